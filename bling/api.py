@@ -1,20 +1,11 @@
-import logging
-from typing import Any, Dict
+import time
 
-from flask import Blueprint, request
+from flask import Blueprint, g, jsonify, request
 
-from bling.helpscout.mailboxes import MAILBOXES_BY_ID, MAILBOXES_BY_TWILIO_PHONE
-
-from bling.clients import (
-    twilio_transport,
-    incoming_message_handler,
-    outgoing_reply_handler,
-    transport_for_type,
-)
-
-from bling.transport import IncomingMesage
-from bling.phone import Phone
-from bling.common.utils import nested_get
+from bling import webhooks
+from bling.common import metrics, profiler
+from bling.common.webhook_auth import ops_authorized
+from bling.warmup import warm_up
 from bling.helpscout.webhook import verify_help_scout_signature
 
 from bling.twi.webhook import validate_twilio_request
@@ -22,24 +13,32 @@ from bling.twi.webhook import validate_twilio_request
 mod = Blueprint("bling", __name__)
 
 
-def twilio_empty_response():
-    return "<Response></Response>", 200
-
-
-def helpscout_empty_response():
-    return "", 204
-
+@mod.before_request
+def start_timer():
+    g.bling_request_start = time.perf_counter()
+    g.bling_profiler = profiler.start_if_requested(
+        request.path, request.headers.get(profiler.PROFILE_HEADER)
+    )
 
-def format_twilio_sms(payload: Dict[str, Any]) -> str:
-    body = payload.get("Body") or "(empty message)"
 
-    for i in range(int(payload.get("NumMedia", "0"))):
-        content_type = payload.get(f"MediaContentType{i}", "unknown type")
-        url = payload.get(f"MediaUrl{i}", "(missing URL)")
+@mod.after_request
+def record_request(response):
+    start = g.get("bling_request_start")
+    if start is not None:
+        metrics.record_request(
+            request.path,
+            response.status_code,
+            time.perf_counter() - start,
+            request.content_length or 0,
+        )
+    return response
 
-        body += f"\nAttachment ({content_type}): {url}"
 
-    return body
+@mod.teardown_request
+def finish_profile(exc):
+    running = g.pop("bling_profiler", None)
+    if running is not None:
+        profiler.finish(running, request.path)
 
 
 @mod.route("/", methods=["GET"])
@@ -47,31 +46,35 @@ def hello():
     return "Hello from Bling!", 200
 
 
+@mod.route("/warmup", methods=["GET", "POST"])
+def warmup():
+    """
+    Primes Help Scout and Twilio auth and connections, lazy imports and the
+    mailbox config, and reports how long each step took
+    """
+    if not ops_authorized(request.headers.get("Authorization")):
+        return "Unauthorized", 401
+    return jsonify(warm_up()), 200
+
+
+@mod.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    This process's request, webhook and upstream API metrics, in the
+    Prometheus text format
+    """
+    if not ops_authorized(request.headers.get("Authorization")):
+        return "Unauthorized", 401
+    return metrics.render_prometheus(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
 @mod.route("/twilio_sms", methods=["POST"])
 @validate_twilio_request
 def twilio_sms():
     """
     Target for incoming SMSes from Twilio
     """
-    data = request.form
-
-    to_phone_twilio = data["To"]
-    if to_phone_twilio not in MAILBOXES_BY_TWILIO_PHONE:
-        # This will happen if you create a new phone number in Twilio and point
-        # it to Bling, but don't configure Bling to handle that phone number.
-        logging.warning(f"Bling got an SMS to an unknown phone: {to_phone_twilio}")
-        return twilio_empty_response()
-
-    mailbox = MAILBOXES_BY_TWILIO_PHONE[to_phone_twilio]
-    from_phone = Phone.parse(data["From"])
-    handler = incoming_message_handler(twilio_transport())
-
-    handler.handle_message(
-        IncomingMesage(
-            mailbox=mailbox, from_phone=from_phone, body=format_twilio_sms(data)
-        )
-    )
-    return twilio_empty_response()
+    return webhooks.handle_twilio_sms(request.form)
 
 
 @mod.route("/twilio_voicemail", methods=["POST"])
@@ -80,25 +83,7 @@ def twilio_voicemail():
     """
     Target for incoming voicemail from Twilio
     """
-
-    data = request.form
-
-    to_phone_twilio = data["to"]
-    if to_phone_twilio not in MAILBOXES_BY_TWILIO_PHONE:
-        logging.warning(f"Bling got a voicemail to an unknown phone: {to_phone_twilio}")
-        return twilio_empty_response()
-
-    mailbox = MAILBOXES_BY_TWILIO_PHONE[to_phone_twilio]
-    from_phone = Phone.parse(data["from"])
-
-    length = int(data.get("length") or 0)
-
-    body = f"Caller left a voicemail ({length} seconds): {data['recording']}\n"
-
-    incoming_message_handler(twilio_transport()).handle_message(
-        IncomingMesage(mailbox=mailbox, from_phone=from_phone, body=body)
-    )
-    return twilio_empty_response()
+    return webhooks.handle_twilio_voicemail(request.form)
 
 
 @mod.route("/twilio_transcription", methods=["POST"])
@@ -107,29 +92,7 @@ def twilio_transcription():
     """
     Target for incoming transcriptions from Twilio
     """
-
-    data = request.form
-
-    to_phone_twilio = data["To"]
-    if to_phone_twilio not in MAILBOXES_BY_TWILIO_PHONE:
-        logging.warning(
-            f"Bling got a transcription to an unknown phone: {to_phone_twilio}"
-        )
-        return twilio_empty_response()
-
-    mailbox = MAILBOXES_BY_TWILIO_PHONE[to_phone_twilio]
-    from_phone = Phone.parse(data["From"])
-
-    status = data["TranscriptionStatus"]
-    if status == "failed":
-        body = f"Voicemail transcription failed, please listen to the recording: {data['RecordingUrl']}"
-    else:
-        body = f"Voicemail transcription: {data['TranscriptionText']}\n\nRecording: {data['RecordingUrl']}"
-
-    incoming_message_handler(twilio_transport()).handle_message(
-        IncomingMesage(mailbox=mailbox, from_phone=from_phone, body=body)
-    )
-    return twilio_empty_response()
+    return webhooks.handle_twilio_transcription(request.form)
 
 
 @mod.route("/helpscout_webhook", methods=["POST"])
@@ -139,22 +102,6 @@ def helpscout_webhook():
     Method called by Help Scout webhooks
     See: https://developer.helpscout.com/webhooks/
     """
-    data = request.get_json()
-    event_type = request.headers.get("X-HelpScout-Event")
-    if not event_type:
-        return "Bad request: missing event header", 400
-
-    event_type = event_type.strip()
-    mailbox_id = nested_get(data, "mailbox", "id")
-
-    logging.info(
-        "Received webhook with event_type %s, mailbox: %s", event_type, mailbox_id
+    return webhooks.handle_helpscout_webhook(
+        request.get_data(as_text=False), request.headers.get("X-HelpScout-Event")
     )
-
-    mailbox = MAILBOXES_BY_ID.get(mailbox_id)
-    if mailbox:
-        outgoing_reply_handler(
-            transport_for_type(mailbox.transport_type)
-        ).handle_outgoing_reply(mailbox, data)
-
-    return "", 204
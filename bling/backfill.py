@@ -0,0 +1,402 @@
+"""
+Backfill a hotline number's SMS history into its Help Scout mailbox, e.g.
+when onboarding a number that was already in use.
+
+    python -m bling.backfill --mailbox-phone +16173973198
+        [--input history.csv | --since 2020-01-01 --until 2020-06-01]
+        [--status closed] [--concurrency 4] [--checkpoint backfill.json]
+        [--dry-run] [--json]
+
+Messages come from Twilio's message log for the number, or from a CSV (like
+the Twilio console's export) or JSON lines file with from, to, body and
+date_sent (or sentdate) fields, plus an optional sid.
+
+Each supporter's messages are imported in date order as conversations of
+up to CONVERSATION_LENGTH threads, one API call per conversation rather
+than one per message. That's below the MAX_CONVERSATION_LENGTH that
+bling/incoming.py stops adding to a conversation at, so new texts from the
+supporter still join their imported conversation. Imported conversations
+don't notify anyone or send auto replies. Conversations are created
+concurrently, within HELPSCOUT_REQUESTS_PER_MINUTE if that's set. With
+--checkpoint, each imported message is recorded by its sid, and a rerun
+leaves those out before splitting what's left into conversations, so a
+rerun with a different --since or --input doesn't import anything twice.
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import requests
+from dateutil import parser as date_parser
+
+from bling.common.resilience import UpstreamUnavailable
+from bling.helpscout.client import (
+    Conversation,
+    HelpScoutClient,
+    NewCustomer,
+    Thread,
+    ThreadType,
+)
+from bling.helpscout.mailboxes import Mailbox
+from bling.incoming import MAX_CONVERSATION_LENGTH
+from bling.phone import Phone
+
+# Room for the supporter's next few texts, which bling/incoming.py adds to
+# their latest conversation until it's MAX_CONVERSATION_LENGTH long
+CONVERSATION_LENGTH = MAX_CONVERSATION_LENGTH - 10
+
+
+@dataclass
+class HistoricalMessage:
+    from_phone: str
+    to_phone: str
+    body: str
+    sent_at: datetime
+    sid: str = ""
+
+    @property
+    def key(self) -> str:
+        """What the checkpoint knows the message by"""
+        return self.sid or f"{self.from_phone}>{self.to_phone}@{self.sent_at}"
+
+
+def _field(row: Dict[str, str], *names: str) -> str:
+    lowered = {k.lower().replace("_", ""): v for k, v in row.items() if k}
+    for name in names:
+        value = lowered.get(name)
+        if value:
+            return value
+    return ""
+
+
+def _parse_time(value) -> datetime:
+    sent_at = value if isinstance(value, datetime) else date_parser.parse(value)
+    if sent_at.tzinfo is None:
+        sent_at = sent_at.replace(tzinfo=timezone.utc)
+    return sent_at
+
+
+def load_messages_file(path: str) -> Iterator[HistoricalMessage]:
+    """Messages from a CSV or JSON lines file"""
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows: Iterable[Dict[str, str]] = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            sent = _field(row, "datesent", "sentdate", "datecreated", "createdat")
+            if not sent:
+                continue
+            yield HistoricalMessage(
+                from_phone=_field(row, "from"),
+                to_phone=_field(row, "to"),
+                body=_field(row, "body"),
+                sent_at=_parse_time(sent),
+                sid=_field(row, "sid", "messagesid"),
+            )
+
+
+def twilio_messages(
+    client,
+    mailbox_phone: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[HistoricalMessage]:
+    """Messages to and from the number in Twilio's message log"""
+    # Twilio formats these without their time zone
+    since = since.astimezone(timezone.utc) if since else None
+    until = until.astimezone(timezone.utc) if until else None
+    for direction in ("to", "from_"):
+        for message in client.messages.stream(
+            date_sent_after=since,
+            date_sent_before=until,
+            page_size=1000,
+            **{direction: mailbox_phone},
+        ):
+            if message.date_sent is None:
+                continue
+            yield HistoricalMessage(
+                from_phone=message.from_,
+                to_phone=message.to,
+                body=message.body or "",
+                sent_at=_parse_time(message.date_sent),
+                sid=message.sid,
+            )
+
+
+@dataclass
+class Backlog:
+    """One conversation's worth of a supporter's messages"""
+
+    supporter: Phone
+    messages: List[HistoricalMessage] = field(default_factory=list)
+    # For each message, whether the supporter sent it
+    inbound: List[bool] = field(default_factory=list)
+
+
+def group_by_supporter(
+    messages: Iterable[HistoricalMessage], mailbox_phone: str
+) -> List[Backlog]:
+    """Split each supporter's messages, oldest first, into conversations"""
+    by_supporter: Dict[str, List[HistoricalMessage]] = {}
+    seen: Set[str] = set()
+    for message in messages:
+        if message.sid:
+            if message.sid in seen:
+                continue
+            seen.add(message.sid)
+        if message.to_phone == mailbox_phone:
+            supporter = message.from_phone
+        elif message.from_phone == mailbox_phone:
+            supporter = message.to_phone
+        else:
+            continue
+        by_supporter.setdefault(supporter, []).append(message)
+
+    backlogs = []
+    for supporter, history in sorted(by_supporter.items()):
+        try:
+            phone = Phone.parse(supporter)
+        except Exception:
+            logging.warning("Skipping messages with unparseable number %s", supporter)
+            continue
+        history.sort(key=lambda m: m.sent_at)
+        for start in range(0, len(history), CONVERSATION_LENGTH):
+            chunk = history[start : start + CONVERSATION_LENGTH]
+            backlogs.append(
+                Backlog(phone, chunk, [m.from_phone == supporter for m in chunk])
+            )
+    return backlogs
+
+
+def build_conversation(backlog: Backlog, mailbox: Mailbox, status: str) -> Conversation:
+    phone = backlog.supporter
+    customer = NewCustomer(
+        email=phone.blackhole_email,
+        phone=phone.helpscout_format,
+        firstName=phone.helpscout_format,
+    )
+    threads = []
+    for message, inbound in zip(backlog.messages, backlog.inbound):
+        created_at = message.sent_at.astimezone(timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+        if inbound:
+            threads.append(
+                Thread(
+                    customer=customer,
+                    type=ThreadType.CUSTOMER,
+                    text=message.body,
+                    imported=True,
+                    createdAt=created_at,
+                )
+            )
+        else:
+            # Like the notes bling/outgoing.py adds for replies
+            threads.append(
+                Thread(
+                    customer=NewCustomer(email=phone.blackhole_email),
+                    type=ThreadType.PHONE,
+                    text=f"SMS reply sent: {message.body}",
+                    imported=True,
+                    createdAt=created_at,
+                )
+            )
+    return Conversation(
+        subject=f"Request from {phone.helpscout_format}",
+        customer=customer,
+        mailboxId=mailbox.id,
+        threads=threads,
+        status=status,
+        imported=True,
+    )
+
+
+@dataclass
+class BackfillReport:
+    messages: int = 0
+    conversations: int = 0
+    failed: int = 0
+    # Messages already imported according to the checkpoint
+    skipped: int = 0
+    elapsed: float = 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "messages": self.messages,
+            "conversations": self.conversations,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed": round(self.elapsed, 2),
+            "messages_per_second": round(
+                self.messages / self.elapsed if self.elapsed else 0.0, 2
+            ),
+        }
+
+
+class Checkpoint:
+    """The conversation each imported message went into, by message key,
+    saved after each conversation"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.messages: Dict[str, int] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if "messages" not in data:
+                raise ValueError(
+                    f"{path} is a checkpoint from an older version of the "
+                    "backfill, which can't be resumed"
+                )
+            self.messages = data["messages"]
+
+    def add(self, backlog: Backlog, conversation_id: int):
+        for message in backlog.messages:
+            self.messages[message.key] = conversation_id
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"messages": self.messages}, f)
+        os.replace(tmp, self.path)
+
+
+def backfill(
+    client: HelpScoutClient,
+    mailbox: Mailbox,
+    messages: Iterable[HistoricalMessage],
+    checkpoint: Checkpoint,
+    status: str = "closed",
+    concurrency: int = 4,
+    dry_run: bool = False,
+) -> BackfillReport:
+    report = BackfillReport()
+    start = time.perf_counter()
+
+    def unseen(messages: Iterable[HistoricalMessage]):
+        for message in messages:
+            if message.key in checkpoint.messages:
+                report.skipped += 1
+            else:
+                yield message
+
+    backlogs = group_by_supporter(unseen(messages), mailbox.phone.twilio_format)
+
+    def create(backlog: Backlog) -> int:
+        res = client.create_conversation(build_conversation(backlog, mailbox, status))
+        return int(res.headers["Resource-ID"])
+
+    if dry_run:
+        report.conversations = len(backlogs)
+        report.messages = sum(len(b.messages) for b in backlogs)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(create, b): b for b in backlogs}
+            recorded: Set[Future] = set()
+
+            def record(future: Future):
+                recorded.add(future)
+                backlog = futures[future]
+                try:
+                    conversation_id = future.result()
+                except (requests.RequestException, UpstreamUnavailable) as e:
+                    logging.warning(
+                        "Failed to import %s messages from %s: %s",
+                        len(backlog.messages),
+                        backlog.supporter.helpscout_format,
+                        e,
+                    )
+                    report.failed += 1
+                    return
+                checkpoint.add(backlog, conversation_id)
+                report.conversations += 1
+                report.messages += len(backlog.messages)
+
+            try:
+                for future in as_completed(futures):
+                    record(future)
+            finally:
+                # If we're stopping early, don't start any more, but record
+                # the ones already running, or a rerun would import them again
+                running = [f for f in futures if f not in recorded and not f.cancel()]
+                for future in running:
+                    with contextlib.suppress(Exception):
+                        record(future)
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--mailbox-phone", required=True, help="the hotline number")
+    parser.add_argument("--input", help="CSV or JSONL file instead of Twilio's log")
+    parser.add_argument("--since", type=_parse_time, help="Twilio messages sent after")
+    parser.add_argument("--until", type=_parse_time, help="and before")
+    parser.add_argument("--status", default="closed", help="for the conversations")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--checkpoint", help="file to save and resume progress in")
+    parser.add_argument("--dry-run", action="store_true", help="count, don't import")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from bling.clients import helpscout_client, twilio_client
+    from bling.helpscout import mailboxes
+
+    args = parse_args(argv)
+    mailbox = mailboxes.registry.by_twilio_phone(
+        Phone.parse(args.mailbox_phone).twilio_format
+    )
+    if mailbox is None:
+        raise SystemExit(f"No mailbox is configured for {args.mailbox_phone}")
+
+    if args.input:
+        messages: Iterable[HistoricalMessage] = load_messages_file(args.input)
+    else:
+        messages = twilio_messages(
+            twilio_client(), mailbox.phone.twilio_format, args.since, args.until
+        )
+
+    try:
+        checkpoint = Checkpoint(args.checkpoint)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    report = backfill(
+        helpscout_client(),
+        mailbox,
+        messages,
+        checkpoint,
+        status=args.status,
+        concurrency=args.concurrency,
+        dry_run=args.dry_run,
+    )
+
+    if args.json:
+        print(json.dumps(report.as_dict(), indent=2))
+        return
+    verb = "Would import" if args.dry_run else "Imported"
+    print(
+        f"{verb} {report.messages} messages as {report.conversations} "
+        f"conversations in {report.elapsed:.1f}s, {report.failed} failed, "
+        f"{report.skipped} already imported"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from bling import backfill
+from bling.bench.fakes import FakeHelpScout
+from bling.common.resilience import CircuitOpenError
+from bling.helpscout.client import HelpScoutClient, ThreadType
+from bling.helpscout.mailboxes import Mailbox
+from bling.phone import Phone
+
+HOTLINE = "+16175550100"
+MAILBOX = Mailbox(
+    transport_type="twilio", phone=Phone.parse(HOTLINE), id=1, mc_campaign_id=""
+)
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def history(supporter, count, offset=0):
+    return [
+        backfill.HistoricalMessage(
+            from_phone=supporter if i % 2 == 0 else HOTLINE,
+            to_phone=HOTLINE if i % 2 == 0 else supporter,
+            body=f"Message {i}",
+            sent_at=START + timedelta(minutes=i),
+            sid=f"SM{supporter}{i:04}",
+        )
+        for i in range(offset, count)
+    ]
+
+
+def test_groups_by_supporter_in_order_within_the_cap():
+    messages = history("+16175552000", 100)[::-1] + history("+16175553000", 3)
+    messages.append(
+        backfill.HistoricalMessage("+16175554000", "+16175555000", "Other", START)
+    )
+    messages.append(messages[0])
+
+    backlogs = backfill.group_by_supporter(messages, HOTLINE)
+
+    assert [len(b.messages) for b in backlogs] == [backfill.CONVERSATION_LENGTH, 20, 3]
+    first = backlogs[0]
+    assert first.messages[0].body == "Message 0"
+    assert first.inbound[:2] == [True, False]
+
+    conversation = backfill.build_conversation(first, MAILBOX, "closed")
+    assert conversation.imported
+    assert conversation.threads[0].type == ThreadType.CUSTOMER
+    assert conversation.threads[0].createdAt == "2020-01-01T00:00:00Z"
+    assert conversation.threads[1].type == ThreadType.PHONE
+    assert conversation.threads[1].text == "SMS reply sent: Message 1"
+
+
+def test_loads_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / "history.csv"
+    csv_path.write_text(
+        "From,To,Body,Status,SentDate,Direction\n"
+        f"+16175552000,{HOTLINE},Hello,received,2020-01-01 10:00:00,inbound\n"
+    )
+    jsonl_path = tmp_path / "history.jsonl"
+    jsonl_path.write_text(
+        json.dumps(
+            {
+                "sid": "SM1",
+                "from": HOTLINE,
+                "to": "+16175552000",
+                "body": "Hi",
+                "date_sent": "2020-01-01T10:05:00Z",
+            }
+        )
+        + "\n"
+    )
+
+    [received] = backfill.load_messages_file(str(csv_path))
+    [sent] = backfill.load_messages_file(str(jsonl_path))
+    assert received.body == "Hello"
+    assert received.sent_at == datetime(2020, 1, 1, 10, tzinfo=timezone.utc)
+    assert sent.sid == "SM1"
+    assert sent.to_phone == "+16175552000"
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+def test_backfill_creates_conversations_and_resumes(helpscout, tmp_path):
+    client = HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s")
+    messages = history("+16175552000", 95) + history("+16175553000", 4)
+    path = str(tmp_path / "backfill.json")
+
+    # Only the first supporter's history so far
+    report = backfill.backfill(
+        client, MAILBOX, messages[:95], backfill.Checkpoint(path)
+    )
+    assert (report.conversations, report.messages) == (2, 95)
+    assert helpscout.requests["POST /v2/conversations"] == 2
+
+    report = backfill.backfill(client, MAILBOX, messages, backfill.Checkpoint(path))
+    assert (report.conversations, report.skipped) == (1, 95)
+    assert helpscout.requests["POST /v2/conversations"] == 3
+    assert sorted(len(c.threads) for c in helpscout.conversations.values()) == [
+        4,
+        15,
+        backfill.CONVERSATION_LENGTH,
+    ]
+
+    dry_run = backfill.backfill(
+        client, MAILBOX, messages, backfill.Checkpoint(None), dry_run=True
+    )
+    assert dry_run.conversations == 3
+    assert helpscout.requests["POST /v2/conversations"] == 3
+
+
+def test_rerun_with_a_different_window_imports_nothing_twice(helpscout, tmp_path):
+    client = HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s")
+    messages = history("+16175552000", 100)
+    path = str(tmp_path / "backfill.json")
+
+    # A window that starts partway through, so the chunks start elsewhere
+    backfill.backfill(client, MAILBOX, messages[30:], backfill.Checkpoint(path))
+    report = backfill.backfill(client, MAILBOX, messages, backfill.Checkpoint(path))
+
+    assert (report.messages, report.skipped) == (30, 70)
+    threads = sorted(
+        t["body"] for c in helpscout.conversations.values() for t in c.threads
+    )
+    assert len(threads) == len(set(threads)) == 100
+
+    with open(path, "w") as f:
+        json.dump({"done": {}}, f)
+    with pytest.raises(ValueError):
+        backfill.Checkpoint(path)
+
+
+def test_backfill_records_what_it_imported_when_help_scout_goes_down(
+    helpscout, tmp_path
+):
+    client = HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s")
+    create = client.create_conversation
+    calls = []
+
+    def flaky_create(conversation, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise CircuitOpenError("helpscout")
+        return create(conversation, **kwargs)
+
+    client.create_conversation = flaky_create
+    messages = sum((history(f"+1617555{n}000", 3) for n in range(3)), [])
+    path = str(tmp_path / "backfill.json")
+
+    report = backfill.backfill(
+        client, MAILBOX, messages, backfill.Checkpoint(path), concurrency=1
+    )
+    assert (report.conversations, report.failed) == (2, 1)
+    assert len(backfill.Checkpoint(path).messages) == 6
@@ -0,0 +1,112 @@
+"""
+Cold-start benchmark: how long does a fresh interpreter take to import the app?
+
+    python -m bling.bench.cold_start [--module app] [--runs 7] [--budget-ms 250]
+
+Imports the module in fresh subprocesses with `python -X importtime`,
+reports the median import time and the slowest imports, and exits non-zero
+if the median is over budget or if any module that should only be imported
+on the code paths that use it was imported at startup.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_BUDGET_MS = 250
+
+# Heavy dependencies that should only be imported by the requests that need them
+LAZY_MODULES = [
+    "requests",
+    "twilio",
+    "lxml",
+    "phonenumbers",
+    "dateutil",
+    "xmltodict",
+    "bling.mc.client",
+    "bling.helpscout.client",
+]
+
+
+def _run(args: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable] + args,
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_times(module: str) -> Tuple[int, Dict[str, int]]:
+    """
+    Import a module in a fresh interpreter. Returns the module's cumulative
+    import time and the cumulative time of everything it imported, in
+    microseconds.
+    """
+    result = _run(["-X", "importtime", "-c", f"import {module}"])
+    total = 0
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, us, name = line.split("|")
+        package = name.strip()
+        cumulative[package] = max(cumulative.get(package, 0), int(us))
+        if name.rstrip() == f" {module}":
+            total = int(us)
+    return total, cumulative
+
+
+def lazy_modules_imported(module: str) -> List[str]:
+    """Which of the LAZY_MODULES get imported along with a module"""
+    result = _run(
+        [
+            "-c",
+            f"import sys, {module}; "
+            f"print('\\n'.join(m for m in {LAZY_MODULES!r} if m in sys.modules))",
+        ]
+    )
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    median_ms = statistics.median(total for total, _ in runs) / 1000
+    _, slowest = runs[len(runs) // 2]
+
+    print(f"import {args.module}: median {median_ms:.1f} ms over {args.runs} runs")
+    print("\nSlowest imports (cumulative, one run):")
+    for name, us in sorted(slowest.items(), key=lambda i: -i[1])[: args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failed = False
+
+    eager = lazy_modules_imported(args.module)
+    if eager:
+        print(f"\nFAIL: imported at startup but should be lazy: {', '.join(eager)}")
+        failed = True
+
+    if median_ms > args.budget_ms:
+        print(f"\nFAIL: {median_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+
+    if not failed:
+        print(f"\nOK: within the {args.budget_ms:.0f} ms budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from bling.bench.cold_start import import_times, lazy_modules_imported
+
+
+def test_heavy_dependencies_are_lazy():
+    assert lazy_modules_imported("app") == []
+
+
+def test_import_times():
+    total, cumulative = import_times("bling.sms_encoding")
+    assert total > 0
+    assert "bling.sms_encoding" in cumulative
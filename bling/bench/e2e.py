@@ -0,0 +1,252 @@
+"""
+End-to-end benchmark: drive app.app through the real routes, with Help Scout
+and Twilio replaced by the fake servers in bling/bench/fakes.py, and report
+latency percentiles and throughput for each flow.
+
+    python -m bling.bench.e2e [--requests 200] [--concurrency 4]
+        [--latency-ms 20] [--rate-429 0.01] [--rate-5xx 0] [--threads 10]
+        [--flows sms,voicemail,transcription,agent_reply] [--json]
+
+Requests are signed like the real ones and go through the whole Flask
+stack, signature checks included; the upstream calls go over HTTP to the
+fakes, so connection pooling, JSON encoding and retries are all measured.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from bling.bench.fakes import FakeHelpScout, FakeTwilio
+from bling.bench.stats import Results, format_table
+
+MAILBOX_ID = 1001
+MAILBOX_PHONE = "+16175550100"
+BASE_URL = "http://localhost"
+
+# (path, form or raw body, headers)
+BenchRequest = Tuple[str, Any, Dict[str, str]]
+
+
+def supporter_phone(i: int, supporters: int) -> str:
+    return f"+1617555{2000 + i % supporters:04}"
+
+
+def configure_environment(helpscout: FakeHelpScout, twilio: FakeTwilio):
+    """Point Bling at the fakes. Has to happen before bling.config is read."""
+    os.environ.update(
+        {
+            "HELPSCOUT_BASE_URL": helpscout.url,
+            "HELPSCOUT_API_CLIENT_ID": "bench",
+            "HELPSCOUT_API_CLIENT_SECRET": "bench",
+            "HELPSCOUT_WEBHOOK_SECRET": "bench-secret",
+            "TWILIO_BASE_URL": twilio.url,
+            "TWILIO_ACCOUNT_SID": "AC" + "0" * 32,
+            "TWILIO_AUTH_TOKEN": "bench-token",
+            "BLING_MAILBOXES": f"twilio:{MAILBOX_PHONE}:{MAILBOX_ID}",
+        }
+    )
+    os.environ.pop("BLING_MAILBOXES_FILE", None)
+
+
+class Flows:
+    """Builds the signed requests for each flow"""
+
+    def __init__(self, helpscout: FakeHelpScout, supporters: int, threads: int):
+        from bling.common.webhook_auth import helpscout_validator, twilio_validator
+
+        self.twilio = twilio_validator()
+        self.helpscout = helpscout_validator()
+        self.supporters = supporters
+        self.threads = threads
+        self._run = f"{time.time():.0f}"
+
+        # Agent replies need conversations to reply to
+        self.conversations = [
+            helpscout.add_conversation(
+                MAILBOX_ID, f"supporter{i}@bench.invalid", threads=threads
+            ).id
+            for i in range(supporters)
+        ]
+
+    def _twilio(self, path: str, params: Dict[str, str]) -> BenchRequest:
+        signature = self.twilio.sign(BASE_URL + path, params)
+        return path, params, {"X-Twilio-Signature": signature}
+
+    def sms(self, i: int) -> BenchRequest:
+        return self._twilio(
+            "/bling/twilio_sms",
+            {
+                "From": supporter_phone(i, self.supporters),
+                "To": MAILBOX_PHONE,
+                "Body": f"Benchmark message {i}",
+                "MessageSid": f"SM{self._run}{i:012}",
+                "NumMedia": "0",
+            },
+        )
+
+    def voicemail(self, i: int) -> BenchRequest:
+        return self._twilio(
+            "/bling/twilio_voicemail",
+            {
+                "from": supporter_phone(i, self.supporters),
+                "to": MAILBOX_PHONE,
+                "length": "12",
+                "recording": f"https://api.twilio.com/recordings/RE{self._run}{i}",
+            },
+        )
+
+    def transcription(self, i: int) -> BenchRequest:
+        return self._twilio(
+            "/bling/twilio_transcription",
+            {
+                "From": supporter_phone(i, self.supporters),
+                "To": MAILBOX_PHONE,
+                "TranscriptionStatus": "completed",
+                "TranscriptionText": f"Please call me back about event {i}",
+                "RecordingUrl": f"https://api.twilio.com/recordings/RE{self._run}{i}",
+            },
+        )
+
+    def agent_reply(self, i: int) -> BenchRequest:
+        supporter = i % self.supporters
+        threads = [
+            {
+                "id": i * 1000 + n,
+                "type": "customer",
+                "createdAt": f"2020-01-01T00:{n // 60 % 60:02}:{n % 60:02}Z",
+                "body": f"Earlier message {n} " * 10,
+                "source": {"type": "SMS", "via": "customer"},
+            }
+            for n in range(self.threads)
+        ]
+        threads.append(
+            {
+                "id": i * 1000 + self.threads,
+                "type": "message",
+                "createdAt": "2020-01-02T00:00:00Z",
+                "body": f"<p>Thanks for writing in! Reply {i}</p>",
+                "source": {"type": "web", "via": "user"},
+            }
+        )
+        body = json.dumps(
+            {
+                "id": self.conversations[supporter],
+                "type": "phone",
+                "mailbox": {"id": MAILBOX_ID},
+                "customer": {"phone": supporter_phone(i, self.supporters)},
+                "threads": threads,
+            }
+        ).encode("utf-8")
+        return (
+            "/bling/helpscout_webhook",
+            body,
+            {
+                "X-HelpScout-Signature": self.helpscout.sign(body),
+                "X-HelpScout-Event": "convo.agent.reply.created",
+                "Content-Type": "application/json",
+            },
+        )
+
+
+def run_flow(
+    app,
+    name: str,
+    build: Callable[[int], BenchRequest],
+    indexes: range,
+    concurrency: int,
+) -> Results:
+    local = threading.local()
+
+    def send(i: int) -> Tuple[float, int]:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        path, data, headers = build(i)
+        start = time.perf_counter()
+        response = client.post(path, data=data, headers=headers)
+        return time.perf_counter() - start, response.status_code
+
+    results = Results(name)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for seconds, status in pool.map(send, indexes):
+            results.record(seconds, status)
+    results.elapsed = time.perf_counter() - start
+    return results
+
+
+FLOW_NAMES = ["sms", "voicemail", "transcription", "agent_reply"]
+
+
+def run(args) -> List[Dict[str, object]]:
+    fault_args = dict(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+    )
+    with FakeHelpScout(
+        seed_threads=args.threads, **fault_args
+    ) as helpscout, FakeTwilio(**fault_args) as twilio:
+        configure_environment(helpscout, twilio)
+
+        import app
+
+        flows = Flows(helpscout, supporters=args.supporters, threads=args.threads)
+        summaries = []
+        for name in args.flows:
+            build = getattr(flows, name)
+            # Warm up connections and lazy imports; not counted. The indexes
+            # differ so the measured requests aren't dropped as replays.
+            warmup = range(args.requests, args.requests + args.warmup)
+            run_flow(app.app, name, build, warmup, 1)
+            results = run_flow(
+                app.app, name, build, range(args.requests), args.concurrency
+            )
+            summaries.append(results.summary())
+        return summaries
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--latency-ms", type=float, default=20, help="latency the fakes add"
+    )
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument(
+        "--threads", type=int, default=10, help="threads per existing conversation"
+    )
+    parser.add_argument("--supporters", type=int, default=50)
+    parser.add_argument(
+        "--flows",
+        type=lambda s: [f.strip() for f in s.split(",") if f.strip()],
+        default=FLOW_NAMES,
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args(argv)
+    unknown = set(args.flows) - set(FLOW_NAMES)
+    if unknown:
+        parser.error(f"Unknown flows: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summaries = run(args)
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        print(format_table(summaries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import json
+import subprocess
+import sys
+
+from bling.bench.cold_start import ROOT
+
+
+def test_e2e_benchmark_runs():
+    # In a subprocess, since it configures Bling through the environment
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "bling.bench.e2e",
+            "--requests",
+            "4",
+            "--warmup",
+            "1",
+            "--latency-ms",
+            "0",
+            "--jitter-ms",
+            "0",
+            "--supporters",
+            "2",
+            "--json",
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    summaries = json.loads(result.stdout)
+
+    assert [s["flow"] for s in summaries] == [
+        "sms",
+        "voicemail",
+        "transcription",
+        "agent_reply",
+    ]
+    for summary in summaries:
+        assert summary["requests"] == 4
+        assert summary["errors"] == 0
+        assert summary["p50_ms"] <= summary["p99_ms"]
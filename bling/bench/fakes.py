@@ -0,0 +1,518 @@
+"""
+In-process stand-ins for the Help Scout and Twilio APIs, for benchmarks and
+tests that should exercise the real HTTP stack (requests, connection pools,
+JSON encoding) without talking to the real services.
+
+Each server runs on a random localhost port in a background thread and can
+be told to add latency and to fail a fraction of requests with a 429 or a
+5xx.
+
+    with FakeHelpScout(latency=0.05, rate_429=0.01) as helpscout:
+        client = HelpScoutClient(base_url=helpscout.url, client_id="x", secret="y")
+"""
+
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from dateutil.parser import isoparse
+
+Handler = Callable[["FakeRequest"], Tuple[int, Any, Dict[str, str]]]
+
+
+@dataclass
+class FakeRequest:
+    method: str
+    path: str
+    query: Dict[str, str]
+    body: bytes
+    headers: Dict[str, str]
+    match: Any = None
+
+    def json(self) -> Any:
+        return json.loads(self.body or b"null")
+
+    def form(self) -> Dict[str, str]:
+        return {k: v[-1] for k, v in parse_qs(self.body.decode("utf-8")).items()}
+
+
+@dataclass
+class Faults:
+    """Latency and error injection, shared by all of a server's routes"""
+
+    # Seconds added to every response, plus up to `jitter` more at random
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Fraction of requests answered with a 429 / a 503
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    # Retry-After we send with a 429, in seconds
+    retry_after: int = 0
+
+
+class FakeServer:
+    """A threaded HTTP server that dispatches to regex routes"""
+
+    def __init__(self, faults: Optional[Faults] = None, **fault_args):
+        self.faults = faults or Faults(**fault_args)
+        self.requests: Counter = Counter()
+        self.responses: Counter = Counter()
+        self._routes: List[Tuple[str, "re.Pattern", Handler]] = []
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def route(self, method: str, pattern: str, handler: Handler):
+        self._routes.append((method, re.compile(pattern + "$"), handler))
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _rate_limit_headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.faults.retry_after)}
+
+    def handle(self, request: FakeRequest) -> Tuple[int, Any, Dict[str, str]]:
+        faults = self.faults
+        if faults.latency or faults.jitter:
+            time.sleep(faults.latency + random.random() * faults.jitter)
+
+        if faults.rate_429 and random.random() < faults.rate_429:
+            return 429, {"message": "Too many requests"}, self._rate_limit_headers()
+        if faults.rate_5xx and random.random() < faults.rate_5xx:
+            return 503, {"message": "Service unavailable"}, {}
+
+        for method, pattern, handler in self._routes:
+            if method != request.method:
+                continue
+            match = pattern.match(request.path)
+            if match:
+                request.match = match
+                return handler(request)
+        return 404, {"message": f"No fake for {request.method} {request.path}"}, {}
+
+    def _handler_class(self):
+        fake = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send each response in one write, so keep-alive clients don't
+            # sit out a delayed ACK between the headers and the body
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def _serve(self):
+                parsed = urlparse(self.path)
+                request = FakeRequest(
+                    method=self.command,
+                    path=parsed.path,
+                    query={k: v[-1] for k, v in parse_qs(parsed.query).items()},
+                    body=self._read_body(),
+                    headers={k.lower(): v for k, v in self.headers.items()},
+                )
+                status, body, headers = fake.handle(request)
+                with fake._lock:
+                    fake.requests[f"{request.method} {request.path}"] += 1
+                    fake.responses[status] += 1
+
+                if isinstance(body, bytes):
+                    data = body
+                else:
+                    data = b"" if body is None else json.dumps(body).encode("utf-8")
+                    headers = {"Content-Type": "application/json", **headers}
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+                    length = int(self.headers.get("Content-Length") or 0)
+                    return self.rfile.read(length) if length else b""
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b"".join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
+
+    def start(self) -> "FakeServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            # Short poll so stopping a fake doesn't hold up a test
+            kwargs={"poll_interval": 0.05},
+            name=type(self).__name__,
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+@dataclass
+class FakeConversation:
+    id: int
+    mailbox_id: int
+    email: str
+    threads: List[Dict[str, Any]] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    status: str = "active"
+    created_at: str = field(
+        default_factory=lambda: time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    )
+    # Microseconds, unlike the real API, so every change shows. Like the
+    # real API, userUpdatedAt doesn't change for customer replies, but
+    # modifiedAt, which the list is filtered and sorted by, does
+    modified_at: str = ""
+    user_updated_at: str = ""
+
+    def as_json(
+        self, embed_threads: bool = False, embed_limit: Optional[int] = None
+    ) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "id": self.id,
+            "type": "phone",
+            "status": self.status,
+            "mailboxId": self.mailbox_id,
+            "threads": len(self.threads),
+            "primaryCustomer": {"email": self.email},
+            "createdAt": self.created_at,
+            "modifiedAt": self.modified_at,
+            "userUpdatedAt": self.user_updated_at,
+            "tags": [{"id": i, "tag": tag} for i, tag in enumerate(self.tags)],
+        }
+        if embed_threads:
+            data["_embedded"] = {"threads": self.threads[:embed_limit]}
+        return data
+
+
+class FakeHelpScout(FakeServer):
+    """
+    The parts of the Help Scout Mailbox API that Bling uses, backed by an
+    in-memory store of conversations.
+
+    `seed_threads` pre-populates conversations found by phone-number email
+    lookups with that many threads, so lookups hit conversations of a
+    realistic size instead of always creating new ones.
+    """
+
+    PAGE_SIZE = 25
+    # Threads returned by embed=threads; more need the threads endpoint
+    EMBED_LIMIT: Optional[int] = None
+
+    def __init__(self, seed_threads: int = 0, **fault_args):
+        super().__init__(**fault_args)
+        self.seed_threads = seed_threads
+        self.conversations: Dict[int, FakeConversation] = {}
+        self._by_email: Dict[str, List[FakeConversation]] = {}
+        # thread id -> attachments, with their data decoded
+        self.attachments: Dict[int, List[Dict[str, Any]]] = {}
+        self._next_id = 1000
+        self._last_update = 0.0
+
+        self.route("POST", r"/v2/oauth2/token", self._token)
+        self.route("GET", r"/v2/conversations", self._list_conversations)
+        self.route("POST", r"/v2/conversations", self._create_conversation)
+        self.route("GET", r"/v2/conversations/(\d+)", self._get_conversation)
+        self.route("PATCH", r"/v2/conversations/(\d+)", self._patch_conversation)
+        self.route("GET", r"/v2/conversations/(\d+)/threads", self._list_threads)
+        self.route(
+            "PATCH", r"/v2/conversations/(\d+)/threads/(\d+)", self._patch_thread
+        )
+        self.route("POST", r"/v2/conversations/(\d+)/(\w+)", self._add_thread)
+        self.route("PUT", r"/v2/conversations/(\d+)/tags", self._put_tags)
+        self.route(
+            "POST",
+            r"/v2/conversations/(\d+)/threads/(\d+)/attachments",
+            self._add_attachment,
+        )
+
+    def _rate_limit_headers(self) -> Dict[str, str]:
+        return {"X-RateLimit-Retry-After": str(self.faults.retry_after)}
+
+    def _new_id(self) -> int:
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def touch(self, conversation: FakeConversation, by_user: bool = True):
+        """Record a change, which by_user=False (a customer reply) leaves out
+        of userUpdatedAt"""
+        with self._lock:
+            now = self._last_update = max(time.time(), self._last_update + 1e-6)
+        conversation.modified_at = (
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now))
+            + f".{int(now % 1 * 1e6):06}Z"
+        )
+        if by_user:
+            conversation.user_updated_at = conversation.modified_at
+
+    def advance_clock(self, seconds: float):
+        """Make the next change happen at least seconds from now"""
+        with self._lock:
+            self._last_update = max(self._last_update, time.time() + seconds)
+
+    def add_conversation(
+        self, mailbox_id: int, email: str, threads: int = 0
+    ) -> FakeConversation:
+        conversation = FakeConversation(
+            id=self._new_id(), mailbox_id=mailbox_id, email=email
+        )
+        for _ in range(threads):
+            conversation.threads.append(self._new_thread("customer", "Seeded message"))
+        self.touch(conversation)
+        with self._lock:
+            self.conversations[conversation.id] = conversation
+            self._by_email.setdefault(email, []).append(conversation)
+        return conversation
+
+    def _new_thread(self, thread_type: str, text: str, **extra) -> Dict[str, Any]:
+        return {
+            "id": self._new_id(),
+            "type": thread_type,
+            "body": text,
+            "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            **extra,
+        }
+
+    def _conversation(self, request: FakeRequest) -> Optional[FakeConversation]:
+        return self.conversations.get(int(request.match.group(1)))
+
+    def _token(self, request):
+        return 200, {"access_token": "fake-token", "expires_in": 172800}, {}
+
+    def _list_conversations(self, request):
+        query = request.query.get("query", "")
+        email = re.search(r'email:"([^"]+)"', query)
+        if email:
+            found = self._by_email.get(email.group(1), [])
+            if not found and self.seed_threads:
+                mailbox = int(request.query.get("mailbox", "0").split(",")[0])
+                self.add_conversation(mailbox, email.group(1), self.seed_threads)
+            # Newest first, like the sortOrder=desc Bling asks for
+            found = list(reversed(self._by_email.get(email.group(1), [])))
+        else:
+            mailbox = request.query.get("mailbox")
+            found = [
+                c
+                for c in self.conversations.values()
+                if mailbox is None or str(c.mailbox_id) == mailbox
+            ]
+            since = request.query.get("modifiedSince")
+            if since:
+                found = [c for c in found if isoparse(c.modified_at) >= isoparse(since)]
+            if request.query.get("sortField") == "modifiedAt":
+                found.sort(
+                    key=lambda c: c.modified_at,
+                    reverse=request.query.get("sortOrder") == "desc",
+                )
+
+        page = int(request.query.get("page", "1"))
+        start = (page - 1) * self.PAGE_SIZE
+        body: Dict[str, Any] = {
+            "_embedded": {
+                "conversations": [
+                    c.as_json() for c in found[start : start + self.PAGE_SIZE]
+                ]
+            },
+            "page": {"number": page, "totalElements": len(found)},
+            "_links": {},
+        }
+        if start + self.PAGE_SIZE < len(found):
+            body["_links"]["next"] = {
+                "href": f"{self.url}{request.path}?"
+                + urlencode({**request.query, "page": page + 1})
+            }
+        return 200, body, {}
+
+    def _create_conversation(self, request):
+        data = request.json()
+        conversation = self.add_conversation(
+            data["mailboxId"], (data.get("customer") or {}).get("email", "")
+        )
+        conversation.tags = list(data.get("tags") or [])
+        for thread in data.get("threads") or []:
+            conversation.threads.append(
+                self._new_thread(thread.get("type", "customer"), thread.get("text", ""))
+            )
+        return 201, None, {"Resource-ID": str(conversation.id)}
+
+    def _get_conversation(self, request):
+        conversation = self._conversation(request)
+        if conversation is None:
+            return 404, {"message": "Not found"}, {}
+        embed = request.query.get("embed") == "threads"
+        return 200, conversation.as_json(embed, self.EMBED_LIMIT), {}
+
+    def _patch_conversation(self, request):
+        conversation = self._conversation(request)
+        if conversation is None:
+            return 404, {"message": "Not found"}, {}
+        data = request.json()
+        if data.get("path") == "/mailboxId":
+            conversation.mailbox_id = int(data["value"])
+        elif data.get("path") == "/status":
+            conversation.status = data["value"]
+        self.touch(conversation)
+        return 204, None, {}
+
+    def _list_threads(self, request):
+        conversation = self._conversation(request)
+        if conversation is None:
+            return 404, {"message": "Not found"}, {}
+        page = int(request.query.get("page", "1"))
+        start = (page - 1) * self.PAGE_SIZE
+        body: Dict[str, Any] = {
+            "_embedded": {
+                "threads": conversation.threads[start : start + self.PAGE_SIZE]
+            },
+            "page": {"number": page, "totalElements": len(conversation.threads)},
+            "_links": {},
+        }
+        if start + self.PAGE_SIZE < len(conversation.threads):
+            body["_links"]["next"] = {
+                "href": f"{self.url}{request.path}?page={page + 1}"
+            }
+        return 200, body, {}
+
+    def _patch_thread(self, request):
+        conversation = self._conversation(request)
+        thread_id = int(request.match.group(2))
+        threads = conversation.threads if conversation else []
+        thread = next((t for t in threads if t["id"] == thread_id), None)
+        if thread is None:
+            return 404, {"message": "Not found"}, {}
+        data = request.json()
+        if data.get("op") == "remove":
+            conversation.threads.remove(thread)
+        elif data.get("path") == "/text":
+            thread["body"] = data["value"]
+        self.touch(conversation)
+        return 204, None, {}
+
+    def _add_thread(self, request):
+        conversation = self._conversation(request)
+        if conversation is None:
+            return 404, {"message": "Not found"}, {}
+        data = request.json()
+        thread = self._new_thread(request.match.group(2), data.get("text", ""))
+        conversation.threads.append(thread)
+        self.touch(conversation, by_user=thread["type"] != "customer")
+        return 201, None, {"Resource-ID": str(thread["id"])}
+
+    def _add_attachment(self, request):
+        conversation = self._conversation(request)
+        thread_id = int(request.match.group(2))
+        if conversation is None or not any(
+            t["id"] == thread_id for t in conversation.threads
+        ):
+            return 404, {"message": "Not found"}, {}
+        data = request.json()
+        attachment_id = self._new_id()
+        self.attachments.setdefault(thread_id, []).append(
+            {
+                "id": attachment_id,
+                "fileName": data["fileName"],
+                "mimeType": data["mimeType"],
+                "data": base64.b64decode(data["data"]),
+            }
+        )
+        return 201, None, {"Resource-ID": str(attachment_id)}
+
+    def _put_tags(self, request):
+        conversation = self._conversation(request)
+        if conversation is None:
+            return 404, {"message": "Not found"}, {}
+        conversation.tags = list(request.json().get("tags") or [])
+        self.touch(conversation)
+        return 204, None, {}
+
+
+class FakeTwilio(FakeServer):
+    """Just enough of the Twilio REST API to send messages and fetch MMS media"""
+
+    def __init__(self, **fault_args):
+        super().__init__(**fault_args)
+        self.messages: List[Dict[str, str]] = []
+        # media sid -> (content type, data)
+        self.media: Dict[str, Tuple[str, bytes]] = {}
+        self.route("GET", r"/2010-04-01/Accounts/(\w+)\.json", self._account)
+        self.route(
+            "POST", r"/2010-04-01/Accounts/(\w+)/Messages\.json", self._create_message
+        )
+        self.route(
+            "GET", r"/2010-04-01/Accounts/\w+/Messages/\w+/Media/(\w+)", self._media
+        )
+
+    def add_media(self, content_type: str, data: bytes) -> str:
+        """Returns the media's URL, as it would appear in an MMS webhook"""
+        with self._lock:
+            sid = f"ME{len(self.media) + 1:032x}"
+            self.media[sid] = (content_type, data)
+        return (
+            f"{self.url}/2010-04-01/Accounts/AC{0:032}/Messages/MM{0:032}/Media/{sid}"
+        )
+
+    def _media(self, request):
+        found = self.media.get(request.match.group(1))
+        if found is None:
+            return 404, {"message": "Not found"}, {}
+        content_type, data = found
+        return 200, data, {"Content-Type": content_type}
+
+    def _account(self, request):
+        sid = request.match.group(1)
+        return 200, {"sid": sid, "status": "active", "friendly_name": "Fake"}, {}
+
+    def _create_message(self, request):
+        form = request.form()
+        with self._lock:
+            self.messages.append(form)
+            sid = f"SM{len(self.messages):032x}"
+        return (
+            201,
+            {
+                "sid": sid,
+                "account_sid": request.match.group(1),
+                "to": form.get("To"),
+                "from": form.get("From"),
+                "messaging_service_sid": form.get("MessagingServiceSid"),
+                "body": form.get("Body"),
+                "status": "queued",
+                "num_segments": "1",
+            },
+            {},
+        )
@@ -0,0 +1,114 @@
+import pytest
+from twilio.rest import Client as TwilioClient
+
+from bling.bench.fakes import FakeHelpScout, FakeTwilio
+from bling.common.resilience import Backoff, RateLimited, Upstream
+from bling.helpscout.client import (
+    Conversation,
+    HelpScoutClient,
+    NewCustomer,
+    Thread,
+    ThreadType,
+)
+from bling.twi.http_client import BaseUrlHttpClient
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+def test_helpscout_conversations(helpscout):
+    client = HelpScoutClient(base_url=helpscout.url, client_id="id", secret="secret")
+    customer = NewCustomer(email="a@example.com", phone="+16175550100")
+    client.create_conversation(
+        Conversation(
+            subject="Hi",
+            customer=customer,
+            mailboxId=1,
+            threads=[
+                Thread(
+                    type=ThreadType.CUSTOMER,
+                    text="hello",
+                    imported=False,
+                    customer=customer,
+                )
+            ],
+        )
+    )
+
+    [found] = client.find_conversations(
+        mailbox_ids=[1], filters={"email": '"a@example.com"'}
+    )
+    assert found["threads"] == 1
+
+    client.add_thread_to_conversation(
+        found["id"], Thread(type=ThreadType.CUSTOMER, text="again", imported=False)
+    )
+    threads = client.get_threads_for_conversation(found["id"]).json()
+    assert [t["body"] for t in threads["_embedded"]["threads"]] == ["hello", "again"]
+    assert client.find_conversations(filters={"email": '"b@example.com"'}) == []
+
+
+def test_helpscout_thread_pagination(helpscout):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=60)
+    client = HelpScoutClient(base_url=helpscout.url, client_id="id", secret="secret")
+
+    pages = list(client._paginate(client.get_threads_for_conversation(conversation.id)))
+    assert [len(p.json()["_embedded"]["threads"]) for p in pages] == [25, 25, 10]
+
+
+def test_helpscout_errors_are_retried(helpscout):
+    client = HelpScoutClient(
+        base_url=helpscout.url,
+        client_id="id",
+        secret="secret",
+        resilience=Upstream("helpscout", backoff=Backoff(base=0.01)),
+    )
+    helpscout.faults.rate_429 = 1.0
+    with pytest.raises(Exception):
+        client.find_conversations()
+    assert helpscout.responses[429] == 3
+
+    helpscout.faults.rate_429 = 0
+    helpscout.faults.rate_5xx = 1.0
+    with pytest.raises(Exception):
+        client.find_conversations()
+    assert helpscout.responses[503] == 3
+
+
+def test_helpscout_rate_limited_calls_can_spill(helpscout):
+    conversation = helpscout.add_conversation(1, "a@example.com")
+    client = HelpScoutClient(
+        base_url=helpscout.url,
+        client_id="id",
+        secret="secret",
+        resilience=Upstream("helpscout", backoff=Backoff(base=0.01)),
+    )
+    helpscout.faults.rate_429 = 1.0
+    with pytest.raises(RateLimited):
+        client.add_thread_to_conversation(
+            conversation.id,
+            Thread(type=ThreadType.CUSTOMER, text="hi", imported=False),
+            spill=True,
+        )
+    # Raised on the first 429 rather than retrying
+    assert helpscout.responses[429] == 1
+    with pytest.raises(RateLimited):
+        client.find_conversations(mailbox_ids=[1], spill=True)
+    assert helpscout.responses[429] == 2
+
+
+def test_twilio_send_message():
+    with FakeTwilio() as twilio:
+        client = TwilioClient(
+            "AC123", "token", http_client=BaseUrlHttpClient(twilio.url)
+        )
+        message = client.messages.create(
+            to="+16175550101", from_="+16175550100", body="hi"
+        )
+        assert message.sid.startswith("SM")
+        assert twilio.messages == [
+            {"To": "+16175550101", "From": "+16175550100", "Body": "hi"}
+        ]
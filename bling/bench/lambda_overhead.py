@@ -0,0 +1,110 @@
+"""
+Compare the per-invocation overhead, import time and dependency footprint of
+the Flask/WSGI entry point (app.py) with the Lambda-native one
+(lambda_handler.py).
+
+    python -m bling.bench.lambda_overhead [--requests 2000]
+
+The request timed is a signed Help Scout webhook for a mailbox we don't
+serve, which is dropped before any upstream call, so what's measured is
+the framework overhead. The WSGI side goes through Flask's test client,
+which stands in for serverless-wsgi translating the event into a WSGI call.
+"""
+
+import argparse
+import os
+import statistics
+import time
+from importlib import metadata
+
+from bling.bench.cold_start import import_times
+
+# Only needed by the Flask entry point
+FLASK_DISTRIBUTIONS = [
+    "flask",
+    "flask-cors",
+    "werkzeug",
+    "jinja2",
+    "click",
+    "itsdangerous",
+    "markupsafe",
+]
+
+BODY = b'{"id": 1, "type": "phone", "mailbox": {"id": 1}, "threads": []}'
+EVENT = "convo.agent.reply.created"
+
+
+def distribution_size(name: str) -> int:
+    try:
+        dist = metadata.distribution(name)
+    except metadata.PackageNotFoundError:
+        return 0
+    return sum(
+        os.path.getsize(dist.locate_file(f))
+        for f in dist.files or []
+        if os.path.exists(dist.locate_file(f))
+    )
+
+
+def _time_per_request(call, n: int) -> float:
+    """Median microseconds per call, over 5 batches"""
+    batches = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(n // 5):
+            call()
+        batches.append((time.perf_counter() - start) / (n // 5))
+    return statistics.median(batches) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("HELPSCOUT_WEBHOOK_SECRET", "bench-secret")
+
+    import app
+    import lambda_handler
+    from bling.common import webhook_auth
+
+    signature = webhook_auth.helpscout_validator().sign(BODY)
+    headers = {"X-HelpScout-Signature": signature, "X-HelpScout-Event": EVENT}
+    event = {
+        "httpMethod": "POST",
+        "path": "/bling/helpscout_webhook",
+        "headers": headers,
+        "requestContext": {"path": "/dev/bling/helpscout_webhook", "stage": "dev"},
+        "body": BODY.decode(),
+    }
+    client = app.app.test_client()
+
+    def wsgi():
+        webhook_auth.helpscout_replay_cache.clear()
+        client.post("/bling/helpscout_webhook", data=BODY, headers=headers)
+
+    def native():
+        webhook_auth.helpscout_replay_cache.clear()
+        lambda_handler.handler(event)
+
+    wsgi_us = _time_per_request(wsgi, args.requests)
+    native_us = _time_per_request(native, args.requests)
+    print("Per invocation (dropped Help Scout webhook):")
+    print(f"  flask/wsgi      {wsgi_us:8.1f} us")
+    print(f"  lambda_handler  {native_us:8.1f} us  ({wsgi_us / native_us:.1f}x faster)")
+
+    app_us, _ = import_times("app")
+    native_import_us, _ = import_times("lambda_handler")
+    print("\nCold import:")
+    print(f"  app             {app_us / 1000:8.1f} ms")
+    print(f"  lambda_handler  {native_import_us / 1000:8.1f} ms")
+
+    sizes = {name: distribution_size(name) for name in FLASK_DISTRIBUTIONS}
+    print("\nDependencies only the Flask entry point needs:")
+    for name, size in sizes.items():
+        print(f"  {name:14}  {size / 1024:8.0f} KiB")
+    print(f"  {'total':14}  {sum(sizes.values()) / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import math
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class Results:
+    """Latencies and status codes for a run of requests"""
+
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    elapsed: float = 0.0
+
+    def record(self, seconds: float, status: int):
+        """Status 0 means the request didn't get a response at all"""
+        self.latencies.append(seconds)
+        self.statuses[status] += 1
+
+    def summary(self) -> Dict[str, object]:
+        latencies = sorted(self.latencies)
+        errors = sum(
+            n for status, n in self.statuses.items() if status >= 400 or status == 0
+        )
+        return {
+            "flow": self.name,
+            "requests": len(latencies),
+            "errors": errors,
+            "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            "rps": round(len(latencies) / self.elapsed, 1) if self.elapsed else 0.0,
+            "statuses": dict(sorted(self.statuses.items())),
+        }
+
+
+def format_table(summaries: List[Dict[str, object]]) -> str:
+    columns = ["flow", "requests", "errors", "p50_ms", "p95_ms", "p99_ms", "rps"]
+    rows = [columns] + [[str(s[c]) for c in columns] for s in summaries]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows
+    )
@@ -1,48 +1,105 @@
-from bling.helpscout.client import HelpScoutClient
-from bling.mc.client import MobileCommonsClient
-from twilio.rest import Client as TwilioClient
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
-from bling.incoming import IncomingHandler
-from bling.outgoing import OutgoingHandler
 from bling.config import config
 
 
 from bling.transport import (
     Transport,
-    TwilioTransport,
-    MobileCommonsTransport,
     TWILIO_TRANSPORT_TYPE,
     MOBILECOMMONS_TRANSPORT_TYPE,
 )
 
+# The API clients pull in requests, twilio, xmltodict, lxml and friends, which
+# is most of our cold start. They're imported where they're built, so a
+# Lambda only pays for the ones the request it's serving actually uses.
+if TYPE_CHECKING:
+    from bling.helpscout.client import HelpScoutClient
+    from bling.incoming import IncomingHandler
+    from bling.mc.client import MobileCommonsClient
+    from bling.outgoing import OutgoingHandler
+    from bling.transport import MobileCommonsTransport, TwilioTransport
+    from twilio.rest import Client as TwilioClient
+
+
+def _session():
+    """
+    A requests session for an API client, going through the record/replay
+    cassette if one is configured
+    """
+    import requests
+
+    from bling.common import cassette
+
+    session = requests.Session()
+    recording = cassette.from_config()
+    if recording is not None:
+        recording.mount(session)
+    return session
+
+
+# API clients are shared for the life of the process (i.e. the Lambda
+# container), so requests reuse the Help Scout OAuth token and the pooled
+# connections, and warming up (see bling/warmup.py) primes them.
+@lru_cache(maxsize=None)
+def helpscout_client() -> "HelpScoutClient":
+    from bling.helpscout.client import HelpScoutClient
 
-def helpscout_client() -> HelpScoutClient:
     return HelpScoutClient(
+        base_url=config.helpscout_base_url,
         client_id=config.helpscout_api_client_id,
         secret=config.helpscout_api_client_secret,
+        session=_session(),
+        requests_per_minute=config.helpscout_requests_per_minute,
+        conversation_cache_size=config.helpscout_conversation_cache_size,
     )
 
 
-def twilio_client() -> TwilioClient:
-    return TwilioClient(config.twilio_account_sid, config.twilio_auth_token)
+@lru_cache(maxsize=None)
+def twilio_client() -> "TwilioClient":
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client as TwilioClient
 
+    from bling.twi.http_client import BaseUrlHttpClient
+
+    if config.twilio_base_url:
+        http_client = BaseUrlHttpClient(config.twilio_base_url)
+    else:
+        http_client = TwilioHttpClient()
+    http_client.session = _session()
+
+    return TwilioClient(
+        config.twilio_account_sid, config.twilio_auth_token, http_client=http_client
+    )
+
+
+def twilio_transport() -> "TwilioTransport":
+    from bling.transport import TwilioTransport
 
-def twilio_transport() -> TwilioTransport:
     return TwilioTransport(twilio_client())
 
 
-def mobilecommons_client() -> MobileCommonsClient:
+@lru_cache(maxsize=None)
+def mobilecommons_client() -> "MobileCommonsClient":
+    from bling.mc.client import MobileCommonsClient
+
     return MobileCommonsClient(
-        config.mobilecommons_username, config.mobilecommons_password
+        config.mobilecommons_username, config.mobilecommons_password, _session()
     )
 
 
-def mobilecommons_transport() -> MobileCommonsTransport:
+def mobilecommons_transport() -> "MobileCommonsTransport":
+    from bling.transport import MobileCommonsTransport
+
     return MobileCommonsTransport(mobilecommons_client())
 
 
-def incoming_message_handler(transport: Transport) -> IncomingHandler:
-    return IncomingHandler(helpscout_client(), transport)
+def incoming_message_handler(transport: Transport) -> "IncomingHandler":
+    from bling.incoming import IncomingHandler
+
+    return IncomingHandler(
+        helpscout_client(), transport, spill_rate_limited=config.spill_rate_limited
+    )
 
 
 def transport_for_type(transport_type: str) -> Transport:
@@ -54,5 +111,7 @@ def transport_for_type(transport_type: str) -> Transport:
         raise Exception(f"'{transport_type}' is not a valid transport type'")
 
 
-def outgoing_reply_handler(transport: Transport) -> OutgoingHandler:
-    return OutgoingHandler(helpscout_client(), transport)
\ No newline at end of file
+def outgoing_reply_handler(transport: Transport) -> "OutgoingHandler":
+    from bling.outgoing import OutgoingHandler
+
+    return OutgoingHandler(helpscout_client(), transport)
@@ -0,0 +1,205 @@
+"""
+Combines a burst of texts from one supporter into a single Help Scout
+thread. People often send a thought as three or four short texts a few
+seconds apart, and handling each on its own means a conversation search
+and a new thread for every one, which uses up the rate limit and the
+conversation's thread budget.
+
+With BLING_COALESCE_SECONDS set, the first text from a supporter to a
+mailbox starts a window of that many seconds. Texts from them that arrive
+during the window join it, and when it closes they go to Help Scout as one
+thread, each line stamped with the time it arrived. The window is never
+extended, so no text waits longer than BLING_COALESCE_SECONDS. Twilio gets
+its response straight away.
+
+Twilio has had its response by the time a burst goes to Help Scout, so
+there's nobody to tell if that fails. A burst Help Scout can't take goes on
+the deferred queue instead (see bling/deferred.py), which means coalescing
+is off unless that's kept in a journal, and so never on Lambda.
+
+Bursts are held in memory, so this only combines texts handled by the same
+process, like the Flask app, which flushes anything pending when it exits
+(e.g. on a deploy; a process that's killed outright still loses them).
+"""
+
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from bling import deferred
+from bling.common import logs, metrics
+from bling.config import config
+from bling.helpscout.mailboxes import Mailbox
+from bling.media import Media
+from bling.phone import Phone
+
+
+@dataclass
+class PendingText:
+    body: str
+    # time.time() when we got it
+    received_at: float
+    media: List[Media] = field(default_factory=list)
+
+
+@dataclass
+class Burst:
+    mailbox: Mailbox
+    from_phone: Phone
+    # time.monotonic() the window closes at
+    deadline: float
+    texts: List[PendingText] = field(default_factory=list)
+
+    @property
+    def body(self) -> str:
+        if len(self.texts) == 1:
+            return self.texts[0].body
+        return "\n".join(
+            time.strftime("[%H:%M:%S UTC] ", time.gmtime(text.received_at)) + text.body
+            for text in self.texts
+        )
+
+    @property
+    def media(self) -> List[Media]:
+        return [item for text in self.texts for item in text.media]
+
+
+class Coalescer:
+    def __init__(
+        self, window: float, deliver: Callable[[Burst], None], workers: int = 4
+    ):
+        self.window = window
+        self.deliver = deliver
+        self._bursts: Dict[Tuple[int, str], Burst] = {}
+        self._changed = threading.Condition()
+        self._timer: Optional[threading.Thread] = None
+        # Delivering on a pool keeps one slow Help Scout call from holding
+        # up the other bursts due at the same time
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bling-coalesce"
+        )
+        self._delivering: Set[Future] = set()
+
+    def add(
+        self,
+        mailbox: Mailbox,
+        from_phone: Phone,
+        body: str,
+        media: Optional[List[Media]] = None,
+    ):
+        text = PendingText(body, time.time(), media or [])
+        key = (mailbox.id, from_phone.twilio_format)
+        with self._changed:
+            burst = self._bursts.get(key)
+            if burst is None:
+                burst = self._bursts[key] = Burst(
+                    mailbox, from_phone, time.monotonic() + self.window
+                )
+                metrics.increment("coalesce_texts_total", result="first")
+            else:
+                metrics.increment("coalesce_texts_total", result="joined")
+            burst.texts.append(text)
+            if self._timer is None:
+                self._timer = threading.Thread(
+                    target=self._run, name="bling-coalesce-timer", daemon=True
+                )
+                self._timer.start()
+            self._changed.notify()
+
+    def _due(self, now: float) -> List[Burst]:
+        due = [k for k, b in self._bursts.items() if b.deadline <= now]
+        return [self._bursts.pop(k) for k in due]
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due:
+                        break
+                    deadlines = [b.deadline for b in self._bursts.values()]
+                    self._changed.wait(min(deadlines) - now if deadlines else None)
+                # Submitted under the lock so flush() sees them
+                futures = [self._pool.submit(self._deliver, b) for b in due]
+                self._delivering.update(futures)
+            for future in futures:
+                future.add_done_callback(self._delivered)
+
+    def _delivered(self, future: Future):
+        with self._changed:
+            self._delivering.discard(future)
+
+    def _deliver(self, burst: Burst):
+        metrics.increment("coalesce_bursts_total")
+        try:
+            self.deliver(burst)
+        except Exception:
+            logging.exception(
+                "Failed to deliver %s texts from %s",
+                len(burst.texts),
+                burst.from_phone.helpscout_format,
+            )
+
+    def flush(self):
+        """Deliver everything pending now, and wait for what's being delivered"""
+        with self._changed:
+            bursts = list(self._bursts.values())
+            self._bursts.clear()
+            delivering = set(self._delivering)
+        for burst in bursts:
+            self._deliver(burst)
+        wait(delivering)
+
+    def pending(self) -> int:
+        with self._changed:
+            return len(self._bursts)
+
+
+_coalescer: Optional[Coalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def _deliver(burst: Burst):
+    """deliver_sms, or if that fails, queue the burst to be posted later"""
+    from bling.webhooks import defer_sms, deliver_sms
+
+    posted = threading.Event()
+    try:
+        deliver_sms(
+            burst.mailbox, burst.from_phone, burst.body, burst.media, posted.set
+        )
+    except Exception:
+        # Once it's in Help Scout, posting it again would only duplicate it
+        if posted.is_set():
+            raise
+        logging.exception(
+            "Failed to deliver %s texts from %s, deferring them",
+            len(burst.texts),
+            burst.from_phone.helpscout_format,
+        )
+        defer_sms(burst.mailbox, burst.from_phone, burst.body, burst.media)
+
+
+def coalescer() -> Optional[Coalescer]:
+    """The process's coalescer, if BLING_COALESCE_SECONDS is set and failed
+    bursts can be deferred"""
+    global _coalescer
+    if config.coalesce_seconds <= 0:
+        return None
+    if not deferred.enabled():
+        logs.warning_limited(
+            "coalesce_without_journal",
+            "Not combining texts: BLING_COALESCE_SECONDS needs a deferred journal",
+        )
+        return None
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = Coalescer(config.coalesce_seconds, _deliver)
+            # Twilio has already had its response for these
+            atexit.register(_coalescer.flush)
+    return _coalescer
@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+
+from bling import coalesce, deferred, webhooks
+from bling.coalesce import Burst, Coalescer, PendingText
+from bling.config import config
+from bling.deferred import DeferredQueue, Journal
+from bling.helpscout.mailboxes import Mailbox
+from bling.phone import Phone
+
+MAILBOX = Mailbox(
+    transport_type="twilio", phone=Phone.parse("+16175550100"), id=1, mc_campaign_id=""
+)
+ALICE = Phone.parse("+16175550111")
+BOB = Phone.parse("+16175550122")
+
+
+class Recorder:
+    def __init__(self):
+        self.bursts = []
+        self.delivered = threading.Event()
+
+    def __call__(self, burst):
+        self.bursts.append((burst, time.monotonic()))
+        self.delivered.set()
+
+
+def test_combines_texts_within_the_window():
+    recorder = Recorder()
+    coalescer = Coalescer(0.3, recorder)
+
+    start = time.monotonic()
+    coalescer.add(MAILBOX, ALICE, "hi")
+    coalescer.add(MAILBOX, ALICE, "can you help")
+    coalescer.add(MAILBOX, BOB, "hello")
+    assert recorder.delivered.wait(2)
+    time.sleep(0.1)
+
+    by_sender = {b.from_phone.twilio_format: (b, t) for b, t in recorder.bursts}
+    assert len(by_sender) == 2
+    alice, delivered_at = by_sender[ALICE.twilio_format]
+    lines = alice.body.split("\n")
+    assert lines[0].endswith("UTC] hi")
+    assert lines[1].endswith("UTC] can you help")
+    # A single text isn't stamped
+    assert by_sender[BOB.twilio_format][0].body == "hello"
+    # Delivered when the window closed, not later
+    assert 0.3 <= delivered_at - start < 1
+    assert coalescer.pending() == 0
+
+
+def test_window_isnt_extended_by_later_texts():
+    recorder = Recorder()
+    coalescer = Coalescer(0.3, recorder)
+
+    start = time.monotonic()
+    coalescer.add(MAILBOX, ALICE, "one")
+    time.sleep(0.2)
+    coalescer.add(MAILBOX, ALICE, "two")
+    assert recorder.delivered.wait(2)
+
+    [(burst, delivered_at)] = recorder.bursts
+    assert len(burst.texts) == 2
+    assert delivered_at - start < 0.45
+
+
+def test_flush_delivers_now():
+    recorder = Recorder()
+    coalescer = Coalescer(60, recorder)
+
+    coalescer.add(MAILBOX, ALICE, "hi")
+    coalescer.flush()
+    assert [b.body for b, _ in recorder.bursts] == ["hi"]
+    assert coalescer.pending() == 0
+
+
+def test_failed_delivery_doesnt_stop_the_timer():
+    recorder = Recorder()
+    calls = []
+
+    def deliver(burst):
+        calls.append(burst)
+        if len(calls) == 1:
+            raise RuntimeError("Help Scout is down")
+        recorder(burst)
+
+    coalescer = Coalescer(0.05, deliver)
+    coalescer.add(MAILBOX, ALICE, "lost")
+    time.sleep(0.2)
+    coalescer.add(MAILBOX, ALICE, "delivered")
+    assert recorder.delivered.wait(2)
+    assert recorder.bursts[0][0].body == "delivered"
+
+
+@pytest.fixture
+def journal(monkeypatch, tmp_path):
+    path = str(tmp_path / "deferred.jsonl")
+    monkeypatch.setitem(config.__dict__, "deferred_journal", path)
+    monkeypatch.setitem(config.__dict__, "on_lambda", False)
+    queue = DeferredQueue(lambda message, posted: None, 60, backend=Journal(path))
+    monkeypatch.setattr(deferred, "_queue", queue)
+    return queue
+
+
+def test_failed_burst_is_deferred(monkeypatch, journal):
+    calls = []
+
+    def post_sms(mailbox, from_phone, body, attachments, posted=None):
+        calls.append(body)
+        if body == "after":
+            posted()
+        raise RuntimeError("Help Scout is down")
+
+    monkeypatch.setattr(webhooks, "post_sms", post_sms)
+    burst = Burst(MAILBOX, ALICE, 0, [PendingText("hi", time.time())])
+    coalesce._deliver(burst)
+    [message] = journal._messages.messages
+    assert (message.from_phone, message.body) == (ALICE.twilio_format, "hi")
+
+    # Not once it's in Help Scout, or it'd be there twice
+    journal._messages.messages.clear()
+    burst = Burst(MAILBOX, ALICE, 0, [PendingText("after", time.time())])
+    with pytest.raises(RuntimeError):
+        coalesce._deliver(burst)
+    assert len(journal) == 0
+
+
+def test_only_coalesces_with_a_journal(monkeypatch):
+    monkeypatch.setitem(config.__dict__, "coalesce_seconds", 60)
+    monkeypatch.setitem(config.__dict__, "deferred_journal", "")
+    monkeypatch.setattr(coalesce, "_coalescer", None)
+    assert coalesce.coalescer() is None
+
+
+def test_flushed_when_the_process_exits(monkeypatch, journal):
+    registered = []
+    monkeypatch.setitem(config.__dict__, "coalesce_seconds", 60)
+    monkeypatch.setattr(coalesce, "_coalescer", None)
+    monkeypatch.setattr(coalesce.atexit, "register", registered.append)
+
+    coalescer = coalesce.coalescer()
+    assert registered == [coalescer.flush]
@@ -0,0 +1,235 @@
+"""
+Record and replay HTTP interactions at the requests Session level, so the
+incoming, outgoing and loader pipelines can be benchmarked reproducibly
+without network access or API quota.
+
+Set BLING_CASSETTE to a file and BLING_CASSETTE_MODE to "record" or
+"replay". The Help Scout, Twilio and Mobile Commons clients built in
+bling/clients.py then send their requests through a CassetteAdapter:
+
+- record: requests go out as normal, and each request/response pair is
+  kept and written to the cassette (gzipped JSON lines) at exit
+- replay: nothing goes out; each request is answered with the recorded
+  response for the same method, path, query and body, or failing that,
+  for the same route (IDs in the path ignored). The original latency is
+  reproduced, times BLING_CASSETTE_LATENCY_SCALE (0 for no delay).
+
+Hosts aren't part of the match, so a cassette recorded against the fakes
+in bling/bench/fakes.py on one port replays fine on another. Request
+headers and bodies aren't written (bodies only as a hash), and credentials
+in query strings and JSON responses are redacted.
+"""
+
+import base64
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from bling.common.logs import REDACTED_KEYS
+from bling.common.metrics import path_template
+
+RECORD = "record"
+REPLAY = "replay"
+
+# Response headers worth keeping: the clients read these
+KEPT_HEADERS = [
+    "Content-Type",
+    "Location",
+    "Resource-ID",
+    "Retry-After",
+    "X-RateLimit-Retry-After",
+]
+
+
+class CassetteMiss(requests.ConnectionError):
+    """Replaying, and there's no recorded response for this request"""
+
+
+def _body_bytes(body: Any) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if not isinstance(body, bytes):
+        # A streamed body, which is gone by now; match those on route
+        return b""
+    return body
+
+
+def _redacted_query(query: str) -> str:
+    pairs = parse_qsl(query, keep_blank_values=True)
+    return urlencode(
+        sorted((k, "[redacted]" if k.lower() in REDACTED_KEYS else v) for k, v in pairs)
+    )
+
+
+def _redacted_text(text: str) -> str:
+    """Blank out credentials in a JSON response, like the OAuth token"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    if not isinstance(data, dict) or not REDACTED_KEYS & {k.lower() for k in data}:
+        return text
+    return json.dumps(
+        {k: "[redacted]" if k.lower() in REDACTED_KEYS else v for k, v in data.items()}
+    )
+
+
+def request_keys(method: str, url: str, body: Any) -> Tuple[str, str]:
+    """(exact key, route key) a request is recorded and looked up under"""
+    parsed = urlparse(url)
+    digest = hashlib.sha1(_body_bytes(body)).hexdigest()[:16]
+    exact = f"{method} {parsed.path}?{_redacted_query(parsed.query)} {digest}"
+    route = f"{method} {path_template(parsed.path)}"
+    return exact, route
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = REPLAY, latency_scale: float = 1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.interactions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._exact: Dict[str, Iterator[Dict[str, Any]]] = {}
+        self._route: Dict[str, Iterator[Dict[str, Any]]] = {}
+        if mode == REPLAY:
+            self._load()
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+
+        exact: Dict[str, List[Dict[str, Any]]] = {}
+        route: Dict[str, List[Dict[str, Any]]] = {}
+        for interaction in self.interactions:
+            exact.setdefault(interaction["key"], []).append(interaction)
+            route.setdefault(interaction["route"], []).append(interaction)
+        # Repeated requests get the recorded responses in order, and then go
+        # round again, so a short recording can drive a long benchmark
+        self._exact = {k: itertools.cycle(v) for k, v in exact.items()}
+        self._route = {k: itertools.cycle(v) for k, v in route.items()}
+
+    def record(
+        self,
+        request: requests.PreparedRequest,
+        response: requests.Response,
+        elapsed: float,
+    ):
+        exact, route = request_keys(request.method, request.url, request.body)
+        content = response.content
+        try:
+            body: Dict[str, str] = {"text": _redacted_text(content.decode("utf-8"))}
+        except UnicodeDecodeError:
+            body = {"base64": base64.b64encode(content).decode("ascii")}
+        interaction = {
+            "key": exact,
+            "route": route,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                h: response.headers[h] for h in KEPT_HEADERS if h in response.headers
+            },
+            "elapsed": round(elapsed, 6),
+            **body,
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def find(self, request: requests.PreparedRequest) -> Dict[str, Any]:
+        exact, route = request_keys(request.method, request.url, request.body)
+        with self._lock:
+            responses = self._exact.get(exact) or self._route.get(route)
+            if responses is None:
+                raise CassetteMiss(f"No recorded response for {route}")
+            return next(responses)
+
+    def save(self):
+        """Write the recorded interactions, replacing the file atomically"""
+        tmp = f"{self.path}.tmp"
+        with self._lock, gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for interaction in self.interactions:
+                f.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.path)
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        adapter = CassetteAdapter(self)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+
+class CassetteAdapter(BaseAdapter):
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+        self._real = HTTPAdapter() if cassette.mode == RECORD else None
+
+    def send(self, request, **kwargs):
+        if self._real is not None:
+            # Session.send only sets response.elapsed after we return
+            start = time.perf_counter()
+            response = self._real.send(request, **kwargs)
+            self.cassette.record(request, response, time.perf_counter() - start)
+            return response
+
+        interaction = self.cassette.find(request)
+        delay = interaction["elapsed"] * self.cassette.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.reason = interaction.get("reason")
+        response.headers = CaseInsensitiveDict(interaction["headers"])
+        if "base64" in interaction:
+            response._content = base64.b64decode(interaction["base64"])
+        else:
+            response._content = interaction["text"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        if self._real is not None:
+            self._real.close()
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def from_config() -> Optional[Cassette]:
+    """The process's cassette, if BLING_CASSETTE is set"""
+    global _cassette
+    from bling.config import config
+
+    if not config.cassette_path:
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette(
+                config.cassette_path,
+                mode=config.cassette_mode,
+                latency_scale=config.cassette_latency_scale,
+            )
+            if _cassette.mode == RECORD:
+                import atexit
+
+                atexit.register(_cassette.save)
+    return _cassette
@@ -0,0 +1,63 @@
+import gzip
+
+import pytest
+
+from bling.bench.fakes import FakeHelpScout
+from bling.common.cassette import RECORD, REPLAY, Cassette, CassetteMiss
+from bling.helpscout.client import HelpScoutClient
+
+
+def make_client(cassette, url):
+    import requests
+
+    return HelpScoutClient(
+        base_url=url,
+        client_id="id",
+        secret="hs-client-secret",
+        session=cassette.mount(requests.Session()),
+    )
+
+
+def test_record_then_replay_without_network(tmp_path):
+    path = str(tmp_path / "hs.jsonl.gz")
+    with FakeHelpScout(latency=0.01) as helpscout:
+        helpscout.add_conversation(1001, "someone@example.com", threads=3)
+        recording = Cassette(path, mode=RECORD)
+        client = make_client(recording, helpscout.url)
+        recorded = client.find_conversations(mailbox_ids=[1001])
+        recording.save()
+        url = helpscout.url
+
+    with gzip.open(path, "rt") as f:
+        saved = f.read()
+    assert "fake-token" not in saved
+    assert "hs-client-secret" not in saved
+
+    replay = Cassette(path, mode=REPLAY, latency_scale=0)
+    client = make_client(replay, url)
+    assert client.find_conversations(mailbox_ids=[1001]) == recorded
+
+
+def test_replay_falls_back_to_route_and_scales_latency(tmp_path):
+    path = str(tmp_path / "hs.jsonl.gz")
+    with FakeHelpScout(latency=0.02) as helpscout:
+        conversation = helpscout.add_conversation(1001, "a@example.com", threads=1)
+        recording = Cassette(path, mode=RECORD)
+        client = make_client(recording, helpscout.url)
+        client.get_conversation(conversation.id)
+        recording.save()
+
+    replay = Cassette(path, mode=REPLAY, latency_scale=0.5)
+    # Different host and conversation ID, same route
+    client = make_client(replay, "http://127.0.0.1:9")
+    res = client.get_conversation(999999)
+    assert res.json()["id"] == conversation.id
+    assert 0.005 < res.elapsed.total_seconds() < 0.1
+
+    with pytest.raises(CassetteMiss):
+        client.get_threads_for_conversation(999999)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Cassette("unused", mode="rewind")
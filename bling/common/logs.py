@@ -0,0 +1,136 @@
+"""
+Logging helpers for payloads and noisy warnings.
+
+Webhook payloads and API bodies can be large (thread bodies, mostly), so
+instead of formatting them into f-strings, pass preview(payload) as a %s
+argument: it's only rendered if the record is actually emitted, and then
+it's truncated and has credentials masked.
+
+    logging.debug("POST %s json_body=%s", path, logs.preview(json_body))
+
+warning_limited() is for warnings that a misconfigured integration or a
+scanner can trigger on every request.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List
+
+from bling.common.rate_limit import TokenBucket
+
+PREVIEW_CHARS = 500
+STRING_CHARS = 100
+
+# Keys whose values never make it into the logs
+REDACTED_KEYS = frozenset(
+    [
+        "access_token",
+        "auth_token",
+        "authorization",
+        "client_secret",
+        "password",
+        "secret",
+        "token",
+    ]
+)
+
+
+class _Truncated(Exception):
+    pass
+
+
+def _render(value: Any, out: List[str], budget: List[int]):
+    def write(s: str):
+        out.append(s)
+        budget[0] -= len(s)
+        if budget[0] < 0:
+            raise _Truncated()
+
+    if isinstance(value, dict):
+        write("{")
+        for i, (k, v) in enumerate(value.items()):
+            write(f"{', ' if i else ''}{k!r}: ")
+            if str(k).lower() in REDACTED_KEYS:
+                write("'[redacted]'")
+            else:
+                _render(v, out, budget)
+        write("}")
+    elif isinstance(value, (list, tuple)):
+        write("[")
+        for i, v in enumerate(value):
+            if i:
+                write(", ")
+            _render(v, out, budget)
+        write("]")
+    else:
+        if isinstance(value, bytes):
+            value = value[: STRING_CHARS * 4].decode("utf-8", errors="replace")
+        if isinstance(value, str) and len(value) > STRING_CHARS:
+            write(repr(value[:STRING_CHARS]) + f"...(+{len(value) - STRING_CHARS})")
+        else:
+            write(repr(value))
+
+
+class Preview:
+    """
+    A log argument that renders a size-capped, redacted preview of a payload,
+    only when the log record is formatted
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value: Any, limit: int = PREVIEW_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        out: List[str] = []
+        try:
+            _render(self.value, out, [self.limit])
+        except _Truncated:
+            return "".join(out)[: self.limit] + "..."
+        return "".join(out)
+
+    __repr__ = __str__
+
+
+def preview(value: Any, limit: int = PREVIEW_CHARS) -> Preview:
+    return Preview(value, limit)
+
+
+class _Category:
+    def __init__(self, per_minute: float, burst: int):
+        self.bucket = TokenBucket(rate=per_minute / 60, capacity=burst)
+        self.suppressed = 0
+
+
+_categories: Dict[str, _Category] = {}
+_categories_lock = threading.Lock()
+
+
+def warning_limited(
+    category: str, msg: str, *args, per_minute: float = 6, burst: int = 3
+):
+    """
+    logging.warning, but at most `burst` at once and `per_minute` after that
+    for each category. The next warning that gets through says how many were
+    dropped.
+    """
+    state = _categories.get(category)
+    if state is None:
+        with _categories_lock:
+            state = _categories.setdefault(category, _Category(per_minute, burst))
+
+    if not state.bucket.try_acquire():
+        state.suppressed += 1
+        return
+
+    suppressed, state.suppressed = state.suppressed, 0
+    if suppressed:
+        msg += f" ({suppressed} similar warnings suppressed)"
+    logging.warning(msg, *args)
+
+
+def reset():
+    with _categories_lock:
+        _categories.clear()
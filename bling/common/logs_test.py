@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+
+from bling.common import logs
+
+
+@pytest.fixture(autouse=True)
+def reset_categories():
+    logs.reset()
+    yield
+    logs.reset()
+
+
+class Exploding:
+    def __repr__(self):
+        raise AssertionError("rendered a preview for a disabled log level")
+
+
+def test_preview_is_lazy(caplog):
+    caplog.set_level(logging.INFO)
+    logging.debug("payload %s", logs.preview({"body": Exploding()}))
+
+
+def test_preview_redacts_and_truncates():
+    rendered = str(
+        logs.preview(
+            {
+                "client_secret": "hunter2",
+                "Authorization": "Bearer abc",
+                "threads": [{"body": "x" * 1000}],
+            }
+        )
+    )
+    assert "hunter2" not in rendered
+    assert "Bearer" not in rendered
+    assert "'client_secret': '[redacted]'" in rendered
+    assert "...(+900)" in rendered
+
+    rendered = str(logs.preview({"threads": ["y" * 50] * 100}, limit=200))
+    assert len(rendered) == 203
+    assert rendered.endswith("...")
+
+
+def test_warning_limited(caplog, monkeypatch):
+    for i in range(10):
+        logs.warning_limited("noisy", "Warning %s", i, burst=3)
+    assert [r.getMessage() for r in caplog.records] == [
+        "Warning 0",
+        "Warning 1",
+        "Warning 2",
+    ]
+
+    # Once the bucket refills, the next warning reports what was dropped
+    logs._categories["noisy"].bucket._tokens = 1
+    logs.warning_limited("noisy", "Warning %s", 10)
+    assert caplog.records[-1].getMessage() == (
+        "Warning 10 (7 similar warnings suppressed)"
+    )
+
+    # Categories are limited separately
+    logs.warning_limited("other", "Other")
+    assert caplog.records[-1].getMessage() == "Other"
@@ -0,0 +1,29 @@
+from bling.common.lru import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_zero_size_caches_nothing():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a", "missing") == "missing"
+
+
+def test_pop():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "missing") == "missing"
+    assert len(cache) == 0
@@ -0,0 +1,295 @@
+import json
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# In-process metrics. Each Lambda container (or dev server) keeps its own
+# numbers; they're cheap enough to record on every request.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+# Upper bounds (seconds) of the latency histogram buckets. Prometheus adds +Inf.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Upper bounds (bytes) of the payload size histogram buckets
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # One count per bucket plus the overflow (+Inf) bucket. These aren't
+        # cumulative; that's done when rendering.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, LabelSet], float] = {}
+_histograms: Dict[Tuple[str, LabelSet], _Histogram] = {}
+_gauges: Dict[Tuple[str, LabelSet], float] = {}
+# Gauges worked out when they're read, see track_gauge
+_gauge_functions: Dict[Tuple[str, LabelSet], Callable[[], float]] = {}
+
+
+def _key(name: str, labels: Dict[str, object]) -> Tuple[str, LabelSet]:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def increment(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Record the current value of something that goes up and down"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def track_gauge(name: str, value: Callable[[], float], **labels):
+    """A gauge whose value is value() whenever it's read, e.g. a queue's age"""
+    key = _key(name, labels)
+    with _lock:
+        _gauge_functions[key] = value
+
+
+def _current_gauges() -> Dict[Tuple[str, LabelSet], float]:
+    with _lock:
+        gauges = dict(_gauges)
+        functions = list(_gauge_functions.items())
+    for key, value in functions:
+        try:
+            gauges[key] = value()
+        except Exception:
+            logging.exception("Failed to read gauge %s", key[0])
+    return gauges
+
+
+def observe(
+    name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels
+):
+    """Record a value (by default a duration in seconds) in a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+@contextmanager
+def timer(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def counter_value(name: str, **labels) -> float:
+    return _counters.get(_key(name, labels), 0)
+
+
+def gauge_value(name: str, **labels) -> Optional[float]:
+    return _current_gauges().get(_key(name, labels))
+
+
+def timer_value(name: str, **labels) -> Tuple[int, float]:
+    """(count, total) observed for a histogram"""
+    histogram = _histograms.get(_key(name, labels))
+    if histogram is None:
+        return (0, 0.0)
+    return (histogram.count, histogram.sum)
+
+
+def histogram_buckets(name: str, **labels) -> List[Tuple[float, int]]:
+    """Cumulative (upper bound, count) pairs for a histogram, ending with +Inf"""
+    histogram = _histograms.get(_key(name, labels))
+    if histogram is None:
+        return []
+    with _lock:
+        counts = list(histogram.counts)
+    bounds = list(histogram.buckets) + [float("inf")]
+    cumulative = []
+    total = 0
+    for bound, count in zip(bounds, counts):
+        total += count
+        cumulative.append((bound, total))
+    return cumulative
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+        _gauge_functions.clear()
+
+
+_ID_SEGMENT_RE = re.compile(r"/\d+(?=/|$)")
+
+
+def path_template(path: str) -> str:
+    """
+    An API path with the IDs taken out, so it can be used as a label without
+    creating a new series per conversation: /v2/conversations/123/reply ->
+    /v2/conversations/:id/reply
+    """
+    path = path.split("?", 1)[0]
+    if "://" in path:
+        path = "/" + path.split("://", 1)[1].partition("/")[2]
+    return _ID_SEGMENT_RE.sub("/:id", path)
+
+
+# The root logger, which the log lines below have always gone to
+_log = logging.getLogger()
+
+
+def record_request(route: str, status: int, seconds: float, request_bytes: int = 0):
+    """Metrics and a structured log line for one request to one of our routes"""
+    increment("bling_requests_total", route=route, status=status)
+    observe("bling_request_seconds", seconds, route=route)
+    observe("bling_request_bytes", request_bytes, buckets=SIZE_BUCKETS, route=route)
+    if not _log.isEnabledFor(logging.INFO):
+        return
+    _log.info(
+        "request %s",
+        json.dumps(
+            {
+                "route": route,
+                "status": status,
+                "ms": round(seconds * 1000, 2),
+                "bytes": request_bytes,
+            }
+        ),
+    )
+
+
+def record_upstream(
+    service: str,
+    operation: str,
+    status: object,
+    seconds: float,
+    request_bytes: int = 0,
+    response_bytes: Optional[int] = None,
+):
+    """
+    Metrics and a structured log line for one call to Help Scout, Twilio or
+    Mobile Commons
+    """
+    labels = {"service": service, "operation": operation}
+    increment("upstream_requests_total", status=status, **labels)
+    observe("upstream_request_seconds", seconds, **labels)
+    observe("upstream_request_bytes", request_bytes, buckets=SIZE_BUCKETS, **labels)
+    if response_bytes is not None:
+        observe(
+            "upstream_response_bytes", response_bytes, buckets=SIZE_BUCKETS, **labels
+        )
+    if not _log.isEnabledFor(logging.INFO):
+        return
+    _log.info(
+        "upstream %s",
+        json.dumps(
+            {
+                "service": service,
+                "operation": operation,
+                "status": status,
+                "ms": round(seconds * 1000, 2),
+                "request_bytes": request_bytes,
+                "response_bytes": response_bytes,
+            }
+        ),
+    )
+
+
+def _format_labels(labels: LabelSet, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    # Exactly, since rate() and friends work from the differences
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def render_prometheus() -> str:
+    """Everything recorded so far, in the Prometheus text exposition format"""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(
+            (key, (h.buckets, list(h.counts), h.count, h.sum))
+            for key, h in _histograms.items()
+        )
+
+    gauges = sorted(_current_gauges().items())
+
+    lines = []
+    last_name = None
+    for (name, labels), value in counters:
+        if name != last_name:
+            lines.append(f"# TYPE {name} counter")
+            last_name = name
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), value in gauges:
+        if name != last_name:
+            lines.append(f"# TYPE {name} gauge")
+            last_name = name
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), (buckets, counts, count, total) in histograms:
+        if name != last_name:
+            lines.append(f"# TYPE {name} histogram")
+            last_name = name
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + [float("inf")], counts):
+            cumulative += bucket_count
+            le = (("le", _format_bound(bound)),)
+            lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
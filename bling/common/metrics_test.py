@@ -0,0 +1,126 @@
+import json
+import logging
+
+import pytest
+
+from bling.common import metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_histogram_buckets():
+    for seconds in [0.0005, 0.003, 0.003, 20]:
+        metrics.observe("latency", seconds, route="/bling/")
+
+    buckets = dict(metrics.histogram_buckets("latency", route="/bling/"))
+    assert buckets[0.001] == 1
+    assert buckets[0.0025] == 1
+    assert buckets[0.005] == 3
+    assert buckets[10.0] == 3
+    assert buckets[float("inf")] == 4
+    assert metrics.timer_value("latency", route="/bling/") == (4, 20.0065)
+
+
+def test_path_template():
+    assert (
+        metrics.path_template("/v2/conversations/123/reply")
+        == "/v2/conversations/:id/reply"
+    )
+    assert (
+        metrics.path_template("https://api.helpscout.net/v2/conversations?page=2")
+        == "/v2/conversations"
+    )
+    assert metrics.path_template("/v2/customers/456") == "/v2/customers/:id"
+
+
+def test_render_prometheus():
+    metrics.record_request("/bling/twilio_sms", 200, 0.02, request_bytes=300)
+    metrics.increment("bling_requests_total", route='we"ird', status=404)
+    metrics.set_gauge("upstream_circuit_state", 2, service="helpscout")
+    metrics.set_gauge("upstream_circuit_state", 0, service="helpscout")
+
+    text = metrics.render_prometheus()
+    lines = text.splitlines()
+
+    assert lines.count("# TYPE bling_requests_total counter") == 1
+    assert 'bling_requests_total{route="/bling/twilio_sms",status="200"} 1' in lines
+    assert 'bling_requests_total{route="we\\"ird",status="404"} 1' in lines
+    assert "# TYPE upstream_circuit_state gauge" in lines
+    assert 'upstream_circuit_state{service="helpscout"} 0' in lines
+    assert "# TYPE bling_request_seconds histogram" in lines
+    assert (
+        'bling_request_seconds_bucket{route="/bling/twilio_sms",le="0.025"} 1' in lines
+    )
+    assert (
+        'bling_request_seconds_bucket{route="/bling/twilio_sms",le="0.01"} 0' in lines
+    )
+    assert (
+        'bling_request_seconds_bucket{route="/bling/twilio_sms",le="+Inf"} 1' in lines
+    )
+    assert 'bling_request_seconds_count{route="/bling/twilio_sms"} 1' in lines
+    assert (
+        'bling_request_bytes_bucket{route="/bling/twilio_sms",le="1024.0"} 1' in lines
+    )
+
+
+def test_render_prometheus_keeps_precision():
+    metrics.increment("big_total", 1234567)
+    metrics.increment("sleep_seconds_total", 0.1234567891)
+    metrics.observe("bling_request_seconds", 1234.5678, route="/bling/")
+
+    lines = metrics.render_prometheus().splitlines()
+    assert "big_total 1234567" in lines
+    assert "sleep_seconds_total 0.1234567891" in lines
+    assert 'bling_request_seconds_sum{route="/bling/"} 1234.5678' in lines
+
+
+def test_record_upstream():
+    metrics.record_upstream(
+        "helpscout", "POST /v2/conversations", 201, 0.3, 100, response_bytes=0
+    )
+    metrics.record_upstream("twilio", "messages.create", 429, 0.1, 40)
+
+    assert (
+        metrics.counter_value(
+            "upstream_requests_total",
+            service="helpscout",
+            operation="POST /v2/conversations",
+            status=201,
+        )
+        == 1
+    )
+    assert metrics.timer_value(
+        "upstream_request_seconds", service="twilio", operation="messages.create"
+    ) == (1, 0.1)
+    assert metrics.timer_value(
+        "upstream_response_bytes", service="twilio", operation="messages.create"
+    ) == (0, 0.0)
+
+
+def test_track_gauge():
+    depth = [3]
+    metrics.track_gauge("deferred_messages", lambda: depth[0], service="helpscout")
+    assert metrics.gauge_value("deferred_messages", service="helpscout") == 3
+
+    depth[0] = 0
+    assert 'deferred_messages{service="helpscout"} 0' in metrics.render_prometheus()
+
+
+def test_log_lines_only_built_when_logged(monkeypatch, caplog):
+    dumps = []
+    monkeypatch.setattr(json, "dumps", lambda value: dumps.append(value) or "{}")
+
+    with caplog.at_level(logging.WARNING):
+        metrics.record_request("/bling/", 200, 0.01)
+        metrics.record_upstream("twilio", "messages.create", 201, 0.1)
+    assert dumps == []
+
+    with caplog.at_level(logging.INFO):
+        metrics.record_request("/bling/", 200, 0.01)
+    assert dumps[0]["route"] == "/bling/"
+    assert "request {}" in caplog.messages
@@ -0,0 +1,166 @@
+"""
+Opt-in sampling profiler for live requests.
+
+A request is profiled if it carries a valid X-Bling-Profile header, or if it
+is picked by BLING_PROFILE_SAMPLE_RATE. While it's being handled, a
+background thread samples the handling thread's stack every few
+milliseconds. When the request finishes, the samples are written in the
+collapsed stack format that flamegraph.pl and speedscope read
+("outer;inner;innermost <count>" per line).
+
+When a request isn't picked, the cost is a random() call and a header
+lookup. Only the newest BLING_PROFILE_KEEP profiles are kept, so the
+directory doesn't grow without limit.
+"""
+
+import hashlib
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import suppress
+from typing import Optional
+
+from bling.common import logs
+from bling.common.webhook_auth import HmacKeyring
+from bling.config import config
+
+PROFILE_HEADER = "X-Bling-Profile"
+
+# How old a signed profile header can be, so a header lifted from a log
+# can't be used to keep profiling us
+MAX_HEADER_AGE_SECONDS = 5 * 60
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval until stopped"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="bling-profiler", daemon=True
+        )
+        self.started = 0.0
+        self.duration = 0.0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                stack.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> "SamplingProfiler":
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+
+_keyring: Optional[HmacKeyring] = None
+
+
+def sign_header(path: str, timestamp: Optional[int] = None) -> str:
+    """X-Bling-Profile value that asks for a profile of a request to path"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    keyring = HmacKeyring([config.profile_secret], digestmod=hashlib.sha256)
+    return f"{timestamp}:{keyring.sign(f'{timestamp}:{path}'.encode())}"
+
+
+def _valid_header(path: str, header: str) -> bool:
+    global _keyring
+    if not config.profile_secret:
+        return False
+    timestamp, _, signature = header.partition(":")
+    try:
+        age = time.time() - int(timestamp)
+    except ValueError:
+        return False
+    if not 0 <= age <= MAX_HEADER_AGE_SECONDS:
+        return False
+    if _keyring is None:
+        _keyring = HmacKeyring([config.profile_secret], digestmod=hashlib.sha256)
+    return _keyring.verify(f"{timestamp}:{path}".encode(), signature)
+
+
+def start_if_requested(path: str, header: Optional[str]) -> Optional[SamplingProfiler]:
+    """Start profiling the current thread if this request should be profiled"""
+    sampled = (
+        config.profile_sample_rate and random.random() < config.profile_sample_rate
+    )
+    if not sampled:
+        if not header:
+            return None
+        if not _valid_header(path, header):
+            logs.warning_limited(
+                "invalid_profile_header",
+                "Ignoring invalid %s header for %s",
+                PROFILE_HEADER,
+                path,
+            )
+            return None
+
+    return SamplingProfiler(
+        threading.get_ident(), interval=config.profile_interval_ms / 1000
+    ).start()
+
+
+def finish(profiler: SamplingProfiler, route: str) -> Optional[str]:
+    """
+    Stop profiling and write out the collapsed stacks: to a file in
+    BLING_PROFILE_DIR, or to the logs if that's set to "log". Returns the
+    file path, if any.
+    """
+    profiler.stop()
+    summary = "Profiled %s: %s stacks, %s samples in %.1fms"
+    args = (
+        route,
+        len(profiler.samples),
+        sum(profiler.samples.values()),
+        profiler.duration * 1000,
+    )
+
+    if config.profile_dir == "log":
+        logging.info(summary + "\n%s", *args, profiler.collapsed())
+        return None
+
+    os.makedirs(config.profile_dir, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    path = os.path.join(config.profile_dir, f"{int(time.time() * 1000)}-{name}.folded")
+    with open(path, "w") as f:
+        f.write(profiler.collapsed())
+    logging.info(summary + ", written to %s", *args, path)
+    _prune(config.profile_dir, config.profile_keep)
+    return path
+
+
+def _prune(directory: str, keep: int):
+    """Remove all but the newest keep profiles"""
+    # Named for the time they were taken, so oldest first
+    profiles = sorted(f for f in os.listdir(directory) if f.endswith(".folded"))
+    for name in profiles[: max(len(profiles) - keep, 0)]:
+        # Another process may have pruned it first
+        with suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, name))
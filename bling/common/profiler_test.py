@@ -0,0 +1,82 @@
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from bling.common import profiler
+from bling.config import config
+
+
+@pytest.fixture(autouse=True)
+def profile_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, "_keyring", None)
+    monkeypatch.setitem(config.__dict__, "profile_secret", "secret")
+    monkeypatch.setitem(config.__dict__, "profile_sample_rate", 0.0)
+    monkeypatch.setitem(config.__dict__, "profile_dir", str(tmp_path))
+    monkeypatch.setitem(config.__dict__, "profile_interval_ms", 1.0)
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profiles_the_calling_thread(tmp_path):
+    running = profiler.start_if_requested("/bling/", profiler.sign_header("/bling/"))
+    assert running is not None
+    busy_wait(0.05)
+    path = profiler.finish(running, "/bling/twilio_sms")
+
+    assert path.startswith(str(tmp_path))
+    assert path.endswith("-bling_twilio_sms.folded")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines
+    assert any("profiler_test:busy_wait" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+def test_keeps_only_the_newest_profiles(monkeypatch, tmp_path):
+    monkeypatch.setitem(config.__dict__, "profile_keep", 2)
+    for i in range(3):
+        (tmp_path / f"100{i}-old.folded").write_text("a 1\n")
+    (tmp_path / "notes.txt").write_text("mine")
+
+    running = profiler.start_if_requested("/bling/", profiler.sign_header("/bling/"))
+    path = profiler.finish(running, "/bling/")
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        ["1002-old.folded", os.path.basename(path), "notes.txt"]
+    )
+
+
+def test_not_profiled_without_header_or_sampling():
+    assert profiler.start_if_requested("/bling/", None) is None
+
+
+def test_rejects_bad_headers():
+    # Signed for a different path
+    assert (
+        profiler.start_if_requested("/bling/", profiler.sign_header("/bling/x")) is None
+    )
+    # Too old
+    old = int(time.time()) - profiler.MAX_HEADER_AGE_SECONDS - 10
+    assert (
+        profiler.start_if_requested("/bling/", profiler.sign_header("/bling/", old))
+        is None
+    )
+    assert profiler.start_if_requested("/bling/", "garbage") is None
+
+
+def test_sample_rate(monkeypatch):
+    monkeypatch.setitem(config.__dict__, "profile_sample_rate", 0.5)
+    with patch("random.random", return_value=0.4):
+        running = profiler.start_if_requested("/bling/", None)
+    assert running is not None
+    running.stop()
+
+    with patch("random.random", return_value=0.6):
+        assert profiler.start_if_requested("/bling/", None) is None
@@ -0,0 +1,61 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, with bursts of up to
+    `capacity`. Thread safe.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def deposit(self, tokens: float):
+        """Add tokens, e.g. earned by something other than time passing"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if they're available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until tokens are available and take them. Returns False if that
+        would take longer than timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate if self.rate else 1.0
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
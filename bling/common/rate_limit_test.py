@@ -0,0 +1,24 @@
+from unittest.mock import patch
+
+from bling.common.rate_limit import TokenBucket
+
+
+def test_token_bucket():
+    with patch("time.monotonic", return_value=100.0) as now:
+        bucket = TokenBucket(rate=2, capacity=3)
+        assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+        now.return_value = 100.5
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()
+
+        # Refills up to capacity, no further
+        now.return_value = 200.0
+        assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_token_bucket_acquire_waits():
+    bucket = TokenBucket(rate=100, capacity=1)
+    assert bucket.acquire()
+    assert not bucket.acquire(timeout=0.001)
+    assert bucket.acquire(timeout=1)
@@ -0,0 +1,277 @@
+"""
+Retries and circuit breaking for calls to Help Scout, Twilio and Mobile
+Commons, shared by their clients.
+
+Each upstream gets an Upstream, which
+
+- retries what the client says is worth retrying, up to
+  BLING_UPSTREAM_MAX_ATTEMPTS attempts, after the delay the upstream asked
+  for (e.g. Retry-After) or a jittered exponential backoff. If the upstream
+  asks for longer than BLING_UPSTREAM_MAX_RETRY_DELAY, we fail straight
+  away rather than hold up the caller.
+- only retries while the upstream's retry budget allows: each call earns
+  BLING_RETRY_BUDGET_RATIO of a retry, plus a trickle over time, so when an
+  upstream is struggling we add at most that fraction to its load instead
+  of multiplying it by the number of attempts
+- opens its circuit breaker after BLING_BREAKER_FAILURES failures in a
+  row. While it's open, calls fail straight away with CircuitOpenError
+  rather than each waiting on a timeout, and callers can put the work
+  aside (see bling/deferred.py). After BLING_BREAKER_RESET_SECONDS one
+  call is let through to test the water, and its result closes the breaker
+  or opens it again.
+
+The breaker's state is the upstream_circuit_state gauge (0 closed, 1 half
+open, 2 open), alongside counters of retries, exhausted budgets and calls
+short circuited.
+"""
+
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, TypeVar
+
+from bling.common import metrics
+from bling.common.rate_limit import TokenBucket
+from bling.config import config
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_CAP_SECONDS = 8.0
+
+
+class UpstreamUnavailable(Exception):
+    """
+    A call wasn't made, or was turned down, to spare an upstream. Catch it
+    alongside requests.RequestException wherever a failed call is handled
+    (it isn't one, to keep requests off the app's import path).
+    """
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """An upstream's breaker is open, so the call wasn't made"""
+
+    def __init__(self, service: str):
+        super().__init__(f"{service} is unavailable, its circuit breaker is open")
+        self.service = service
+
+
+class RateLimited(UpstreamUnavailable):
+    """An upstream turned a call down for now, and the caller asked not to wait"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} is rate limiting us for {retry_after}s")
+        self.service = service
+        self.retry_after = retry_after
+
+
+@dataclass
+class Verdict:
+    """What a client makes of one attempt at a call"""
+
+    # Counts as a failure towards opening the breaker
+    failed: bool
+    retry: bool = False
+    # Seconds the upstream asked us to wait, instead of the usual backoff
+    delay: Optional[float] = None
+    # For the retry metrics, e.g. the status code
+    reason: str = ""
+
+
+OK = Verdict(failed=False)
+
+
+class Backoff:
+    """Exponential backoff with full jitter"""
+
+    def __init__(
+        self, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_CAP_SECONDS
+    ):
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the attempt'th (from 0) failed attempt"""
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+
+class RetryBudget:
+    def __init__(self, ratio: float, per_second: float = 1.0, capacity: float = 10):
+        self.ratio = ratio
+        self._tokens = TokenBucket(rate=per_second, capacity=capacity)
+
+    def called(self):
+        self._tokens.deposit(self.ratio)
+
+    def try_retry(self) -> bool:
+        return self._tokens.try_acquire()
+
+
+class CircuitBreaker:
+    def __init__(self, service: str, failures: int, reset_seconds: float):
+        self.service = service
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._state = CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        metrics.set_gauge("upstream_circuit_state", 0, service=service)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._cooled_down():
+                return HALF_OPEN
+            return self._state
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() - self._opened_at >= self.reset_seconds
+
+    def _set_state(self, state: str):
+        if state == self._state:
+            return
+        self._state = state
+        logging.warning("%s circuit breaker is now %s", self.service, state)
+        metrics.set_gauge(
+            "upstream_circuit_state", STATE_GAUGE[state], service=self.service
+        )
+        metrics.increment(
+            "upstream_circuit_transitions_total", service=self.service, state=state
+        )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self._cooled_down():
+                self._set_state(HALF_OPEN)
+            # One trial call at a time while half open
+            if self._state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self._failed = 0
+            self._trial_running = False
+            self._set_state(CLOSED)
+
+    def failed(self):
+        with self._lock:
+            self._failed += 1
+            self._trial_running = False
+            if self._state == HALF_OPEN or self._failed >= self.failures:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class Upstream:
+    def __init__(
+        self,
+        service: str,
+        max_attempts: int = 3,
+        budget_ratio: float = 0.2,
+        breaker_failures: int = 5,
+        breaker_reset_seconds: float = 30,
+        backoff: Optional[Backoff] = None,
+        max_retry_delay: float = BACKOFF_CAP_SECONDS,
+    ):
+        self.service = service
+        self.max_attempts = max_attempts
+        self.max_retry_delay = max_retry_delay
+        self.budget = RetryBudget(budget_ratio)
+        self.breaker = CircuitBreaker(service, breaker_failures, breaker_reset_seconds)
+        self.backoff = backoff or Backoff()
+
+    @property
+    def available(self) -> bool:
+        """Whether a call now would be let through"""
+        return self.breaker.state != OPEN
+
+    def call(
+        self,
+        attempt: Callable[[], T],
+        judge: Callable[[Optional[T], Optional[Exception]], Verdict],
+    ) -> T:
+        """
+        Make attempts until judge says one shouldn't be retried, or we're
+        out of attempts or retry budget, and return (or raise) the last
+        one's result.
+        """
+        self.budget.called()
+        for n in range(self.max_attempts):
+            if not self.breaker.allow():
+                metrics.increment(
+                    "upstream_short_circuited_total", service=self.service
+                )
+                raise CircuitOpenError(self.service)
+
+            result: Optional[T] = None
+            error: Optional[Exception] = None
+            try:
+                result = attempt()
+            except Exception as e:
+                error = e
+            verdict = judge(result, error)
+            if verdict.failed:
+                self.breaker.failed()
+            else:
+                self.breaker.succeeded()
+
+            last = n + 1 == self.max_attempts
+            if not verdict.retry or last:
+                break
+            if verdict.delay is not None and verdict.delay > self.max_retry_delay:
+                metrics.increment(
+                    "upstream_retry_after_too_long_total", service=self.service
+                )
+                break
+            if not self.budget.try_retry():
+                metrics.increment(
+                    "upstream_retry_budget_exhausted_total", service=self.service
+                )
+                break
+
+            delay = (
+                verdict.delay if verdict.delay is not None else self.backoff.delay(n)
+            )
+            metrics.increment(
+                "upstream_retries_total", service=self.service, reason=verdict.reason
+            )
+            metrics.increment(
+                "upstream_retry_sleep_seconds_total", delay, service=self.service
+            )
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return result  # type: ignore
+
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(service: str) -> Upstream:
+    """The process's shared Upstream for a service"""
+    with _upstreams_lock:
+        if service not in _upstreams:
+            _upstreams[service] = Upstream(
+                service,
+                max_attempts=config.upstream_max_attempts,
+                budget_ratio=config.retry_budget_ratio,
+                breaker_failures=config.breaker_failures,
+                breaker_reset_seconds=config.breaker_reset_seconds,
+                max_retry_delay=config.upstream_max_retry_delay,
+            )
+        return _upstreams[service]
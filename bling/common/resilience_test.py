@@ -0,0 +1,149 @@
+from unittest.mock import patch
+
+import pytest
+
+from bling.common import metrics
+from bling.common.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OK,
+    OPEN,
+    Backoff,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryBudget,
+    Upstream,
+    Verdict,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def judge(result, error):
+    if error is not None:
+        return Verdict(failed=True, retry=True, reason="boom")
+    return OK
+
+
+def test_backoff_is_jittered_and_capped():
+    backoff = Backoff(base=1, cap=5)
+    for attempt in range(6):
+        delays = {backoff.delay(attempt) for _ in range(20)}
+        assert len(delays) > 1
+        assert all(0 <= d <= min(5, 2**attempt) for d in delays)
+
+
+def test_retry_budget():
+    with patch("time.monotonic", return_value=100.0):
+        budget = RetryBudget(ratio=0.5, per_second=1, capacity=2)
+        assert budget.try_retry()
+        assert budget.try_retry()
+        assert not budget.try_retry()
+
+        # Each call earns half a retry
+        budget.called()
+        assert not budget.try_retry()
+        budget.called()
+        assert budget.try_retry()
+
+
+def test_circuit_breaker():
+    with patch("time.monotonic", return_value=100.0) as now:
+        breaker = CircuitBreaker("helpscout", failures=2, reset_seconds=30)
+        breaker.failed()
+        assert breaker.state == CLOSED
+        breaker.failed()
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+        assert metrics.gauge_value("upstream_circuit_state", service="helpscout") == 2
+
+        # One trial call after the reset time, which opens it again if it fails
+        now.return_value = 130.0
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.failed()
+        assert breaker.state == OPEN
+
+        now.return_value = 160.0
+        assert breaker.allow()
+        breaker.succeeded()
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+        assert metrics.gauge_value("upstream_circuit_state", service="helpscout") == 0
+
+
+def test_upstream_retries_then_fails_fast():
+    upstream = Upstream(
+        "helpscout", max_attempts=3, breaker_failures=4, backoff=Backoff(base=0.001)
+    )
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError()
+        return "ok"
+
+    assert upstream.call(flaky, judge) == "ok"
+    assert len(calls) == 3
+    assert (
+        metrics.counter_value(
+            "upstream_retries_total", service="helpscout", reason="boom"
+        )
+        == 2
+    )
+
+    def down():
+        calls.append(1)
+        raise ConnectionError()
+
+    calls.clear()
+    with pytest.raises(ConnectionError):
+        upstream.call(down, judge)
+    # The fourth failure in a row opened the breaker partway through
+    with pytest.raises(CircuitOpenError):
+        upstream.call(down, judge)
+    assert len(calls) == 4
+    assert not upstream.available
+    assert metrics.counter_value("upstream_short_circuited_total", service="helpscout")
+
+
+def test_upstream_stops_retrying_when_out_of_budget():
+    upstream = Upstream("twilio", max_attempts=5, backoff=Backoff(base=0.001))
+    upstream.budget = RetryBudget(ratio=0, per_second=0, capacity=1)
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        upstream.call(down, judge)
+    assert len(calls) == 2
+    assert metrics.counter_value(
+        "upstream_retry_budget_exhausted_total", service="twilio"
+    )
+
+
+def test_upstream_doesnt_wait_out_a_long_retry_after():
+    upstream = Upstream("helpscout", max_attempts=3, max_retry_delay=5)
+    calls = []
+
+    def rate_limited():
+        calls.append(1)
+        return "429"
+
+    def judge_429(result, error):
+        return Verdict(failed=False, retry=True, delay=60, reason="429")
+
+    assert upstream.call(rate_limited, judge_429) == "429"
+    assert len(calls) == 1
+    assert metrics.counter_value(
+        "upstream_retry_after_too_long_total", service="helpscout"
+    )
@@ -0,0 +1,230 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Mapping, Optional, Sequence, TypeVar, Union
+from urllib.parse import urlparse
+
+from bling.common import logs
+from bling.config import config
+
+# How many recent signatures we remember, and for how long. This is per
+# process (so per Lambda container), which is enough to catch the retries and
+# replays that land on a warm container without adding a shared store.
+REPLAY_CACHE_SIZE = 10000
+REPLAY_CACHE_TTL_SECONDS = 15 * 60
+
+T = TypeVar("T")
+
+# A form field's value, or all of them when the field is repeated
+FormValue = Union[str, Sequence[str]]
+
+
+class HmacKeyring:
+    """
+    HMAC state keyed with each active secret, built once. Signing a request
+    copies the prebuilt state instead of re-encoding the secret and redoing
+    the key setup every time.
+
+    The first secret is the current one; any others are still accepted so
+    that secrets can be rotated without dropping webhooks.
+    """
+
+    def __init__(self, secrets: Iterable[Optional[str]], digestmod=hashlib.sha1):
+        self._states = [
+            hmac.new(secret.encode("utf-8"), digestmod=digestmod)
+            for secret in secrets
+            if secret
+        ]
+
+    def __len__(self):
+        return len(self._states)
+
+    def _digest(self, state, data: bytes) -> bytes:
+        mac = state.copy()
+        mac.update(data)
+        return mac.digest()
+
+    def sign(self, data: bytes) -> str:
+        """Base64 signature of data with the current secret"""
+        return base64.b64encode(self._digest(self._states[0], data)).decode("ascii")
+
+    def verify(self, data: bytes, signature: Optional[str]) -> bool:
+        if not signature:
+            return False
+        try:
+            expected = base64.b64decode(signature, validate=True)
+        except (binascii.Error, ValueError):
+            return False
+        return any(
+            hmac.compare_digest(self._digest(state, data), expected)
+            for state in self._states
+        )
+
+
+class ReplayCache:
+    """
+    Bounded set of recently seen signatures, with O(1) lookups and eviction.
+
+    A signature is claimed when a request is accepted. If handling it fails,
+    the claim should be released, so that a legitimate retry of a failed
+    request (e.g. Twilio's #rc=3 retries) still goes through.
+    """
+
+    def __init__(
+        self, max_size: int = REPLAY_CACHE_SIZE, ttl: float = REPLAY_CACHE_TTL_SECONDS
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, signature: str) -> bool:
+        """Record a signature. Returns False if it was already seen."""
+        now = time.monotonic()
+        with self._lock:
+            expires = self._seen.get(signature)
+            if expires is not None and expires > now:
+                return False
+
+            self._seen[signature] = now + self.ttl
+            self._seen.move_to_end(signature)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def release(self, signature: str):
+        with self._lock:
+            self._seen.pop(signature, None)
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
+
+    def run_once(self, signature: str, f: Callable[[], T], duplicate: T) -> T:
+        """
+        Run f unless we've already seen this signature, in which case return
+        the duplicate response without doing any work. If f raises, the claim
+        is released so that a retry of the failed request is let through.
+        """
+        if not self.claim(signature):
+            logs.warning_limited("replayed_webhook", "Ignoring replayed webhook")
+            return duplicate
+        try:
+            return f()
+        except Exception:
+            self.release(signature)
+            raise
+
+
+def _form_values(params: Mapping[str, FormValue], key: str) -> List[str]:
+    # Flask's request.form is a MultiDict, where [key] is only the first value
+    getlist = getattr(params, "getlist", None)
+    if getlist is not None:
+        return getlist(key)
+    value = params[key]
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _twilio_signed_string(url: str, params: Mapping[str, FormValue]) -> bytes:
+    # A repeated field is signed once per distinct value, in order
+    s = url
+    for k in sorted(params):
+        for v in sorted(set(_form_values(params, k))):
+            s += k + v
+    return s.encode("utf-8")
+
+
+def _twilio_url_variants(url: str) -> List[str]:
+    """
+    Twilio may sign the URL with or without an explicit port, so we accept
+    either (this matches twilio.request_validator.RequestValidator).
+    """
+    parsed = urlparse(url)
+    if parsed.port:
+        with_port = url
+        without_port = parsed._replace(netloc=parsed.netloc.split(":")[0]).geturl()
+    else:
+        port = 443 if parsed.scheme == "https" else 80
+        with_port = parsed._replace(netloc=f"{parsed.netloc}:{port}").geturl()
+        without_port = url
+    return [without_port, with_port]
+
+
+class TwilioSignatureValidator:
+    """
+    Equivalent of twilio's RequestValidator, built once per set of auth tokens
+    rather than once per request.
+    """
+
+    def __init__(self, tokens: Iterable[Optional[str]]):
+        self.keyring = HmacKeyring(tokens)
+
+    def sign(self, url: str, params: Mapping[str, FormValue]) -> str:
+        return self.keyring.sign(_twilio_signed_string(url, params))
+
+    def validate(
+        self, url: str, params: Mapping[str, FormValue], signature: str
+    ) -> bool:
+        return any(
+            self.keyring.verify(_twilio_signed_string(u, params), signature)
+            for u in _twilio_url_variants(url)
+        )
+
+
+def ops_authorized(authorization: Optional[str]) -> bool:
+    """Whether an Authorization header carries BLING_OPS_TOKEN, which the
+    warm-up and metrics routes need"""
+    if not config.ops_token or not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        token.strip().encode(), config.ops_token.encode()
+    )
+
+
+class HelpScoutSignatureValidator:
+    """https://developer.helpscout.com/webhooks/#verifying"""
+
+    def __init__(self, secrets: Iterable[Optional[str]]):
+        self.keyring = HmacKeyring(secrets)
+
+    def sign(self, body: bytes) -> str:
+        return self.keyring.sign(body)
+
+    def validate(self, body: bytes, signature: Optional[str]) -> bool:
+        return self.keyring.verify(body, signature)
+
+
+_validators_lock = threading.Lock()
+_twilio_validator: Optional[TwilioSignatureValidator] = None
+_helpscout_validator: Optional[HelpScoutSignatureValidator] = None
+
+twilio_replay_cache = ReplayCache()
+helpscout_replay_cache = ReplayCache()
+
+
+def twilio_validator() -> TwilioSignatureValidator:
+    global _twilio_validator
+    if _twilio_validator is None:
+        with _validators_lock:
+            if _twilio_validator is None:
+                _twilio_validator = TwilioSignatureValidator(
+                    [config.twilio_auth_token] + config.twilio_previous_auth_tokens
+                )
+    return _twilio_validator
+
+
+def helpscout_validator() -> HelpScoutSignatureValidator:
+    global _helpscout_validator
+    if _helpscout_validator is None:
+        with _validators_lock:
+            if _helpscout_validator is None:
+                _helpscout_validator = HelpScoutSignatureValidator(
+                    [config.helpscout_webhook_secret]
+                    + config.helpscout_webhook_previous_secrets
+                )
+    return _helpscout_validator
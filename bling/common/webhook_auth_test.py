@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import hmac
+
+from twilio.request_validator import RequestValidator
+
+from bling.common.webhook_auth import (
+    HelpScoutSignatureValidator,
+    ReplayCache,
+    TwilioSignatureValidator,
+)
+
+URL = "https://example.com/bling/twilio_sms"
+PARAMS = {"From": "+15558889999", "To": "+15556667777", "Body": "hi"}
+
+
+def test_twilio_matches_request_validator():
+    validator = TwilioSignatureValidator(["token"])
+    reference = RequestValidator("token")
+
+    assert validator.sign(URL, PARAMS) == reference.compute_signature(URL, PARAMS)
+    assert validator.validate(URL, PARAMS, reference.compute_signature(URL, PARAMS))
+
+    # Twilio sometimes signs the URL with the port
+    with_port = reference.compute_signature(
+        "https://example.com:443/bling/twilio_sms", PARAMS
+    )
+    assert validator.validate(URL, PARAMS, with_port)
+
+    assert not validator.validate(
+        URL, dict(PARAMS, Body="bye"), validator.sign(URL, PARAMS)
+    )
+    assert not validator.validate(URL, PARAMS, "")
+    assert not validator.validate(URL, PARAMS, "not base64!")
+
+
+def test_twilio_repeated_fields():
+    validator = TwilioSignatureValidator(["token"])
+    signature = validator.sign(URL, dict(PARAMS, Tag=["b", "a"]))
+
+    # Each value is signed, in order, whichever order they came in
+    assert validator.validate(URL, dict(PARAMS, Tag=["a", "b"]), signature)
+    assert not validator.validate(URL, dict(PARAMS, Tag="b"), signature)
+
+    signed = URL + "Bodyhi" + "From+15558889999" + "TagaTagb" + "To+15556667777"
+    expected = hmac.new(b"token", signed.encode(), hashlib.sha1).digest()
+    assert signature == base64.b64encode(expected).decode()
+
+
+def test_twilio_rotation():
+    old = TwilioSignatureValidator(["old"])
+    new = TwilioSignatureValidator(["new"])
+    rotating = TwilioSignatureValidator(["new", "old", None])
+
+    assert rotating.sign(URL, PARAMS) == new.sign(URL, PARAMS)
+    assert rotating.validate(URL, PARAMS, old.sign(URL, PARAMS))
+    assert rotating.validate(URL, PARAMS, new.sign(URL, PARAMS))
+    assert not new.validate(URL, PARAMS, old.sign(URL, PARAMS))
+
+
+def test_twilio_no_tokens():
+    assert not TwilioSignatureValidator([None]).validate(URL, PARAMS, "abc=")
+
+
+def test_helpscout_signature():
+    body = b'{"id": 1}'
+    expected = base64.b64encode(
+        hmac.digest(b"secret", msg=body, digest=hashlib.sha1)
+    ).decode()
+
+    validator = HelpScoutSignatureValidator(["other", "secret"])
+    assert validator.validate(body, expected)
+    assert not validator.validate(b'{"id": 2}', expected)
+    assert not validator.validate(body, None)
+    assert HelpScoutSignatureValidator(["secret"]).sign(body) == expected
+
+
+def test_replay_cache():
+    cache = ReplayCache(max_size=2)
+    assert cache.claim("a")
+    assert not cache.claim("a")
+
+    # released claims can be made again
+    cache.release("a")
+    assert cache.claim("a")
+
+    # oldest entries are evicted once full
+    assert cache.claim("b")
+    assert cache.claim("c")
+    assert cache.claim("a")
+    assert not cache.claim("c")
+
+
+def test_replay_cache_ttl():
+    cache = ReplayCache(ttl=0)
+    assert cache.claim("a")
+    assert cache.claim("a")
@@ -1,7 +1,11 @@
-from werkzeug.utils import cached_property
+from functools import cached_property
 from os import environ
 
 
+def _split_list(value):
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
 class Config:
     @cached_property
     def helpscout_api_client_id(self):
@@ -11,10 +15,31 @@ class Config:
     def helpscout_api_client_secret(self):
         return environ.get("HELPSCOUT_API_CLIENT_SECRET")
 
+    @cached_property
+    def helpscout_base_url(self):
+        """Help Scout API host, overridden to point at a fake for benchmarks"""
+        return environ.get("HELPSCOUT_BASE_URL", "https://api.helpscout.net")
+
+    @cached_property
+    def helpscout_requests_per_minute(self):
+        """Client-side cap on Help Scout API calls from this process"""
+        value = environ.get("HELPSCOUT_REQUESTS_PER_MINUTE")
+        return float(value) if value else None
+
+    @cached_property
+    def helpscout_conversation_cache_size(self):
+        """Hydrated conversations kept in memory, see hydrate_conversations"""
+        return int(environ.get("HELPSCOUT_CONVERSATION_CACHE_SIZE", "256"))
+
     @cached_property
     def helpscout_webhook_secret(self):
         return environ.get("HELPSCOUT_WEBHOOK_SECRET")
 
+    @cached_property
+    def helpscout_webhook_previous_secrets(self):
+        """Comma-separated secrets still accepted while rotating the webhook secret"""
+        return _split_list(environ.get("HELPSCOUT_WEBHOOK_PREVIOUS_SECRETS"))
+
     @cached_property
     def twilio_account_sid(self):
         return environ.get("TWILIO_ACCOUNT_SID")
@@ -23,6 +48,16 @@ class Config:
     def twilio_auth_token(self):
         return environ.get("TWILIO_AUTH_TOKEN")
 
+    @cached_property
+    def twilio_base_url(self):
+        """Send Twilio API requests here instead of *.twilio.com"""
+        return environ.get("TWILIO_BASE_URL")
+
+    @cached_property
+    def twilio_previous_auth_tokens(self):
+        """Comma-separated auth tokens still accepted while rotating the auth token"""
+        return _split_list(environ.get("TWILIO_PREVIOUS_AUTH_TOKENS"))
+
     @cached_property
     def mobilecommons_username(self):
         return environ.get("MOBILECOMMONS_USERNAME")
@@ -31,6 +66,148 @@ class Config:
     def mobilecommons_password(self):
         return environ.get("MOBILECOMMONS_PASSWORD")
 
+    @cached_property
+    def mailboxes(self):
+        """Comma-separated mailbox config, see bling/helpscout/mailboxes.py"""
+        return environ.get("BLING_MAILBOXES", "twilio:+16173973198:206906")
+
+    @cached_property
+    def mailboxes_file(self):
+        """JSON or YAML mailbox config, used instead of BLING_MAILBOXES if set"""
+        return environ.get("BLING_MAILBOXES_FILE")
+
+    @cached_property
+    def mailboxes_reload_seconds(self):
+        """How often to check BLING_MAILBOXES_FILE for changes"""
+        return float(environ.get("BLING_MAILBOXES_RELOAD_SECONDS", "10"))
+
+    @cached_property
+    def forward_media(self):
+        """Attach MMS media to Help Scout threads, see bling/media.py"""
+        return environ.get("BLING_FORWARD_MEDIA", "1") == "1"
+
+    @cached_property
+    def media_cache_dir(self):
+        return environ.get("BLING_MEDIA_CACHE_DIR", "/tmp/bling-media")
+
+    @cached_property
+    def media_workers(self):
+        return int(environ.get("BLING_MEDIA_WORKERS", "2"))
+
+    @cached_property
+    def coalesce_seconds(self):
+        """Combine texts from the same supporter within this window, see bling/coalesce.py"""
+        return float(environ.get("BLING_COALESCE_SECONDS", "0"))
+
+    @cached_property
+    def voicemail_merge_seconds(self):
+        """How long a voicemail's thread waits for its transcription, see bling/voicemail.py"""
+        return float(environ.get("BLING_VOICEMAIL_MERGE_SECONDS", "600"))
+
+    @cached_property
+    def upstream_max_attempts(self):
+        """Tries per API call, see bling/common/resilience.py"""
+        return int(environ.get("BLING_UPSTREAM_MAX_ATTEMPTS", "3"))
+
+    @cached_property
+    def upstream_max_retry_delay(self):
+        """The longest Retry-After we'll wait out before trying again"""
+        return float(environ.get("BLING_UPSTREAM_MAX_RETRY_DELAY", "8"))
+
+    @cached_property
+    def retry_budget_ratio(self):
+        """Retries allowed per API call made, on average"""
+        return float(environ.get("BLING_RETRY_BUDGET_RATIO", "0.2"))
+
+    @cached_property
+    def breaker_failures(self):
+        """Failures in a row that open an upstream's circuit breaker"""
+        return int(environ.get("BLING_BREAKER_FAILURES", "5"))
+
+    @cached_property
+    def breaker_reset_seconds(self):
+        """How long a circuit breaker stays open before trying again"""
+        return float(environ.get("BLING_BREAKER_RESET_SECONDS", "30"))
+
+    @cached_property
+    def deferred_retry_seconds(self):
+        """How often deferred messages are retried, see bling/deferred.py"""
+        return float(environ.get("BLING_DEFERRED_RETRY_SECONDS", "15"))
+
+    @cached_property
+    def on_lambda(self):
+        """Whether we're in AWS Lambda, which freezes us between invocations"""
+        return "AWS_LAMBDA_FUNCTION_NAME" in environ
+
+    @cached_property
+    def spill_rate_limited(self):
+        """Queue incoming messages Help Scout rate limits, see bling/deferred.py.
+        Only where there's a journal to keep them in, and not on Lambda."""
+        if not self.deferred_journal or self.on_lambda:
+            return False
+        return environ.get("BLING_SPILL_RATE_LIMITED", "1") == "1"
+
+    @cached_property
+    def deferred_journal(self):
+        """This process's file to keep the deferred message queue in, if any"""
+        return environ.get("BLING_DEFERRED_JOURNAL", "")
+
+    @cached_property
+    def cassette_path(self):
+        """Record or replay API calls to this file, see bling/common/cassette.py"""
+        return environ.get("BLING_CASSETTE")
+
+    @cached_property
+    def cassette_mode(self):
+        return environ.get("BLING_CASSETTE_MODE", "replay")
+
+    @cached_property
+    def cassette_latency_scale(self):
+        return float(environ.get("BLING_CASSETTE_LATENCY_SCALE", "1"))
+
+    @cached_property
+    def sms_transliterate(self):
+        """Whether outbound SMS replies may swap typographic characters (smart
+        quotes, em dashes, ...) for GSM-7 equivalents to avoid UCS-2"""
+        return environ.get("BLING_SMS_TRANSLITERATE", "true").lower() != "false"
+
+    @cached_property
+    def sms_fold_accents(self):
+        """Whether transliteration may also drop accents outside GSM-7 (ó -> o),
+        which changes the wording of e.g. Spanish replies"""
+        return environ.get("BLING_SMS_FOLD_ACCENTS", "false").lower() == "true"
+
+    @cached_property
+    def profile_sample_rate(self):
+        """Fraction of requests to run under the sampling profiler"""
+        return float(environ.get("BLING_PROFILE_SAMPLE_RATE", "0"))
+
+    @cached_property
+    def profile_secret(self):
+        """Secret for signing X-Bling-Profile headers, which ask for a profile
+        of a single request"""
+        return environ.get("BLING_PROFILE_SECRET")
+
+    @cached_property
+    def ops_token(self):
+        """Bearer token for /bling/warmup and /bling/metrics, which are off
+        without one"""
+        return environ.get("BLING_OPS_TOKEN")
+
+    @cached_property
+    def profile_dir(self):
+        """Where to write profiles, or "log" to log them instead"""
+        return environ.get("BLING_PROFILE_DIR", "/tmp/bling-profiles")
+
+    @cached_property
+    def profile_keep(self):
+        """How many of the newest profiles to keep in BLING_PROFILE_DIR"""
+        return int(environ.get("BLING_PROFILE_KEEP", "100"))
+
+    @cached_property
+    def profile_interval_ms(self):
+        return float(environ.get("BLING_PROFILE_INTERVAL_MS", "5"))
+
     @cached_property
     def blackhole_domain(self):
         """We use a different domain for each set of infrastructure so they
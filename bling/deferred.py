@@ -0,0 +1,374 @@
+"""
+Incoming messages put aside while Help Scout can't take them, to be posted
+once it can.
+
+bling/webhooks.py queues a message here instead of failing the webhook, or
+waiting, when
+
+- Help Scout's circuit breaker is open (see bling/common/resilience.py), or
+- Help Scout's rate limit turns down the conversation search, or the
+  conversation or thread we post, for it (with BLING_SPILL_RATE_LIMITED)
+
+so Twilio gets a quick answer, and doesn't retry the webhook and add to
+the load. A background thread posts the queue oldest first, every
+BLING_DEFERRED_RETRY_SECONDS, or once Help Scout's Retry-After has passed.
+While anything is queued, new messages join the back of the queue, so each
+supporter's messages still arrive in the order they sent them.
+
+Twilio won't send a message again once we've answered, so the queue is
+only as safe as where it's kept. It's kept in the BLING_DEFERRED_JOURNAL
+file: each message is appended when it's queued and marked done once it's
+posted, and a restarted process carries on from the file. Each process
+needs its own journal. Without one, or on Lambda, where a container's /tmp
+doesn't outlive it, nothing is deferred (see enabled), and the webhook
+fails as it always did, so Twilio retries it or sends its fallback.
+
+Help Scout's errors (a 429 or 5xx, or not connecting) pause the replay
+rather than count against the message. A message that still fails for
+some other reason after MAX_ATTEMPTS is moved to the journal's dead letter
+file (the journal's path plus .dead) for someone to look at, instead of
+holding up the rest of the queue.
+
+The deferred_messages and deferred_oldest_age_seconds gauges are how many
+messages are queued and how long the oldest has waited.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from bling.common import logs, metrics
+from bling.common.resilience import CircuitOpenError, RateLimited, upstream
+from bling.config import config
+
+# Tries before we give up on a message that fails for some other reason
+MAX_ATTEMPTS = 5
+# Rewrite the journal without the posted messages once there are this many
+COMPACT_AFTER = 100
+
+
+@dataclass
+class DeferredMessage:
+    mailbox_id: int
+    # In Twilio's format
+    from_phone: str
+    body: str
+    # Media.url and Media.content_type, see bling/media.py
+    media: List[Dict[str, str]] = field(default_factory=list)
+    deferred_at: float = field(default_factory=time.time)
+    attempts: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DeferredMessage":
+        return cls(**data)
+
+
+class MemoryBackend:
+    """Where a DeferredQueue keeps its messages, oldest first"""
+
+    def __init__(self):
+        self.messages: Deque[DeferredMessage] = deque()
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, message: DeferredMessage):
+        self.messages.append(message)
+
+    def first(self) -> Optional[DeferredMessage]:
+        return self.messages[0] if self.messages else None
+
+    def pop_first(self):
+        self.messages.popleft()
+
+    def dead_letter(self, message: DeferredMessage, error: Exception):
+        """Put aside a message that can't be posted"""
+        logging.error(
+            "Dropping a deferred message that can't be posted: %s",
+            logs.preview(message.as_dict()),
+        )
+
+
+class Journal(MemoryBackend):
+    """
+    Messages in memory and in an append-only JSON lines file, of
+    {"put": message} when one is queued and {"done": 1} when the oldest
+    is posted
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._done = 0
+        if os.path.exists(path):
+            self._load()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        good = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("no newline")
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line, cut short by a crash
+                    logging.warning("Dropping a damaged line in %s", self.path)
+                    break
+                good += len(line)
+                if "put" in record:
+                    self.messages.append(DeferredMessage.from_dict(record["put"]))
+                elif self.messages:
+                    self.messages.popleft()
+                    self._done += 1
+        # So new lines don't run on from the damaged one
+        os.truncate(self.path, good)
+        if self.messages:
+            logging.info(
+                "Loaded %s deferred messages from %s", len(self.messages), self.path
+            )
+
+    def _write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, message: DeferredMessage):
+        self._write({"put": message.as_dict()})
+        super().append(message)
+
+    def pop_first(self):
+        self._write({"done": 1})
+        super().pop_first()
+        self._done += 1
+        if self._done >= COMPACT_AFTER and self._done > len(self.messages):
+            self._compact()
+
+    def dead_letter(self, message: DeferredMessage, error: Exception):
+        record = {"message": message.as_dict(), "error": repr(error), "at": time.time()}
+        with open(f"{self.path}.dead", "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        logging.error("Moved a deferred message to %s.dead", self.path)
+
+    def _compact(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for message in self.messages:
+                f.write(json.dumps({"put": message.as_dict()}) + "\n")
+        self._file.close()
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._done = 0
+
+
+class DeferredQueue:
+    def __init__(
+        self,
+        post: Callable[[DeferredMessage, Callable[[], None]], None],
+        retry_seconds: float,
+        backend: Optional[MemoryBackend] = None,
+        service: str = "helpscout",
+    ):
+        self.post = post
+        self.retry_seconds = retry_seconds
+        self.service = service
+        self._messages = backend if backend is not None else MemoryBackend()
+        self._lock = threading.Lock()
+        # Held while replaying, so there's only ever one replay going
+        self._replaying = threading.Lock()
+        self._wake = threading.Event()
+        self._drainer: Optional[threading.Thread] = None
+        # time.monotonic() before which the rate limit says not to bother
+        self._paused_until = 0.0
+        metrics.track_gauge("deferred_messages", self.__len__, service=service)
+        metrics.track_gauge(
+            "deferred_oldest_age_seconds", self.oldest_age, service=service
+        )
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    @property
+    def durable(self) -> bool:
+        """Whether the queue outlives the process"""
+        return isinstance(self._messages, Journal)
+
+    def oldest_age(self) -> float:
+        """Seconds the oldest message has been waiting"""
+        with self._lock:
+            oldest = self._messages.first()
+        return max(0.0, time.time() - oldest.deferred_at) if oldest else 0.0
+
+    def put(self, message: DeferredMessage):
+        with self._lock:
+            self._messages.append(message)
+        metrics.increment("deferred_messages_total", result="deferred")
+        # Queued behind others rather than because Help Scout can't take it
+        if time.monotonic() >= self._paused_until and upstream(self.service).available:
+            self._wake.set()
+
+    def start(self):
+        """Retry the queue on a background thread"""
+        with self._lock:
+            if self._drainer is None:
+                self._drainer = threading.Thread(
+                    target=self._drain, name="bling-deferred", daemon=True
+                )
+                self._drainer.start()
+
+    def _drain(self):
+        while True:
+            wait = max(self._paused_until - time.monotonic(), 0)
+            self._wake.wait(wait or self.retry_seconds)
+            self._wake.clear()
+            try:
+                self.replay()
+            except Exception:
+                logging.exception("Failed to replay deferred messages")
+
+    def replay(self, limit: Optional[int] = None) -> int:
+        """Post queued messages in order until one can't be, or limit have
+        been tried; how many were posted"""
+        posted = tried = 0
+        with self._replaying:
+            while time.monotonic() >= self._paused_until and tried != limit:
+                tried += 1
+                with self._lock:
+                    message = self._messages.first()
+                if message is None:
+                    break
+                # Marked done as soon as it's in Help Scout, so nothing that
+                # goes wrong after, like the first message auto reply, has
+                # it posted again
+                done = threading.Event()
+
+                def mark_done():
+                    with self._lock:
+                        self._messages.pop_first()
+                    done.set()
+
+                try:
+                    self.post(message, mark_done)
+                except Exception as e:
+                    if done.is_set():
+                        logging.warning("Posted a deferred message, but %r", e)
+                    elif isinstance(e, RateLimited):
+                        self.pause(e.retry_after)
+                        break
+                    elif isinstance(e, CircuitOpenError) and e.service == self.service:
+                        break
+                    else:
+                        pause = _upstream_error(e)
+                        if pause is not None:
+                            # Not the message's fault, so try it again later
+                            logging.warning(
+                                "Help Scout couldn't take a deferred message: %r", e
+                            )
+                            self.pause(pause or self.retry_seconds)
+                            break
+                        message.attempts += 1
+                        if message.attempts < MAX_ATTEMPTS:
+                            logging.exception("Failed to post a deferred message")
+                            break
+                        logging.exception(
+                            "Giving up on a deferred message after %s attempts",
+                            message.attempts,
+                        )
+                        self._messages.dead_letter(message, e)
+                        metrics.increment(
+                            "deferred_messages_total", result="dead_lettered"
+                        )
+                        mark_done()
+                        continue
+                posted += 1
+                metrics.increment("deferred_messages_total", result="posted")
+                if not done.is_set():
+                    mark_done()
+        return posted
+
+    def pause(self, seconds: float):
+        """Hold off replaying, e.g. for a rate limit's Retry-After"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def _upstream_error(error: Exception) -> Optional[float]:
+    """
+    For an error that's Help Scout's rather than the message's, e.g. a 429
+    whose Retry-After was longer than we'd wait, how long to pause (0 if it
+    didn't say); None for anything else.
+    """
+    # Only here once something has failed, so requests is already loaded
+    import requests
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return 0.0
+    response = getattr(error, "response", None)
+    if not isinstance(error, requests.HTTPError) or response is None:
+        return None
+    if response.status_code == 429:
+        return float(response.headers.get("X-RateLimit-Retry-After", 60))
+    return 0.0 if response.status_code >= 500 else None
+
+
+def _post(message: DeferredMessage, posted: Callable[[], None]):
+    from bling.helpscout import mailboxes
+    from bling.media import Media
+    from bling.phone import Phone
+    from bling.webhooks import post_sms
+
+    mailbox = mailboxes.registry.by_id(message.mailbox_id)
+    if mailbox is None:
+        logging.warning(
+            "Dropping a deferred message for unknown mailbox %s", message.mailbox_id
+        )
+        return
+    post_sms(
+        mailbox,
+        Phone.parse(message.from_phone),
+        message.body,
+        [Media(**m) for m in message.media],
+        posted,
+    )
+
+
+def _backend() -> MemoryBackend:
+    if not config.deferred_journal:
+        return MemoryBackend()
+    try:
+        return Journal(config.deferred_journal)
+    except OSError:
+        logging.exception(
+            "Can't use %s, keeping deferred messages in memory",
+            config.deferred_journal,
+        )
+        return MemoryBackend()
+
+
+_queue: Optional[DeferredQueue] = None
+_queue_lock = threading.Lock()
+
+
+def queue() -> DeferredQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = DeferredQueue(_post, config.deferred_retry_seconds, _backend())
+            _queue.start()
+    return _queue
+
+
+def enabled() -> bool:
+    """Whether messages Help Scout can't take now can be queued, which is only
+    when the queue is kept in a journal that outlives the process"""
+    return bool(config.deferred_journal) and not config.on_lambda and queue().durable
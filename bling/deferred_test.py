@@ -0,0 +1,280 @@
+import json
+import time
+
+import pytest
+import requests
+
+from bling import deferred, webhooks
+from bling.common import metrics
+from bling.common.resilience import CircuitOpenError, RateLimited
+from bling.config import Config, config
+from bling.deferred import (
+    MAX_ATTEMPTS,
+    DeferredMessage,
+    DeferredQueue,
+    Journal,
+)
+from bling.helpscout.mailboxes import Mailbox
+from bling.phone import Phone
+
+MAILBOX = Mailbox(
+    transport_type="twilio", phone=Phone.parse("+16175550100"), id=1, mc_campaign_id=""
+)
+SUPPORTER = Phone.parse("+16175550111")
+
+
+class Poster:
+    def __init__(self):
+        self.posted = []
+        self.error = None
+
+    def __call__(self, message, posted):
+        if self.error is not None:
+            raise self.error
+        self.posted.append(message.body)
+
+
+def test_replays_in_order_once_help_scout_is_back():
+    poster = Poster()
+    queue = DeferredQueue(poster, retry_seconds=60)
+    poster.error = CircuitOpenError("helpscout")
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "one"))
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "two"))
+
+    assert queue.replay() == 0
+    assert len(queue) == 2
+
+    poster.error = None
+    assert queue.replay() == 2
+    assert poster.posted == ["one", "two"]
+    assert len(queue) == 0
+
+
+def test_rate_limit_pauses_the_replay():
+    poster = Poster()
+    queue = DeferredQueue(poster, retry_seconds=60)
+    poster.error = RateLimited("helpscout", retry_after=0.2)
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "one"))
+
+    assert queue.replay() == 0
+    poster.error = None
+    # Still waiting out the Retry-After, and it isn't held against the message
+    assert queue.replay() == 0
+    assert queue._messages.first().attempts == 0
+
+    time.sleep(0.25)
+    assert queue.replay() == 1
+    assert poster.posted == ["one"]
+
+
+def test_never_posts_again_once_its_in_help_scout():
+    calls = []
+
+    def post(message, posted):
+        calls.append(message.body)
+        posted()
+        raise RuntimeError("couldn't send the auto reply")
+
+    queue = DeferredQueue(post, retry_seconds=60)
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "one"))
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "two"))
+
+    assert queue.replay() == 2
+    assert calls == ["one", "two"]
+    assert len(queue) == 0
+
+
+def _http_error(status, **headers):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers)
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        _http_error(503),
+        _http_error(429, **{"X-RateLimit-Retry-After": "120"}),
+        requests.ConnectionError("reset"),
+    ],
+)
+def test_help_scout_errors_pause_the_replay(error):
+    poster = Poster()
+    queue = DeferredQueue(poster, retry_seconds=60)
+    poster.error = error
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "one"))
+
+    for _ in range(MAX_ATTEMPTS + 1):
+        queue._paused_until = 0
+        assert queue.replay() == 0
+    # Never held against the message
+    assert queue._messages.first().attempts == 0
+    assert queue._paused_until > time.monotonic() + 30
+
+
+def test_dead_letters_a_message_that_keeps_failing(tmp_path):
+    path = str(tmp_path / "deferred.jsonl")
+    poster = Poster()
+    queue = DeferredQueue(poster, retry_seconds=60, backend=Journal(path))
+    poster.error = ValueError("bad message")
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "bad"))
+    queue.put(DeferredMessage(1, SUPPORTER.twilio_format, "next"))
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert queue.replay() == 0
+        assert len(queue) == 2
+    queue.replay(limit=1)
+    assert len(queue) == 1
+    poster.error = None
+    assert queue.replay() == 1
+    assert poster.posted == ["next"]
+
+    with open(f"{path}.dead") as f:
+        [record] = [json.loads(line) for line in f]
+    assert record["message"]["body"] == "bad"
+    assert "bad message" in record["error"]
+
+
+@pytest.fixture
+def queue(monkeypatch, tmp_path):
+    path = str(tmp_path / "deferred.jsonl")
+    monkeypatch.setitem(config.__dict__, "deferred_journal", path)
+    monkeypatch.setitem(config.__dict__, "on_lambda", False)
+    queue = DeferredQueue(Poster(), retry_seconds=60, backend=Journal(path))
+    monkeypatch.setattr(deferred, "_queue", queue)
+    return queue
+
+
+def test_deliver_sms_defers_while_help_scout_is_down(monkeypatch, queue):
+    posted = []
+
+    def post_sms(mailbox, from_phone, body, attachments, on_posted=None):
+        if body == "down":
+            raise CircuitOpenError("helpscout")
+        posted.append(body)
+        return 123, 456
+
+    monkeypatch.setattr(webhooks, "post_sms", post_sms)
+
+    assert webhooks.deliver_sms(MAILBOX, SUPPORTER, "down", []) == (None, None)
+    [message] = queue._messages.messages
+    assert (message.mailbox_id, message.body) == (1, "down")
+
+    # Later messages wait their turn behind it
+    assert webhooks.deliver_sms(MAILBOX, SUPPORTER, "up", []) == (None, None)
+    assert len(queue) == 2
+    assert posted == []
+
+    queue._messages.messages.clear()
+    assert webhooks.deliver_sms(MAILBOX, SUPPORTER, "up", []) == (123, 456)
+
+
+@pytest.mark.parametrize(
+    "journal, on_lambda", [("", False), ("/tmp/deferred.jsonl", True)]
+)
+def test_deliver_sms_fails_without_a_journal(monkeypatch, journal, on_lambda):
+    monkeypatch.setitem(config.__dict__, "deferred_journal", journal)
+    monkeypatch.setitem(config.__dict__, "on_lambda", on_lambda)
+    monkeypatch.setattr(deferred, "_queue", None)
+
+    def post_sms(mailbox, from_phone, body, attachments, on_posted=None):
+        raise CircuitOpenError("helpscout")
+
+    monkeypatch.setattr(webhooks, "post_sms", post_sms)
+    # So Twilio retries it, or texts its fallback
+    with pytest.raises(CircuitOpenError):
+        webhooks.deliver_sms(MAILBOX, SUPPORTER, "hi", [])
+    assert deferred._queue is None
+
+
+def test_deliver_sms_doesnt_defer_for_other_services(monkeypatch, queue):
+    def post_sms(mailbox, from_phone, body, attachments, on_posted=None):
+        raise CircuitOpenError("twilio")
+
+    monkeypatch.setattr(webhooks, "post_sms", post_sms)
+    with pytest.raises(CircuitOpenError):
+        webhooks.deliver_sms(MAILBOX, SUPPORTER, "hi", [])
+    assert len(queue) == 0
+
+
+def test_deliver_sms_defers_when_rate_limited(monkeypatch, queue):
+    def post_sms(mailbox, from_phone, body, attachments, on_posted=None):
+        raise RateLimited("helpscout", retry_after=30)
+
+    monkeypatch.setattr(webhooks, "post_sms", post_sms)
+    assert webhooks.deliver_sms(MAILBOX, SUPPORTER, "hi", []) == (None, None)
+    assert len(queue) == 1
+    assert queue.replay() == 0
+
+
+def test_journal_outlives_the_queue(tmp_path):
+    path = str(tmp_path / "deferred.jsonl")
+    poster = Poster()
+    queue = DeferredQueue(poster, retry_seconds=60, backend=Journal(path))
+    for body in ["one", "two", "three"]:
+        queue.put(DeferredMessage(1, SUPPORTER.twilio_format, body))
+    # Post the first, then pretend the process died before the rest
+    queue._messages.pop_first()
+    with open(path, "a") as f:
+        f.write('{"put": {"mailbox_id": 1, "fr')
+
+    restarted = DeferredQueue(poster, retry_seconds=60, backend=Journal(path))
+    assert restarted.replay() == 2
+    assert poster.posted == ["two", "three"]
+    assert len(Journal(path)) == 0
+
+
+def test_journal_compacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(deferred, "COMPACT_AFTER", 3)
+    path = tmp_path / "deferred.jsonl"
+    journal = Journal(str(path))
+    for n in range(4):
+        journal.append(DeferredMessage(1, SUPPORTER.twilio_format, str(n)))
+    for _ in range(3):
+        journal.pop_first()
+
+    # Only the message still queued is left in the file
+    assert len(path.read_text().splitlines()) == 1
+    journal.append(DeferredMessage(1, SUPPORTER.twilio_format, "4"))
+    assert [m.body for m in Journal(str(path)).messages] == ["3", "4"]
+
+
+def test_depth_and_age_metrics():
+    metrics.reset()
+    queue = DeferredQueue(Poster(), retry_seconds=60, service="test")
+    assert metrics.gauge_value("deferred_messages", service="test") == 0
+    queue.put(
+        DeferredMessage(1, SUPPORTER.twilio_format, "hi", deferred_at=time.time() - 5)
+    )
+    assert metrics.gauge_value("deferred_messages", service="test") == 1
+    assert metrics.gauge_value("deferred_oldest_age_seconds", service="test") >= 5
+    metrics.reset()
+
+
+@pytest.mark.parametrize(
+    "env, spill",
+    [
+        ({}, False),
+        ({"BLING_DEFERRED_JOURNAL": "/tmp/j.jsonl"}, True),
+        (
+            {"BLING_DEFERRED_JOURNAL": "/tmp/j.jsonl", "AWS_LAMBDA_FUNCTION_NAME": "f"},
+            False,
+        ),
+        ({"BLING_SPILL_RATE_LIMITED": "1"}, False),
+        (
+            {"BLING_DEFERRED_JOURNAL": "/tmp/j.jsonl", "BLING_SPILL_RATE_LIMITED": "0"},
+            False,
+        ),
+    ],
+)
+def test_spilling_needs_somewhere_safe(monkeypatch, env, spill):
+    for name in [
+        "BLING_DEFERRED_JOURNAL",
+        "AWS_LAMBDA_FUNCTION_NAME",
+        "BLING_SPILL_RATE_LIMITED",
+    ]:
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    assert Config().spill_rate_limited == spill
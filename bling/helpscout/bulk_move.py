@@ -0,0 +1,254 @@
+"""
+Move conversations from one Help Scout mailbox to another in bulk, e.g. when
+a number in BLING_MAILBOXES is retired or a hotline's mailbox is split.
+
+    python -m bling.helpscout.bulk_move --from 206906 --to 301122
+        [--status active] [--filter 'tag:"spanish"'] [--concurrency 4]
+        [--checkpoint move.json] [--limit 1000] [--dry-run] [--json]
+
+Candidates are streamed from the conversation list a page at a time and
+moved on a thread pool, within HELPSCOUT_REQUESTS_PER_MINUTE if that's set.
+Moved conversations drop out of the list, which shifts the later pages, so
+the list is walked again until a pass moves nothing new.
+
+With --checkpoint, progress is saved to that file as the job goes, and
+running the same command again carries on where it stopped. Conversations
+that failed to move are tried again on the next run.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set
+
+import requests
+
+from bling.common.resilience import UpstreamUnavailable
+
+SAVE_EVERY = 50
+
+
+@dataclass
+class Checkpoint:
+    source: int
+    destination: int
+    moved: Set[int] = field(default_factory=set)
+    failed: Dict[int, str] = field(default_factory=dict)
+    path: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: Optional[str], source: int, destination: int) -> "Checkpoint":
+        checkpoint = cls(source, destination, path=path)
+        if path is None or not os.path.exists(path):
+            return checkpoint
+        with open(path) as f:
+            data = json.load(f)
+        if (data["source"], data["destination"]) != (source, destination):
+            raise ValueError(
+                f"{path} is a checkpoint for moving {data['source']} to "
+                f"{data['destination']}, not {source} to {destination}"
+            )
+        checkpoint.moved = set(data["moved"])
+        # Failures get another go
+        return checkpoint
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "source": self.source,
+                    "destination": self.destination,
+                    "moved": sorted(self.moved),
+                    "failed": {str(k): v for k, v in sorted(self.failed.items())},
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+
+@dataclass
+class MoveReport:
+    moved: int = 0
+    failed: int = 0
+    # Already moved according to the checkpoint
+    skipped: int = 0
+    passes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def per_second(self) -> float:
+        return self.moved / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "moved": self.moved,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "passes": self.passes,
+            "elapsed": round(self.elapsed, 2),
+            "per_second": round(self.per_second, 2),
+        }
+
+
+def _candidates(
+    client, checkpoint: Checkpoint, status: str, filters: Dict[str, str]
+) -> Iterator[int]:
+    for conversation in client.iter_conversations(
+        mailbox_ids=[checkpoint.source], status=status, filters=filters
+    ):
+        # The list can lag behind a move we've just made
+        if conversation.get("mailboxId", checkpoint.source) == checkpoint.source:
+            yield conversation["id"]
+
+
+def bulk_move(
+    client,
+    checkpoint: Checkpoint,
+    status: str = "all",
+    filters: Dict[str, str] = {},
+    concurrency: int = 4,
+    limit: Optional[int] = None,
+    dry_run: bool = False,
+) -> MoveReport:
+    report = MoveReport()
+    start = time.perf_counter()
+    # Everything tried in this run, so failures aren't retried pass after pass
+    attempted: Set[int] = set()
+    started = 0
+
+    def move(conversation_id: int) -> None:
+        client.move_conversation(conversation_id, checkpoint.destination)
+
+    def collect(done: Set[Future]):
+        for future in done:
+            conversation_id = pending.pop(future)
+            try:
+                future.result()
+            except (requests.RequestException, UpstreamUnavailable) as e:
+                logging.warning(
+                    "Failed to move conversation %s: %s", conversation_id, e
+                )
+                checkpoint.failed[conversation_id] = str(e)
+                report.failed += 1
+            else:
+                checkpoint.moved.add(conversation_id)
+                checkpoint.failed.pop(conversation_id, None)
+                report.moved += 1
+                if report.moved % SAVE_EVERY == 0:
+                    checkpoint.save()
+
+    pending: Dict[Future, int] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                report.passes += 1
+                moved_before = report.moved
+                for conversation_id in _candidates(client, checkpoint, status, filters):
+                    if conversation_id in attempted:
+                        continue
+                    attempted.add(conversation_id)
+                    if conversation_id in checkpoint.moved:
+                        report.skipped += 1
+                        continue
+                    if limit is not None and started >= limit:
+                        break
+                    started += 1
+                    if dry_run:
+                        report.moved += 1
+                        continue
+                    pending[pool.submit(move, conversation_id)] = conversation_id
+                    # Keep the pool busy without reading the whole list up front
+                    if len(pending) >= concurrency * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                collect(set(pending))
+                limited = limit is not None and started >= limit
+                if dry_run or limited or report.moved == moved_before:
+                    break
+    finally:
+        if not dry_run:
+            # The pool has finished what it started, so record those too
+            for future in list(pending):
+                with contextlib.suppress(Exception):
+                    collect({future})
+            checkpoint.save()
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def _parse_filters(values: List[str]) -> Dict[str, str]:
+    filters = {}
+    for value in values:
+        key, sep, query = value.partition(":")
+        if not sep:
+            raise SystemExit(f"Filters look like field:value, not {value!r}")
+        filters[key] = query
+    return filters
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--from", dest="source", type=int, required=True)
+    parser.add_argument("--to", dest="destination", type=int, required=True)
+    parser.add_argument("--status", default="all", help="e.g. active, closed, all")
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        help="Help Scout search field:value, e.g. 'tag:\"spanish\"' (repeatable)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--checkpoint", help="file to save and resume progress in")
+    parser.add_argument("--limit", type=int, help="stop after this many moves")
+    parser.add_argument("--dry-run", action="store_true", help="count, don't move")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args(argv)
+    if args.source == args.destination:
+        parser.error("--from and --to are the same mailbox")
+    return args
+
+
+def main(argv=None):
+    from bling.clients import helpscout_client
+
+    args = parse_args(argv)
+    try:
+        checkpoint = Checkpoint.load(args.checkpoint, args.source, args.destination)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    report = bulk_move(
+        helpscout_client(),
+        checkpoint,
+        status=args.status,
+        filters=_parse_filters(args.filter),
+        concurrency=args.concurrency,
+        limit=args.limit,
+        dry_run=args.dry_run,
+    )
+
+    if args.json:
+        print(json.dumps(report.as_dict(), indent=2))
+        return
+    verb = "Would move" if args.dry_run else "Moved"
+    print(
+        f"{verb} {report.moved} conversations from {args.source} to "
+        f"{args.destination} in {report.elapsed:.1f}s ({report.per_second:.1f}/s), "
+        f"{report.failed} failed, {report.skipped} already moved"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from bling.bench.fakes import FakeHelpScout
+from bling.common.resilience import CircuitOpenError
+from bling.helpscout.bulk_move import Checkpoint, bulk_move
+from bling.helpscout.client import HelpScoutClient
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(helpscout):
+    with HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s") as c:
+        yield c
+
+
+def add_conversations(helpscout, mailbox_id, count):
+    return [
+        helpscout.add_conversation(mailbox_id, f"{i}@example.com").id
+        for i in range(count)
+    ]
+
+
+def test_moves_every_page_despite_shifting_pages(helpscout, client, tmp_path):
+    # Several pages, which shift as conversations move out of the mailbox
+    ids = add_conversations(helpscout, 1, helpscout.PAGE_SIZE * 3 + 5)
+    add_conversations(helpscout, 3, 5)
+    path = str(tmp_path / "move.json")
+
+    report = bulk_move(client, Checkpoint(1, 2, path=path), concurrency=3)
+
+    assert report.moved == len(ids)
+    assert report.failed == 0
+    assert report.passes > 1
+    assert (
+        sorted(c.id for c in helpscout.conversations.values() if c.mailbox_id == 2)
+        == ids
+    )
+    with open(path) as f:
+        assert sorted(json.load(f)["moved"]) == ids
+
+
+def test_resumes_from_checkpoint(helpscout, client, tmp_path):
+    ids = add_conversations(helpscout, 1, 10)
+    path = str(tmp_path / "move.json")
+
+    first = bulk_move(client, Checkpoint.load(path, 1, 2), limit=4)
+    assert first.moved == 4
+
+    # Pretend one of the moves was undone, so it shows up in the list again
+    helpscout.conversations[ids[0]].mailbox_id = 1
+    helpscout.requests.clear()
+    second = bulk_move(client, Checkpoint.load(path, 1, 2))
+
+    assert second.moved == 6
+    assert second.skipped == 1
+    assert all(helpscout.conversations[i].mailbox_id == 2 for i in ids[1:])
+    assert f"PATCH /v2/conversations/{ids[0]}" not in helpscout.requests
+
+    with pytest.raises(ValueError):
+        Checkpoint.load(path, 1, 3)
+
+
+def test_dry_run_moves_nothing(helpscout, client):
+    ids = add_conversations(helpscout, 1, 30)
+    report = bulk_move(client, Checkpoint(1, 2), dry_run=True)
+    assert report.moved == len(ids)
+    assert all(c.mailbox_id == 1 for c in helpscout.conversations.values())
+
+
+class FlakyClient:
+    def __init__(self, client, errors):
+        self.client = client
+        self.errors = errors
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def move_conversation(self, conversation_id, destination):
+        if conversation_id in self.errors:
+            raise self.errors[conversation_id]
+        return self.client.move_conversation(conversation_id, destination)
+
+
+def test_saves_progress_when_it_stops_early(helpscout, client, tmp_path):
+    ids = add_conversations(helpscout, 1, 10)
+    path = str(tmp_path / "move.json")
+    flaky = FlakyClient(
+        client, {ids[2]: CircuitOpenError("helpscout"), ids[5]: RuntimeError("bug")}
+    )
+
+    with pytest.raises(RuntimeError):
+        bulk_move(flaky, Checkpoint(1, 2, path=path), concurrency=1)
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert {ids[0], ids[1], ids[3], ids[4]} <= set(saved["moved"])
+    assert list(saved["failed"]) == [str(ids[2])]
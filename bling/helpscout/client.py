@@ -1,15 +1,46 @@
+import base64
+import html
+import json
 import logging
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict, dataclass, field
 from enum import Enum
-from typing import Any, Dict, Iterator, List, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
 
 import requests
 
 from bling.config import config
+from bling.common import logs, metrics
+from bling.common.lru import LRUCache
+from bling.common.rate_limit import TokenBucket
+from bling.common.resilience import (
+    OK,
+    RateLimited,
+    Upstream,
+    UpstreamUnavailable,
+    Verdict,
+    upstream,
+)
 from bling.common.utils import nested_get
 
 HELPSCOUT_BASE_URL = "https://api.helpscout.net"
+ATTACHMENT_CHUNK_BYTES = 3 * 16 * 1024
+# Requests that are safe to send again after an error, since they don't
+# create anything
+IDEMPOTENT_METHODS = {"GET", "PUT", "PATCH", "DELETE"}
 
 
 class ThreadType(Enum):
@@ -75,11 +106,140 @@ class Conversation:
     status: str = field(default="active")
     type: str = field(default="phone")
     autoReply: bool = field(default=False)
+    # Imported conversations don't notify anyone or trigger auto replies
+    imported: bool = field(default=False)
+
+
+@dataclass
+class TagChange:
+    """Tags to add to and remove from a conversation, by name"""
+
+    conversation_id: int
+    add: List[str] = field(default_factory=list)
+    remove: List[str] = field(default_factory=list)
+
+
+@dataclass
+class TagResult:
+    conversation_id: int
+    tags: Optional[List[str]] = None
+    # HTTP status of the PUT, or None if the tags were already right
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def merge_tags(current: Iterable[str], changes: Iterable[TagChange]) -> List[str]:
+    """Apply changes to a conversation's tags in order"""
+    tags = list(current)
+    for change in changes:
+        remove = set(change.remove)
+        tags = [t for t in tags if t not in remove]
+        for t in change.add:
+            if t not in tags:
+                tags.append(t)
+    return tags
+
+
+def tags_by_conversation(
+    conversations: Iterable[Dict[str, Any]],
+) -> Dict[int, List[str]]:
+    """Tag names for each conversation in a list or search page"""
+    return {c["id"]: [t["tag"] for t in c.get("tags") or []] for c in conversations}
+
+
+def conversation_version(conversation: Dict[str, Any]) -> Hashable:
+    """Changes whenever the conversation or its threads do"""
+    # userUpdatedAt alone misses customer replies, so count the threads too
+    return (
+        conversation.get("modifiedAt") or conversation.get("userUpdatedAt"),
+        conversation.get("threads"),
+    )
+
+
+def _plain_text(body: str) -> str:
+    """A thread's text without the HTML Help Scout may have wrapped it in, or
+    differences in whitespace"""
+    text = re.sub(r"<br\s*/?>", "\n", body, flags=re.IGNORECASE)
+    return " ".join(html.unescape(re.sub(r"<[^>]*>", " ", text)).split())
+
+
+def _conversation_list_params(
+    mailbox_ids: Optional[List[int]],
+    status: str,
+    filters: Dict[str, Any],
+    sort_field: str,
+    sort_order: str,
+) -> Dict[str, str]:
+    params = {"status": status, "sortField": sort_field, "sortOrder": sort_order}
+
+    if mailbox_ids:
+        params["mailbox"] = ",".join(str(i) for i in mailbox_ids)
+
+    if filters:
+        query = " AND ".join([f"{k}:{v}" for k, v in filters.items()])
+        params["query"] = f"({query})"
+
+    return params
+
+
+def judge_response(
+    method: str, res: Optional[requests.Response], error: Optional[Exception]
+) -> Verdict:
+    """Whether a Help Scout API call failed, and whether to try it again"""
+    if error is not None:
+        if not isinstance(error, requests.RequestException):
+            return OK
+        # A request that never connected never reached Help Scout
+        retry = isinstance(error, requests.ConnectTimeout) or (
+            method in IDEMPOTENT_METHODS
+            and isinstance(error, (requests.ConnectionError, requests.Timeout))
+        )
+        return Verdict(failed=True, retry=retry, reason=type(error).__name__)
+    assert res is not None
+    if res.status_code == 429:
+        # Help Scout is fine, we're just going too fast
+        return Verdict(
+            failed=False,
+            retry=True,
+            delay=int(res.headers.get("X-RateLimit-Retry-After", 60)),
+            reason="429",
+        )
+    if res.status_code >= 500:
+        return Verdict(
+            failed=True,
+            retry=method in IDEMPOTENT_METHODS or res.status_code == 503,
+            reason=str(res.status_code),
+        )
+    return OK
 
 
 class HelpScoutClient:
-    def __init__(self, base_url=HELPSCOUT_BASE_URL, client_id=None, secret=None):
-        self._session = requests.session()
+    def __init__(
+        self,
+        base_url=HELPSCOUT_BASE_URL,
+        client_id=None,
+        secret=None,
+        session=None,
+        requests_per_minute: Optional[float] = None,
+        conversation_cache_size: int = 256,
+        resilience: Optional[Upstream] = None,
+    ):
+        self._session = session if session is not None else requests.session()
+        # Retries and the circuit breaker, shared by every Help Scout client
+        # in the process unless one is given
+        self._upstream = resilience or upstream("helpscout")
+        # Shared by every thread using this client
+        self._rate_limit = (
+            TokenBucket(rate=requests_per_minute / 60, capacity=1)
+            if requests_per_minute
+            else None
+        )
+        # conversation id -> (version, conversation with all its threads)
+        self._conversations = LRUCache(conversation_cache_size)
         self._base_url = base_url.strip("/")
         self._client_id = client_id or config.helpscout_api_client_id
         self._secret = secret or config.helpscout_api_client_secret
@@ -100,35 +260,80 @@ class HelpScoutClient:
         self._token = res.json()["access_token"]
 
     def _make_request(
-        self, method, path, params=None, json_body=None, absolute_url=False
+        self,
+        method,
+        path,
+        params=None,
+        json_body=None,
+        absolute_url=False,
+        stream_body: Optional[Callable[[], Iterator[bytes]]] = None,
+        spill: bool = False,
     ):
-        logging.debug(f"[{method}] {path} params={params} json_body={json_body}")
+        """stream_body makes a fresh iterator of JSON body chunks for each
+        attempt, sent with chunked transfer encoding instead of json_body.
+
+        With spill, a 429 raises RateLimited straight away instead of
+        waiting out Help Scout's Retry-After, so the caller can put the
+        work aside (see bling/deferred.py)."""
+        logging.debug(
+            "[%s] %s params=%s json_body=%s",
+            method,
+            path,
+            logs.preview(params),
+            logs.preview(json_body),
+        )
         url = path if absolute_url else self._base_url + path
 
+        operation = f"{method} {metrics.path_template(path)}"
+
         def _req():
-            return self._session.request(
+            if self._rate_limit is not None:
+                self._rate_limit.acquire()
+            headers = {"Authorization": f"Bearer {self._token}"}
+            data = None
+            if stream_body is not None:
+                headers["Content-Type"] = "application/json"
+                data = stream_body()
+            start = time.perf_counter()
+            res = self._session.request(
                 method=method,
-                headers={"Authorization": f"Bearer {self._token}"},
+                headers=headers,
                 url=url,
                 json=json_body,
+                data=data,
                 params=params,
             )
-
-        res = _req()
-        if res.status_code == 429:
-            sleep_seconds = int(res.headers.get("X-RateLimit-Retry-After", 60))
-            logging.info(
-                f"Help Scout rate limit exceeded sleeping {sleep_seconds} seconds"
+            body = res.request.body
+            metrics.record_upstream(
+                "helpscout",
+                operation,
+                res.status_code,
+                time.perf_counter() - start,
+                request_bytes=len(body) if isinstance(body, (bytes, str)) else 0,
+                response_bytes=len(res.content),
             )
-            time.sleep(sleep_seconds)
-            res = _req()
+            return res
+
+        def judge(res, error):
+            if spill and res is not None and res.status_code == 429:
+                return OK
+            return judge_response(method, res, error)
+
+        res = self._upstream.call(_req, judge)
+        if spill and res.status_code == 429:
+            retry_after = int(res.headers.get("X-RateLimit-Retry-After", 60))
+            metrics.increment("helpscout_requests_spilled_total", method=method)
+            raise RateLimited("helpscout", retry_after)
         if res.status_code == 401:
+            metrics.increment("upstream_retries_total", service="helpscout", reason=401)
             self._authenticate()
-            res = _req()
+            res = self._upstream.call(_req, judge)
         try:
             res.raise_for_status()
         except requests.HTTPError as e:
-            logging.error(f"Error response from Help Scout {e.response.content}")
+            logging.error(
+                "Error response from Help Scout %s", logs.preview(e.response.content)
+            )
             raise e
         return res
 
@@ -156,8 +361,11 @@ class HelpScoutClient:
         res = self._make_request("POST", "/v2/customers", json_body=payload)
         return res.headers["Resource-ID"]
 
-    def create_conversation(self, conversation: Conversation):
-        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/create/"""
+    def create_conversation(self, conversation: Conversation, spill: bool = False):
+        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/create/
+
+        See _make_request for spill.
+        """
         payload = asdict(conversation)
         for t in payload["threads"]:
             # This would be cleaner if we could make the enum serializable
@@ -165,7 +373,9 @@ class HelpScoutClient:
             # createdAt not supported when imported = false
             if not t["imported"]:
                 del t["createdAt"]
-        return self._make_request("POST", "/v2/conversations", json_body=payload)
+        return self._make_request(
+            "POST", "/v2/conversations", json_body=payload, spill=spill
+        )
 
     def find_conversations(
         self,
@@ -174,20 +384,52 @@ class HelpScoutClient:
         filters: Dict[str, Any] = {},
         sort_field: str = "createdAt",
         sort_order: str = "desc",
+        spill: bool = False,
     ) -> List[Dict[str, Any]]:
-        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/list/"""
-        params = {"status": status, "sortField": sort_field, "sortOrder": sort_order}
-
-        if mailbox_ids:
-            params["mailbox"] = ",".join(str(i) for i in mailbox_ids)
+        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/list/
 
-        if filters:
-            query = " AND ".join([f"{k}:{v}" for k, v in filters.items()])
-            params["query"] = f"({query})"
+        See _make_request for spill.
+        """
+        params = _conversation_list_params(
+            mailbox_ids, status, filters, sort_field, sort_order
+        )
+        res = self._make_request("GET", "/v2/conversations", params=params, spill=spill)
+        return res.json()["_embedded"]["conversations"]
 
-        return self._make_request("GET", "/v2/conversations", params=params).json()[
-            "_embedded"
-        ]["conversations"]
+    def iter_conversations(
+        self,
+        mailbox_ids: List[int] = None,
+        status: str = "all",
+        filters: Dict[str, Any] = {},
+        sort_field: str = "createdAt",
+        sort_order: str = "asc",
+        modified_since: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Like find_conversations, but yields every page's conversations,
+        fetching each page as the previous one runs out"""
+        for page in self.iter_conversation_pages(
+            mailbox_ids, status, filters, sort_field, sort_order, modified_since
+        ):
+            yield from page
+
+    def iter_conversation_pages(
+        self,
+        mailbox_ids: List[int] = None,
+        status: str = "all",
+        filters: Dict[str, Any] = {},
+        sort_field: str = "createdAt",
+        sort_order: str = "asc",
+        modified_since: Optional[str] = None,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """iter_conversations a page at a time"""
+        params = _conversation_list_params(
+            mailbox_ids, status, filters, sort_field, sort_order
+        )
+        if modified_since:
+            params["modifiedSince"] = modified_since
+        first_page = self._make_request("GET", "/v2/conversations", params=params)
+        for page in self._paginate(first_page):
+            yield nested_get(page.json(), "_embedded", "conversations") or []
 
     def find_conversations_for_customer(
         self, customer_id: int, mailbox_ids: List[int] = None, status: str = "all"
@@ -198,9 +440,62 @@ class HelpScoutClient:
         )
 
     def get_threads_for_conversation(self, conversation_id):
-        # TODO: paginate by default?
+        """The first page of threads, see iter_threads for all of them"""
         return self._make_request("GET", f"/v2/conversations/{conversation_id}/threads")
 
+    def iter_threads(self, conversation_id: int) -> Iterator[Dict[str, Any]]:
+        for page in self._paginate(self.get_threads_for_conversation(conversation_id)):
+            yield from nested_get(page.json(), "_embedded", "threads") or []
+
+    def hydrate_conversation(
+        self, conversation_id: int, version: Optional[Hashable] = None
+    ) -> Dict[str, Any]:
+        """A conversation with every thread in _embedded.threads.
+
+        If version (see conversation_version) is given, e.g. from a list page,
+        and matches the cached copy, that's returned without calling the API.
+        Treat the result as read only, it may be shared.
+        """
+        if version is not None:
+            cached = self._conversations.get(conversation_id)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        conversation = self.get_conversation(
+            conversation_id, include_threads=True
+        ).json()
+        threads = nested_get(conversation, "_embedded", "threads") or []
+        if len(threads) < (conversation.get("threads") or 0):
+            # Too many to embed, fetch them all from the threads endpoint
+            conversation.setdefault("_embedded", {})["threads"] = list(
+                self.iter_threads(conversation_id)
+            )
+        self._conversations.put(
+            conversation_id, (conversation_version(conversation), conversation)
+        )
+        return conversation
+
+    def hydrate_conversations(
+        self,
+        conversations: Iterable[Union[int, Dict[str, Any]]],
+        concurrency: int = 4,
+    ) -> Dict[int, Dict[str, Any]]:
+        """hydrate_conversation for many conversations at once.
+
+        Pass conversations from list pages (e.g. iter_conversations) rather
+        than bare ids, so unchanged ones come from the cache.
+        """
+
+        def hydrate(conversation: Union[int, Dict[str, Any]]) -> Dict[str, Any]:
+            if isinstance(conversation, dict):
+                return self.hydrate_conversation(
+                    conversation["id"], conversation_version(conversation)
+                )
+            return self.hydrate_conversation(conversation)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return {c["id"]: c for c in pool.map(hydrate, conversations)}
+
     def delete_thread(self, conversation_id, thread_id):
         return self._make_request(
             "PATCH",
@@ -208,8 +503,37 @@ class HelpScoutClient:
             json_body={"op": "remove"},
         )
 
-    def add_thread_to_conversation(self, conversation_id: int, thread: Thread):
-        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/threads/reply/"""
+    def update_thread_text(self, conversation_id: int, thread_id: int, text: str):
+        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/threads/update/"""
+        return self._make_request(
+            "PATCH",
+            f"/v2/conversations/{conversation_id}/threads/{thread_id}",
+            json_body={"op": "replace", "path": "/text", "value": text},
+        )
+
+    def customer_thread_id(self, conversation_id: int, text: str) -> Optional[int]:
+        """
+        The customer thread we posted with this text, e.g. in a new
+        conversation, where Help Scout doesn't tell us the thread's id. If
+        there's more than one, the newest (highest id), whatever order they're
+        listed in.
+        """
+        wanted = _plain_text(text)
+        ids = [
+            t["id"]
+            for t in self.iter_threads(conversation_id)
+            if t.get("type") == "customer"
+            and _plain_text(t.get("body") or "") == wanted
+        ]
+        return max(ids) if ids else None
+
+    def add_thread_to_conversation(
+        self, conversation_id: int, thread: Thread, spill: bool = False
+    ):
+        """https://developer.helpscout.com/mailbox-api/endpoints/conversations/threads/reply/
+
+        See _make_request for spill.
+        """
         payload = asdict(thread)
         del payload["type"]  # not needed here since we use the type in the path name
         # createdAt not supported when imported = false
@@ -219,6 +543,36 @@ class HelpScoutClient:
             "POST",
             f"/v2/conversations/{conversation_id}/{thread.type.path_name}",
             json_body=payload,
+            spill=spill,
+        )
+
+    def upload_attachment(
+        self,
+        conversation_id: int,
+        thread_id: int,
+        file_name: str,
+        mime_type: str,
+        path: str,
+    ):
+        """Attach a file to a thread, streaming it from disk rather than
+        reading it all into memory to base64 encode it.
+
+        https://developer.helpscout.com/mailbox-api/endpoints/conversations/threads/attachments/upload/
+        """
+
+        def body() -> Iterator[bytes]:
+            head = json.dumps({"fileName": file_name, "mimeType": mime_type})
+            yield head[:-1].encode("utf-8") + b', "data": "'
+            with open(path, "rb") as f:
+                # Multiples of 3 bytes base64 encode without padding
+                for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK_BYTES), b""):
+                    yield base64.b64encode(chunk)
+            yield b'"}'
+
+        return self._make_request(
+            "POST",
+            f"/v2/conversations/{conversation_id}/threads/{thread_id}/attachments",
+            stream_body=body,
         )
 
     def move_conversation(self, conversation_id, new_mailbox):
@@ -262,21 +616,68 @@ class HelpScoutClient:
             page = self._make_request("GET", next_page, absolute_url=True)
 
     def update_conversation_tags(
-        self, conversation_id, remove: List[str] = None, add: List[str] = None
+        self,
+        conversation_id,
+        remove: List[str] = None,
+        add: List[str] = None,
+        current_tags: List[str] = None,
     ):
         """Remove and add tags to a conversation.
 
+        Pass current_tags if you already have them (e.g. from a list page) to
+        skip fetching the conversation.
+
         Note: Tags are passed by name, not id
         """
-        add = add if add else []
-        remove = set(remove) if remove else set()  # type: ignore
+        if current_tags is None:
+            current_tags = self._current_tags(conversation_id)
+        tags = merge_tags(
+            current_tags, [TagChange(conversation_id, add or [], remove or [])]
+        )
+        return self.put_conversation_tags(conversation_id, tags)
+
+    def _current_tags(self, conversation_id: int) -> List[str]:
         previous_tags = self.get_conversation(conversation_id).json()["tags"]
-        tags = [t["tag"] for t in previous_tags if t["tag"] not in remove]
-        for t in add:
-            if t not in tags:
-                tags.append(t)
+        return [t["tag"] for t in previous_tags]
 
-        return self.put_conversation_tags(conversation_id, tags)
+    def bulk_update_conversation_tags(
+        self,
+        changes: Iterable[TagChange],
+        known_tags: Mapping[int, List[str]] = None,
+        concurrency: int = 4,
+    ) -> Dict[int, TagResult]:
+        """Apply many tag changes with at most one PUT per conversation.
+
+        Changes to the same conversation are merged in order. Conversations in
+        known_tags (see tags_by_conversation) aren't fetched first, and
+        conversations whose tags wouldn't change aren't updated. Requests run on
+        `concurrency` threads, within the client's rate limit. A failure only
+        affects that conversation's result.
+        """
+        known_tags = known_tags or {}
+        grouped: Dict[int, List[TagChange]] = {}
+        for change in changes:
+            grouped.setdefault(change.conversation_id, []).append(change)
+
+        def apply(conversation_id: int) -> TagResult:
+            result = TagResult(conversation_id)
+            try:
+                current = known_tags.get(conversation_id)
+                if current is None:
+                    current = self._current_tags(conversation_id)
+                result.tags = merge_tags(current, grouped[conversation_id])
+                if result.tags == list(current):
+                    return result
+                res = self.put_conversation_tags(conversation_id, result.tags)
+                result.status = res.status_code
+            except (requests.RequestException, UpstreamUnavailable) as e:
+                response = getattr(e, "response", None)
+                result.status = response.status_code if response is not None else None
+                result.error = str(e)
+            return result
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return {r.conversation_id: r for r in pool.map(apply, grouped)}
 
     def put_conversation_tags(self, conversation_id: int, tags: List[str]):
         """Set conversation tags, this overwrites existing tags.
@@ -0,0 +1,113 @@
+import pytest
+
+from bling.bench.fakes import FakeHelpScout
+from bling.helpscout.client import (
+    HelpScoutClient,
+    TagChange,
+    Thread,
+    ThreadType,
+    merge_tags,
+    tags_by_conversation,
+)
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(helpscout):
+    with HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s") as c:
+        yield c
+
+
+def test_merge_tags_applies_changes_in_order():
+    changes = [
+        TagChange(1, add=["b", "c"], remove=["a"]),
+        TagChange(1, add=["a"], remove=["c"]),
+    ]
+    assert merge_tags(["a", "z"], changes) == ["z", "b", "a"]
+
+
+def test_bulk_update_uses_known_tags_and_merges(helpscout, client):
+    listed = helpscout.add_conversation(1, "listed@example.com")
+    listed.tags = ["old"]
+    unknown = helpscout.add_conversation(1, "unknown@example.com")
+    unknown.tags = ["keep"]
+    unchanged = helpscout.add_conversation(1, "unchanged@example.com")
+    unchanged.tags = ["done"]
+
+    page = client.find_conversations(mailbox_ids=[1])
+    known = tags_by_conversation(c for c in page if c["id"] != unknown.id)
+    helpscout.requests.clear()
+
+    results = client.bulk_update_conversation_tags(
+        [
+            TagChange(listed.id, add=["new"]),
+            TagChange(unknown.id, add=["new"]),
+            TagChange(listed.id, remove=["old"]),
+            TagChange(unchanged.id, add=["done"]),
+            TagChange(999, add=["new"]),
+        ],
+        known_tags=known,
+        concurrency=2,
+    )
+
+    assert listed.tags == ["new"]
+    assert unknown.tags == ["keep", "new"]
+    assert helpscout.requests == {
+        f"PUT /v2/conversations/{listed.id}/tags": 1,
+        f"GET /v2/conversations/{unknown.id}": 1,
+        f"PUT /v2/conversations/{unknown.id}/tags": 1,
+        "GET /v2/conversations/999": 1,
+    }
+    assert results[listed.id].status == 204
+    assert results[unchanged.id].ok and results[unchanged.id].status is None
+    assert not results[999].ok and results[999].status == 404
+
+
+def test_update_conversation_tags_with_current_tags_skips_fetch(helpscout, client):
+    conversation = helpscout.add_conversation(1, "someone@example.com")
+    client.update_conversation_tags(
+        conversation.id, remove=["a"], add=["b"], current_tags=["a", "c"]
+    )
+    assert conversation.tags == ["c", "b"]
+    assert f"GET /v2/conversations/{conversation.id}" not in helpscout.requests
+
+
+def test_iter_threads_reads_every_page(helpscout, client):
+    conversation = helpscout.add_conversation(1, "long@example.com", threads=60)
+    assert len(list(client.iter_threads(conversation.id))) == 60
+
+
+def test_hydrate_conversations_embeds_and_caches(helpscout, client):
+    short = helpscout.add_conversation(1, "short@example.com", threads=3)
+    long = helpscout.add_conversation(1, "long@example.com", threads=30)
+    helpscout.EMBED_LIMIT = 10
+
+    listed = client.find_conversations(mailbox_ids=[1])
+    hydrated = client.hydrate_conversations(listed)
+    assert len(hydrated[short.id]["_embedded"]["threads"]) == 3
+    assert len(hydrated[long.id]["_embedded"]["threads"]) == 30
+    assert helpscout.requests[f"GET /v2/conversations/{short.id}/threads"] == 0
+
+    # Unchanged conversations come from the cache
+    helpscout.requests.clear()
+    client.hydrate_conversations(client.find_conversations(mailbox_ids=[1]))
+    assert helpscout.requests == {"GET /v2/conversations": 1}
+
+    # Changed ones are fetched again
+    client.add_thread_to_conversation(
+        short.id, Thread(type=ThreadType.CUSTOMER, text="new", imported=False)
+    )
+    helpscout.requests.clear()
+    hydrated = client.hydrate_conversations(client.find_conversations(mailbox_ids=[1]))
+    assert len(hydrated[short.id]["_embedded"]["threads"]) == 4
+    assert helpscout.requests[f"GET /v2/conversations/{short.id}"] == 1
+    assert helpscout.requests[f"GET /v2/conversations/{long.id}"] == 0
+
+    # Bare ids can't be checked against a version, so they're always fetched
+    client.hydrate_conversations([long.id])
+    assert helpscout.requests[f"GET /v2/conversations/{long.id}"] == 1
@@ -0,0 +1,138 @@
+import json
+import re
+from dataclasses import dataclass
+from json.decoder import scanstring  # type: ignore
+from typing import Any, Callable, Dict, Optional
+
+from bling.clients import outgoing_reply_handler, transport_for_type
+from bling.common import metrics
+from bling.helpscout.mailboxes import Mailbox
+
+AGENT_REPLY_CREATED = "convo.agent.reply.created"
+
+EventHandler = Callable[[Mailbox, Dict[str, Any]], None]
+
+
+@dataclass
+class Subscription:
+    event_type: str
+    handler: EventHandler
+    # Bling only deals with SMS, so most handlers only care about phone
+    # conversations and the webhook can be dropped before it's parsed
+    phone_only: bool = True
+
+
+class WebhookRouter:
+    """
+    Maps X-HelpScout-Event values to the handlers that are subscribed to
+    them. Events nobody subscribes to are dropped before we parse the payload
+    or build any API clients.
+    """
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Subscription] = {}
+
+    def subscribe(self, event_type: str, phone_only: bool = True):
+        """Decorator to register a handler for a Help Scout event type"""
+
+        def register(handler: EventHandler) -> EventHandler:
+            if event_type in self._subscriptions:
+                raise ValueError(f"'{event_type}' already has a handler")
+            self._subscriptions[event_type] = Subscription(
+                event_type=event_type, handler=handler, phone_only=phone_only
+            )
+            return handler
+
+        return register
+
+    def subscription_for(self, event_type: str) -> Optional[Subscription]:
+        return self._subscriptions.get(event_type)
+
+    def dispatch(
+        self, subscription: Subscription, mailbox: Mailbox, payload: Dict[str, Any]
+    ):
+        metrics.increment(
+            "helpscout_webhook_events_total", event=subscription.event_type
+        )
+        with metrics.timer(
+            "helpscout_webhook_event_seconds", event=subscription.event_type
+        ):
+            subscription.handler(mailbox, payload)
+
+
+router = WebhookRouter()
+
+
+@router.subscribe(AGENT_REPLY_CREATED)
+def agent_reply_created(mailbox: Mailbox, payload: Dict[str, Any]):
+    outgoing_reply_handler(
+        transport_for_type(mailbox.transport_type)
+    ).handle_outgoing_reply(mailbox, payload)
+
+
+@dataclass
+class WebhookPeek:
+    """The handful of fields we need to decide whether a webhook is ours"""
+
+    mailbox_id: Optional[int]
+    type: Optional[str]
+
+
+_decoder = json.JSONDecoder()
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+
+def peek_webhook(raw: bytes) -> Optional[WebhookPeek]:
+    """
+    Pull the mailbox ID and conversation type out of a webhook body without
+    parsing the whole thing.
+
+    Help Scout sends us webhooks for every mailbox in the account, and most
+    of the size of a payload is thread bodies we never look at if the
+    webhook isn't for one of our mailboxes. This walks the top-level members
+    one at a time and stops as soon as it has seen "type" and "mailbox" (or
+    "mailboxId"), so the rest of the document is never decoded. At worst
+    (both fields after the threads) it costs about as much as a full parse.
+
+    Returns None if the body doesn't look like a JSON object, in which case
+    the caller should fall back to a full parse.
+    """
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+    pos = _WHITESPACE_RE.match(text).end()
+    if text[pos : pos + 1] != "{":
+        return None
+    pos += 1
+
+    mailbox_id = None
+    conversation_type = None
+    try:
+        while mailbox_id is None or conversation_type is None:
+            pos = _WHITESPACE_RE.match(text, pos).end()
+            char = text[pos : pos + 1]
+            if char == ",":
+                pos += 1
+                continue
+            if char != '"':
+                break  # end of the object (or garbage; the full parse will tell)
+
+            key, pos = scanstring(text, pos + 1)
+            pos = _WHITESPACE_RE.match(text, pos).end()
+            if text[pos : pos + 1] != ":":
+                return None
+            pos = _WHITESPACE_RE.match(text, pos + 1).end()
+            value, pos = _decoder.raw_decode(text, pos)
+
+            if key == "type":
+                conversation_type = value
+            elif key == "mailboxId":
+                mailbox_id = value
+            elif key == "mailbox" and isinstance(value, dict):
+                mailbox_id = value.get("id")
+    except ValueError:
+        return None
+
+    return WebhookPeek(mailbox_id=mailbox_id, type=conversation_type)
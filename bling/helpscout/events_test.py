@@ -0,0 +1,93 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from bling.common import metrics
+from bling.helpscout.events import (
+    AGENT_REPLY_CREATED,
+    WebhookPeek,
+    WebhookRouter,
+    peek_webhook,
+    router,
+)
+
+
+def test_default_subscriptions():
+    assert router.subscription_for(AGENT_REPLY_CREATED).phone_only
+    assert router.subscription_for("convo.created") is None
+
+
+def test_subscribe_and_dispatch():
+    events = WebhookRouter()
+    handler = MagicMock()
+    events.subscribe("convo.note.created", phone_only=False)(handler)
+
+    subscription = events.subscription_for("convo.note.created")
+    assert subscription.handler is handler
+    assert not subscription.phone_only
+
+    with pytest.raises(ValueError):
+        events.subscribe("convo.note.created")(MagicMock())
+
+    metrics.reset()
+    mailbox = MagicMock()
+    events.dispatch(subscription, mailbox, {"id": 1})
+
+    handler.assert_called_once_with(mailbox, {"id": 1})
+    assert (
+        metrics.counter_value(
+            "helpscout_webhook_events_total", event="convo.note.created"
+        )
+        == 1
+    )
+    count, _ = metrics.timer_value(
+        "helpscout_webhook_event_seconds", event="convo.note.created"
+    )
+    assert count == 1
+
+
+def _payload(**overrides):
+    payload = {
+        "id": 1,
+        "type": "phone",
+        "customer": {"id": 7, "phone": "555-888-9999"},
+        "threads": [
+            {"type": "customer", "body": 'a "quoted" {body} with [brackets]'},
+            {"type": "message", "body": "x" * 10000, "mailbox": {"id": 999}},
+        ],
+        "mailbox": {"links": {"self": {"id": 5}}, "name": "Hotline", "id": 123},
+    }
+    payload.update(overrides)
+    return json.dumps(payload).encode()
+
+
+def test_peek_webhook():
+    assert peek_webhook(_payload()) == WebhookPeek(mailbox_id=123, type="phone")
+    assert peek_webhook(_payload(type="email")) == WebhookPeek(
+        mailbox_id=123, type="email"
+    )
+
+
+def test_peek_webhook_ignores_nested_fields():
+    # only the top-level type and mailbox.id count
+    raw = json.dumps(
+        {
+            "threads": [{"type": "customer", "mailbox": {"id": 999}}],
+            "customer": {"id": 1, "mailbox": {"id": 998}},
+            "mailbox": None,
+            "type": "phone",
+        }
+    ).encode()
+    assert peek_webhook(raw) == WebhookPeek(mailbox_id=None, type="phone")
+
+
+def test_peek_webhook_mailbox_id_field():
+    raw = b'{"mailboxId": 123, "type": "phone"}'
+    assert peek_webhook(raw) == WebhookPeek(mailbox_id=123, type="phone")
+
+
+def test_peek_webhook_unscannable():
+    assert peek_webhook(b"") is None
+    assert peek_webhook(b"[1, 2]") is None
+    assert peek_webhook(b'{"type": "pho') is None
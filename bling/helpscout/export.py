@@ -0,0 +1,319 @@
+"""
+Export the Bling mailboxes' conversations, with all their threads, to
+gzipped JSON lines or Parquet files.
+
+    python -m bling.helpscout.export --out exports/ [--mailbox 206906 ...]
+        [--format jsonl|parquet] [--full] [--modified-since 2020-06-01T00:00:00Z]
+        [--concurrency 8] [--part-size 500] [--json]
+
+Conversations are listed oldest change first, a page at a time, and
+hydrated concurrently `--part-size` at a time, each batch going to its own
+part file under <out>/<mailbox id>/, so memory use doesn't grow with the
+mailbox. Parquet needs pyarrow, which isn't a dependency otherwise.
+
+A conversation that changes while we're listing moves to the end of the
+list, which shifts every later page. So rather than following the page
+links, each page is listed afresh from the last change we've seen.
+
+<out>/cursor.json records how far each mailbox has got. Rerunning after a
+crash carries on from the last part written. Once a run has finished, the
+next one only exports conversations modified since it started, so nightly
+runs are deltas; --full starts from scratch. A conversation that changes
+during a run can appear in more than one part, so consumers should keep the
+copy with the latest modifiedAt.
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from bling.helpscout.client import HelpScoutClient
+
+FORMATS = {"jsonl": ".jsonl.gz", "parquet": ".parquet"}
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _modified_at(conversation: Dict[str, Any]) -> Optional[str]:
+    """When a conversation last changed, by the field the list is filtered and
+    sorted on (userUpdatedAt misses customer replies)"""
+    return conversation.get("modifiedAt") or conversation.get("userUpdatedAt")
+
+
+class ExportCursor:
+    """Progress per mailbox, saved after every part"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mailboxes: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.mailboxes = json.load(f)["mailboxes"]
+
+    def get(self, mailbox_id: int) -> Optional[Dict[str, Any]]:
+        return self.mailboxes.get(str(mailbox_id))
+
+    def set(self, mailbox_id: int, state: Dict[str, Any]):
+        self.mailboxes[str(mailbox_id)] = state
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"mailboxes": self.mailboxes}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def _write_jsonl(path: str, conversations: List[Dict[str, Any]]):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for conversation in conversations:
+            f.write(json.dumps(conversation, separators=(",", ":")) + "\n")
+
+
+def _write_parquet(path: str, conversations: List[Dict[str, Any]]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def column(get):
+        return [get(c) for c in conversations]
+
+    table = pa.table(
+        {
+            "id": column(lambda c: c["id"]),
+            "mailbox_id": column(lambda c: c.get("mailboxId")),
+            "status": column(lambda c: c.get("status")),
+            "subject": column(lambda c: c.get("subject")),
+            "created_at": column(lambda c: c.get("createdAt")),
+            "modified_at": column(lambda c: c.get("modifiedAt")),
+            "user_updated_at": column(lambda c: c.get("userUpdatedAt")),
+            "customer_email": column(
+                lambda c: (c.get("primaryCustomer") or {}).get("email")
+            ),
+            "tags": column(lambda c: [t["tag"] for t in c.get("tags") or []]),
+            "thread_count": column(
+                lambda c: len((c.get("_embedded") or {}).get("threads") or [])
+            ),
+            # Threads vary too much in shape to be worth their own columns
+            "threads_json": column(
+                lambda c: json.dumps((c.get("_embedded") or {}).get("threads") or [])
+            ),
+        }
+    )
+    pq.write_table(table, path, compression="zstd")
+
+
+WRITERS = {"jsonl": _write_jsonl, "parquet": _write_parquet}
+
+
+@dataclass
+class ExportStats:
+    mailbox_id: int
+    conversations: int = 0
+    threads: int = 0
+    parts: int = 0
+    elapsed: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "mailbox_id": self.mailbox_id,
+            "conversations": self.conversations,
+            "threads": self.threads,
+            "parts": self.parts,
+            "elapsed": round(self.elapsed, 2),
+            "per_second": round(
+                self.conversations / self.elapsed if self.elapsed else 0.0, 2
+            ),
+        }
+
+
+class Exporter:
+    def __init__(
+        self,
+        client: HelpScoutClient,
+        out_dir: str,
+        format: str = "jsonl",
+        concurrency: int = 8,
+        part_size: int = 500,
+    ):
+        if format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise RuntimeError("Exporting to Parquet needs pyarrow installed")
+        self.client = client
+        self.out_dir = out_dir
+        self.format = format
+        self.concurrency = concurrency
+        self.part_size = part_size
+        os.makedirs(out_dir, exist_ok=True)
+        self.cursor = ExportCursor(os.path.join(out_dir, "cursor.json"))
+
+    def _start_state(
+        self, mailbox_id: int, full: bool, modified_since: Optional[str]
+    ) -> Dict[str, Any]:
+        previous = self.cursor.get(mailbox_id)
+        if previous and not previous["complete"] and not full and not modified_since:
+            return previous
+
+        if modified_since is None and previous and not full:
+            # A delta from when the last complete run started
+            modified_since = previous["run_started_at"]
+        return {
+            "run_started_at": _now(),
+            "modified_since": modified_since,
+            "resume_since": None,
+            "resume_ids": [],
+            "parts": 0,
+            "exported": 0,
+            "complete": False,
+        }
+
+    def _listed(
+        self, mailbox_id: int, state: Dict[str, Any]
+    ) -> Iterator[Dict[str, Any]]:
+        """The mailbox's conversations from the cursor on, oldest change first"""
+        since = state["resume_since"] or state["modified_since"]
+        # Already listed and changed at since, which the next page includes
+        seen = set(state["resume_ids"])
+        while True:
+            new: List[Dict[str, Any]] = []
+            for page in self.client.iter_conversation_pages(
+                mailbox_ids=[mailbox_id],
+                sort_field="modifiedAt",
+                sort_order="asc",
+                modified_since=since,
+            ):
+                new = [c for c in page if c["id"] not in seen]
+                # Only on to the next page if this whole one changed at since
+                if new:
+                    break
+            if not new:
+                return
+            for conversation in new:
+                changed = _modified_at(conversation)
+                # Never back, which would list the same pages again
+                if changed and (since is None or changed > since):
+                    since = changed
+                    seen = set()
+                seen.add(conversation["id"])
+                yield conversation
+
+    def export_mailbox(
+        self, mailbox_id: int, full: bool = False, modified_since: Optional[str] = None
+    ) -> ExportStats:
+        stats = ExportStats(mailbox_id)
+        start = time.perf_counter()
+        state = self._start_state(mailbox_id, full, modified_since)
+        self.cursor.set(mailbox_id, state)
+
+        mailbox_dir = os.path.join(self.out_dir, str(mailbox_id))
+        os.makedirs(mailbox_dir, exist_ok=True)
+        run_id = state["run_started_at"].replace("-", "").replace(":", "")
+
+        listed = self._listed(mailbox_id, state)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while True:
+                batch = list(itertools.islice(listed, self.part_size))
+                if not batch:
+                    break
+                conversations = list(
+                    pool.map(lambda c: self.client.hydrate_conversation(c["id"]), batch)
+                )
+
+                path = os.path.join(
+                    mailbox_dir,
+                    f"{run_id}-{state['parts']:05}{FORMATS[self.format]}",
+                )
+                tmp = f"{path}.tmp"
+                WRITERS[self.format](tmp, conversations)
+                os.replace(tmp, path)
+
+                # Resume from the last change listed; anything else changed
+                # at that same moment has already been written
+                previous = state["resume_since"]
+                last = _modified_at(batch[-1])
+                if previous and (not last or last < previous):
+                    last = previous
+                same = {c["id"] for c in batch if _modified_at(c) == last}
+                if last == previous:
+                    same.update(state["resume_ids"])
+                state["resume_ids"] = sorted(same)
+                state["resume_since"] = last
+                state["parts"] += 1
+                state["exported"] += len(conversations)
+                self.cursor.set(mailbox_id, state)
+
+                stats.parts += 1
+                stats.conversations += len(conversations)
+                stats.threads += sum(
+                    len((c.get("_embedded") or {}).get("threads") or [])
+                    for c in conversations
+                )
+
+        state["complete"] = True
+        self.cursor.set(mailbox_id, state)
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--out", required=True, help="directory to write to")
+    parser.add_argument(
+        "--mailbox",
+        type=int,
+        action="append",
+        help="mailbox id (repeatable), defaults to every configured mailbox",
+    )
+    parser.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    parser.add_argument("--full", action="store_true", help="ignore the cursor")
+    parser.add_argument("--modified-since", help="e.g. 2020-06-01T00:00:00Z")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--part-size", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from bling.clients import helpscout_client
+    from bling.helpscout import mailboxes
+
+    args = parse_args(argv)
+    mailbox_ids = args.mailbox or sorted({m.id for m in mailboxes.registry})
+    try:
+        exporter = Exporter(
+            helpscout_client(),
+            args.out,
+            format=args.format,
+            concurrency=args.concurrency,
+            part_size=args.part_size,
+        )
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+
+    results = []
+    for mailbox_id in mailbox_ids:
+        stats = exporter.export_mailbox(mailbox_id, args.full, args.modified_since)
+        results.append(stats.as_dict())
+        if not args.json:
+            summary = stats.as_dict()
+            print(
+                f"Mailbox {mailbox_id}: {stats.conversations} conversations, "
+                f"{stats.threads} threads in {stats.parts} parts, "
+                f"{stats.elapsed:.1f}s ({summary['per_second']}/s)"
+            )
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import gzip
+import json
+import os
+import time
+
+import pytest
+
+from bling.bench.fakes import FakeHelpScout
+from bling.helpscout import export
+from bling.helpscout.client import HelpScoutClient, Thread, ThreadType
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(helpscout):
+    with HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s") as c:
+        yield c
+
+
+def read_export(out_dir, mailbox_id):
+    conversations = []
+    mailbox_dir = os.path.join(out_dir, str(mailbox_id))
+    for name in sorted(os.listdir(mailbox_dir)):
+        with gzip.open(os.path.join(mailbox_dir, name), "rt") as f:
+            conversations.extend(json.loads(line) for line in f)
+    return conversations
+
+
+def test_exports_every_conversation_and_thread(helpscout, client, tmp_path):
+    ids = [
+        helpscout.add_conversation(1, f"{i}@example.com", threads=i % 4).id
+        for i in range(60)
+    ]
+    helpscout.add_conversation(2, "other@example.com")
+
+    exporter = export.Exporter(client, str(tmp_path), part_size=25)
+    stats = exporter.export_mailbox(1)
+
+    assert (stats.conversations, stats.parts) == (60, 3)
+    exported = read_export(tmp_path, 1)
+    assert [c["id"] for c in exported] == ids
+    assert [len(c["_embedded"]["threads"]) for c in exported] == [
+        i % 4 for i in range(60)
+    ]
+    assert exporter.cursor.get(1)["complete"]
+
+
+def test_resumes_after_a_failure(helpscout, client, tmp_path, monkeypatch):
+    ids = [helpscout.add_conversation(1, f"{i}@example.com").id for i in range(30)]
+
+    hydrate = client.hydrate_conversation
+    calls = []
+
+    def flaky_hydrate(conversation_id, version=None):
+        calls.append(conversation_id)
+        if len(calls) > 12:
+            raise RuntimeError("boom")
+        return hydrate(conversation_id, version)
+
+    monkeypatch.setattr(client, "hydrate_conversation", flaky_hydrate)
+    with pytest.raises(RuntimeError):
+        export.Exporter(client, str(tmp_path), part_size=10).export_mailbox(1)
+    assert export.ExportCursor(str(tmp_path / "cursor.json")).get(1)["parts"] == 1
+
+    monkeypatch.setattr(client, "hydrate_conversation", hydrate)
+    stats = export.Exporter(client, str(tmp_path), part_size=10).export_mailbox(1)
+    assert stats.conversations == 20
+    assert [c["id"] for c in read_export(tmp_path, 1)] == ids
+
+
+def test_changes_during_a_run_dont_shift_pages(helpscout, client, tmp_path):
+    ids = [helpscout.add_conversation(1, f"{i}@example.com").id for i in range(60)]
+    hydrate = client.hydrate_conversation
+
+    def hydrate_while_busy(conversation_id, version=None):
+        # Live traffic on an early conversation moves it to the end
+        if conversation_id == ids[10]:
+            helpscout.touch(helpscout.conversations[ids[0]])
+        return hydrate(conversation_id, version)
+
+    client.hydrate_conversation = hydrate_while_busy
+    export.Exporter(client, str(tmp_path), part_size=10).export_mailbox(1)
+
+    exported = [c["id"] for c in read_export(tmp_path, 1)]
+    assert set(exported) == set(ids)
+    # Exported again once it changed
+    assert exported.count(ids[0]) == 2
+
+
+def test_cursor_follows_modified_at(helpscout, client, tmp_path, monkeypatch):
+    x = helpscout.add_conversation(1, "x@example.com")
+    y = helpscout.add_conversation(1, "y@example.com")
+    x.modified_at = x.user_updated_at = "2020-01-01T00:01:40Z"
+    # A customer reply changed y after x, which userUpdatedAt doesn't show
+    y.modified_at, y.user_updated_at = "2020-01-01T00:03:20Z", "2020-01-01T00:00:50Z"
+
+    pages = client.iter_conversation_pages
+    listed = []
+
+    def counted_pages(**kwargs):
+        listed.append(kwargs["modified_since"])
+        assert len(listed) < 10, "the cursor went backwards"
+        return pages(**kwargs)
+
+    monkeypatch.setattr(client, "iter_conversation_pages", counted_pages)
+    stats = export.Exporter(client, str(tmp_path)).export_mailbox(
+        1, modified_since="2020-01-01T00:00:50Z"
+    )
+
+    assert stats.conversations == 2
+    assert [c["id"] for c in read_export(tmp_path, 1)] == [x.id, y.id]
+
+
+def test_later_runs_export_changes_only(helpscout, client, tmp_path, monkeypatch):
+    ids = [helpscout.add_conversation(1, f"{i}@example.com").id for i in range(5)]
+    # The run starts a second after everything so far changed, and later
+    # changes come after that
+    started = time.gmtime(time.time() + 1)
+    monkeypatch.setattr(
+        export, "_now", lambda: time.strftime("%Y-%m-%dT%H:%M:%SZ", started)
+    )
+    export.Exporter(client, str(tmp_path)).export_mailbox(1)
+    helpscout.advance_clock(2)
+
+    client.add_thread_to_conversation(
+        ids[2], Thread(type=ThreadType.CUSTOMER, text="again", imported=False)
+    )
+    # A customer reply, which only modifiedAt shows
+    changed = helpscout.conversations[ids[2]]
+    assert changed.user_updated_at < changed.modified_at
+    new = helpscout.add_conversation(1, "new@example.com").id
+    stats = export.Exporter(client, str(tmp_path)).export_mailbox(1)
+
+    assert stats.conversations == 2
+    assert [c["id"] for c in read_export(tmp_path, 1)][-2:] == [ids[2], new]
+
+    stats = export.Exporter(client, str(tmp_path)).export_mailbox(1, full=True)
+    assert stats.conversations == 6
+
+
+def test_parquet_needs_pyarrow(client, tmp_path):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        with pytest.raises(RuntimeError):
+            export.Exporter(client, str(tmp_path), format="parquet")
+    else:
+        pytest.skip("pyarrow is installed")
@@ -1,6 +1,14 @@
+import hashlib
+import json
+import logging
 import os
-from dataclasses import dataclass
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
 
+from bling.config import config
 from bling.phone import Phone
 
 
@@ -14,9 +22,66 @@ class Mailbox:
     phone: Phone
     id: int
     mc_campaign_id: str
+    # Twilio only: send through a Messaging Service instead of a single number
+    messaging_service_sid: str = ""
+    # Twilio only: every number in the pool, when there's more than one
+    sender_pool: List[Phone] = field(default_factory=list)
 
+    @property
+    def twilio_phones(self) -> List[Phone]:
+        """All the Twilio numbers that route to this mailbox"""
+        return self.sender_pool or [self.phone]
 
-# Parse mailbox config: comma-separated mailboxes in the format <twilio number>:<mailbox id>
+    def sender_for(self, to_phone: Phone) -> Phone:
+        """
+        Pick the pool number to text a supporter from. Each number in the
+        pool is scored with a hash of it and the supporter's number, and the
+        highest wins (rendezvous hashing), so every Lambda sends a given
+        supporter replies from the same number without any shared state,
+        and adding or removing a number only moves the supporters it gains
+        or loses.
+        """
+        if not self.sender_pool:
+            return self.phone
+        supporter = to_phone.twilio_format
+        return max(
+            self.sender_pool,
+            key=lambda sender: hashlib.blake2b(
+                f"{supporter}|{sender.twilio_format}".encode(), digest_size=8
+            ).digest(),
+        )
+
+
+def _parse_twilio_senders(transport_value):
+    """
+    The Twilio transport value is a |-separated list of senders: phone numbers
+    and/or a Messaging Service SID (MG...). The first phone number is the
+    mailbox's primary number; if there's more than one they form a pool.
+    """
+    senders = [s.strip() for s in transport_value.split("|") if s.strip()]
+    service_sids = [s for s in senders if s.startswith("MG")]
+    phones = [Phone.parse(s) for s in senders if not s.startswith("MG")]
+
+    if len(service_sids) > 1:
+        raise ValueError(f"More than one Messaging Service in '{transport_value}'")
+    if not phones:
+        raise ValueError(f"No Twilio phone number in '{transport_value}'")
+
+    return (
+        phones[0],
+        service_sids[0] if service_sids else "",
+        phones if len(phones) > 1 else [],
+    )
+
+
+# Parse mailbox config: comma-separated mailboxes in the format
+# <transport type>:<transport value>:<mailbox id>
+#
+# For twilio, the value is a phone number, or a |-separated pool of phone
+# numbers and/or a Messaging Service SID, e.g.:
+#   twilio:+16173973198:206906
+#   twilio:+16173973198|+16173973199:206906
+#   twilio:MG0123456789abcdef0123456789abcdef|+16173973198:206906
 def parse_mailboxes(configs_str):
     if (len(configs_str.strip())) == 0:
         return []
@@ -27,41 +92,244 @@ def parse_mailboxes(configs_str):
 
     mailboxes = []
     for transport_type, transport_value, mailbox_id in mailbox_configs:
-        transport_type = transport_type.strip()
-        mailbox_id = mailbox_id.strip()
-        transport_value = transport_value.strip()
-
-        if transport_type == "twilio":
-            mailboxes.append(
-                Mailbox(
-                    transport_type=transport_type,
-                    id=int(mailbox_id),
-                    phone=Phone.parse(transport_value),
-                    mc_campaign_id="",
+        mailbox = _build_mailbox(transport_type, transport_value, mailbox_id)
+        if mailbox is not None:
+            mailboxes.append(mailbox)
+    return mailboxes
+
+
+def _build_mailbox(transport_type, transport_value, mailbox_id) -> Optional[Mailbox]:
+    transport_type = transport_type.strip()
+    transport_value = transport_value.strip()
+    mailbox_id = int(str(mailbox_id).strip())
+
+    if transport_type == "twilio":
+        phone, messaging_service_sid, sender_pool = _parse_twilio_senders(
+            transport_value
+        )
+        return Mailbox(
+            transport_type=transport_type,
+            id=mailbox_id,
+            phone=phone,
+            mc_campaign_id="",
+            messaging_service_sid=messaging_service_sid,
+            sender_pool=sender_pool,
+        )
+    elif transport_type == "mobilecommons":
+        return Mailbox(
+            transport_type=transport_type,
+            id=mailbox_id,
+            phone=Phone.parse("5555555555"),
+            mc_campaign_id=transport_value,
+        )
+    return None
+
+
+def _mailbox_from_entry(entry: Any) -> Mailbox:
+    """
+    One mailbox from a mailbox file. Entries are either strings in the
+    BLING_MAILBOXES format, or objects like:
+
+        {"id": 206906, "transport": "twilio", "phones": ["+16173973198"],
+         "messaging_service_sid": "MG..."}
+        {"id": 206907, "transport": "mobilecommons", "campaign_id": "12345"}
+    """
+    if isinstance(entry, str):
+        mailbox_configs = parse_mailboxes(entry)
+        if len(mailbox_configs) != 1:
+            raise ValueError(f"Expected exactly one mailbox in '{entry}'")
+        return mailbox_configs[0]
+
+    if not isinstance(entry, dict):
+        raise ValueError(f"Can't parse mailbox entry: {entry!r}")
+
+    transport_type = entry.get("transport", "")
+    if transport_type == "twilio":
+        phones = entry.get("phones") or [entry.get("phone", "")]
+        senders = list(phones)
+        if entry.get("messaging_service_sid"):
+            senders.append(entry["messaging_service_sid"])
+        transport_value = "|".join(senders)
+    else:
+        transport_value = entry.get("campaign_id", "")
+
+    mailbox = _build_mailbox(transport_type, transport_value, entry.get("id", ""))
+    if mailbox is None:
+        raise ValueError(f"Unknown transport type in mailbox entry: {entry!r}")
+    return mailbox
+
+
+def load_mailbox_file(path: str) -> List[Mailbox]:
+    """
+    Parse a JSON or YAML (.yml/.yaml, needs pyyaml) mailbox file: a list of
+    mailbox entries, or an object with the list under "mailboxes".
+    """
+    with open(path) as f:
+        if path.endswith((".yml", ".yaml")):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(
+                    f"Install pyyaml to load YAML mailbox files ({path})"
                 )
-            )
-        elif transport_type == "mobilecommons":
-            mailboxes.append(
-                Mailbox(
-                    transport_type=transport_type,
-                    id=int(mailbox_id),
-                    phone=Phone.parse("5555555555"),
-                    mc_campaign_id=transport_value,
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    if isinstance(data, dict):
+        data = data.get("mailboxes")
+    if not isinstance(data, list):
+        raise ValueError(f"{path} should contain a list of mailboxes")
+
+    return [_mailbox_from_entry(entry) for entry in data]
+
+
+@dataclass(frozen=True)
+class MailboxIndex:
+    """
+    An immutable snapshot of the configured mailboxes, indexed by every key we
+    route on. The registry swaps in a whole new index when the config changes,
+    so a reader always sees one consistent set of mailboxes.
+    """
+
+    mailboxes: Tuple[Mailbox, ...]
+    by_twilio_phone: Mapping[str, Mailbox]
+    by_campaign_id: Mapping[str, Mailbox]
+    by_id: Mapping[int, Mailbox]
+
+    @classmethod
+    def build(cls, mailboxes: List[Mailbox]) -> "MailboxIndex":
+        by_twilio_phone: Dict[str, Mailbox] = {}
+        by_campaign_id: Dict[str, Mailbox] = {}
+        by_id: Dict[int, Mailbox] = {}
+
+        def add(index, key, mailbox, kind):
+            if key in index:
+                raise ValueError(
+                    f"{kind} {key} is used by mailboxes {index[key].id} and {mailbox.id}"
                 )
-            )
-    return mailboxes
+            index[key] = mailbox
+
+        for mb in mailboxes:
+            add(by_id, mb.id, mb, "Mailbox ID")
+            if mb.transport_type == "twilio":
+                for phone in mb.twilio_phones:
+                    add(by_twilio_phone, phone.twilio_format, mb, "Twilio phone")
+            if mb.mc_campaign_id:
+                add(by_campaign_id, mb.mc_campaign_id, mb, "Mobile Commons campaign")
+
+        return cls(
+            mailboxes=tuple(mailboxes),
+            by_twilio_phone=MappingProxyType(by_twilio_phone),
+            by_campaign_id=MappingProxyType(by_campaign_id),
+            by_id=MappingProxyType(by_id),
+        )
+
+
+class MailboxRegistry:
+    """
+    The configured mailboxes, from BLING_MAILBOXES_FILE if it's set and
+    BLING_MAILBOXES otherwise.
+
+    A mailbox file is checked for changes at most every check_interval
+    seconds, and reloaded when its modification time or size changes, so
+    hotlines can be added without a redeploy. Lookups never take a lock: they
+    read whichever index is current, and a reload builds a new index off to
+    the side and swaps it in with a single assignment. If a changed file
+    doesn't parse, the error is logged and the previous index stays in use.
+    """
+
+    def __init__(
+        self,
+        env_value: str = "",
+        path: Optional[str] = None,
+        check_interval: float = 10.0,
+    ):
+        self.env_value = env_value
+        self.path = path
+        self.check_interval = check_interval
+        self._index: Optional[MailboxIndex] = None
+        self._file_version: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "MailboxRegistry":
+        return cls(
+            env_value=config.mailboxes,
+            path=config.mailboxes_file,
+            check_interval=config.mailboxes_reload_seconds,
+        )
+
+    @property
+    def index(self) -> MailboxIndex:
+        index = self._index
+        if index is None or (self.path and time.monotonic() >= self._next_check):
+            index = self._refresh()
+        return index
+
+    def _file_stat(self) -> Tuple[int, int]:
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self) -> MailboxIndex:
+        # Only one thread reloads. Everyone else carries on with the index
+        # they already have, unless there isn't one yet.
+        if not self._reload_lock.acquire(blocking=self._index is None):
+            return self._index
+        try:
+            if self._index is not None and time.monotonic() < self._next_check:
+                return self._index
+            self._next_check = time.monotonic() + self.check_interval
+
+            if not self.path:
+                if self._index is None:
+                    self._index = MailboxIndex.build(parse_mailboxes(self.env_value))
+                return self._index
+
+            try:
+                version = self._file_stat()
+                if self._index is None or version != self._file_version:
+                    self._index = MailboxIndex.build(load_mailbox_file(self.path))
+                    self._file_version = version
+                    logging.info(
+                        "Loaded %s mailboxes from %s",
+                        len(self._index.mailboxes),
+                        self.path,
+                    )
+            except Exception:
+                if self._index is None:
+                    raise
+                logging.exception(
+                    "Failed to reload mailboxes from %s, keeping the old ones",
+                    self.path,
+                )
+            return self._index
+        finally:
+            self._reload_lock.release()
+
+    def reload(self) -> MailboxIndex:
+        """Reload now rather than waiting for the next check"""
+        self._next_check = 0.0
+        self._file_version = None
+        return self._refresh()
+
+    def __iter__(self) -> Iterator[Mailbox]:
+        return iter(self.index.mailboxes)
+
+    def __len__(self) -> int:
+        return len(self.index.mailboxes)
+
+    def by_twilio_phone(self, phone: str) -> Optional[Mailbox]:
+        return self.index.by_twilio_phone.get(phone)
 
+    def by_campaign_id(self, campaign_id: str) -> Optional[Mailbox]:
+        return self.index.by_campaign_id.get(campaign_id)
 
-# Parse the mailbox config and index by Twilio phone number and mailbox ID
-MAILBOXES = parse_mailboxes(
-    os.environ.get("BLING_MAILBOXES", "twilio:+16173973198:206906")
-)
+    def by_id(self, mailbox_id: int) -> Optional[Mailbox]:
+        return self.index.by_id.get(mailbox_id)
 
-MAILBOXES_BY_TWILIO_PHONE = {}
-MAILBOXES_BY_CAMPAIGN_ID = {}
-MAILBOXES_BY_ID = {}
 
-for mb in MAILBOXES:
-    MAILBOXES_BY_TWILIO_PHONE[mb.phone.twilio_format] = mb
-    MAILBOXES_BY_CAMPAIGN_ID[mb.mc_campaign_id] = mb
-    MAILBOXES_BY_ID[mb.id] = mb
+# Nothing is parsed until the first lookup: parsing the config means parsing
+# phone numbers, which is slow to import
+registry = MailboxRegistry.from_config()
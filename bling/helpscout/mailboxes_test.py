@@ -1,4 +1,15 @@
-from bling.helpscout.mailboxes import Mailbox, parse_mailboxes
+import json
+import os
+
+import pytest
+
+from bling.helpscout.mailboxes import (
+    Mailbox,
+    MailboxIndex,
+    MailboxRegistry,
+    load_mailbox_file,
+    parse_mailboxes,
+)
 from bling.phone import Phone
 
 
@@ -75,3 +86,171 @@ def test_parse_mailboxes():
             mc_campaign_id="test-campaign",
         )
     ]
+
+
+def test_parse_twilio_sender_pool():
+    [mailbox] = parse_mailboxes("twilio: +15556667777 | +15558889999 :123")
+    assert mailbox.phone == Phone.parse("+15556667777")
+    assert mailbox.messaging_service_sid == ""
+    assert mailbox.sender_pool == [
+        Phone.parse("+15556667777"),
+        Phone.parse("+15558889999"),
+    ]
+    assert mailbox.twilio_phones == mailbox.sender_pool
+
+
+def test_parse_twilio_messaging_service():
+    [mailbox] = parse_mailboxes("twilio:MG123|+15556667777:123")
+    assert mailbox.phone == Phone.parse("+15556667777")
+    assert mailbox.messaging_service_sid == "MG123"
+    assert mailbox.sender_pool == []
+    assert mailbox.twilio_phones == [Phone.parse("+15556667777")]
+
+    with pytest.raises(ValueError):
+        parse_mailboxes("twilio:MG123:123")
+
+
+def test_sender_for_is_sticky():
+    [single] = parse_mailboxes("twilio:+15556667777:123")
+    assert single.sender_for(Phone.parse("+15551112222")) == single.phone
+
+    [pooled] = parse_mailboxes("twilio:+15556667777|+15558889999|+15550001111:123")
+    supporters = [Phone.parse(f"+1555111{i:04}") for i in range(50)]
+    senders = [pooled.sender_for(p) for p in supporters]
+
+    assert set(s.twilio_format for s in senders) == {
+        "+15556667777",
+        "+15558889999",
+        "+15550001111",
+    }
+    assert senders == [pooled.sender_for(p) for p in supporters]
+
+
+def test_sender_for_survives_pool_changes():
+    [before] = parse_mailboxes("twilio:+15556667777|+15558889999|+15550001111:123")
+    [added] = parse_mailboxes(
+        "twilio:+15556667777|+15558889999|+15550001111|+15552223333:123"
+    )
+    [dropped] = parse_mailboxes("twilio:+15556667777|+15550001111:123")
+    supporters = [Phone.parse(f"+1555111{i:04}") for i in range(400)]
+
+    # Only the supporters the new number takes move, about a quarter of them
+    moved = [p for p in supporters if before.sender_for(p) != added.sender_for(p)]
+    assert {added.sender_for(p).twilio_format for p in moved} == {"+15552223333"}
+    assert 50 < len(moved) < 150
+
+    # Dropping a number only moves the supporters it had
+    moved = [p for p in supporters if before.sender_for(p) != dropped.sender_for(p)]
+    assert {before.sender_for(p).twilio_format for p in moved} == {"+15558889999"}
+
+
+def test_load_mailbox_file(tmp_path):
+    path = tmp_path / "mailboxes.json"
+    path.write_text(
+        json.dumps(
+            {
+                "mailboxes": [
+                    "twilio:+15556667777:123",
+                    {
+                        "id": 456,
+                        "transport": "twilio",
+                        "phones": ["+15558889999", "+15550001111"],
+                        "messaging_service_sid": "MG123",
+                    },
+                    {"id": 789, "transport": "mobilecommons", "campaign_id": "c1"},
+                ]
+            }
+        )
+    )
+
+    first, second, third = load_mailbox_file(str(path))
+    assert first.id == 123
+    assert first.phone == Phone.parse("+15556667777")
+    assert second.messaging_service_sid == "MG123"
+    assert second.sender_pool == [
+        Phone.parse("+15558889999"),
+        Phone.parse("+15550001111"),
+    ]
+    assert third.mc_campaign_id == "c1"
+
+    path.write_text(json.dumps([{"id": 1, "transport": "carrier-pigeon"}]))
+    with pytest.raises(ValueError):
+        load_mailbox_file(str(path))
+
+
+def test_load_mailbox_file_yaml(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "mailboxes.yml"
+    path.write_text("- id: 123\n  transport: twilio\n  phone: '+15556667777'\n")
+    [mailbox] = load_mailbox_file(str(path))
+    assert mailbox.phone == Phone.parse("+15556667777")
+
+
+def test_index():
+    index = MailboxIndex.build(
+        parse_mailboxes(
+            "twilio:+15556667777|+15558889999:123,mobilecommons:c1:456,"
+            "mobilecommons:c2:789"
+        )
+    )
+    assert index.by_twilio_phone["+15558889999"].id == 123
+    assert index.by_campaign_id["c2"].id == 789
+    assert index.by_id[456].mc_campaign_id == "c1"
+    # Mobile Commons mailboxes have a placeholder phone, which isn't routable
+    assert "+15555555555" not in index.by_twilio_phone
+
+    with pytest.raises(TypeError):
+        index.by_id[1] = index.by_id[123]
+
+    with pytest.raises(ValueError):
+        MailboxIndex.build(
+            parse_mailboxes("twilio:+15556667777:123,twilio:+15556667777:456")
+        )
+
+
+def test_registry_from_env():
+    registry = MailboxRegistry(env_value="twilio:+15556667777:123")
+    assert registry.by_twilio_phone("+15556667777").id == 123
+    assert registry.by_id(123).id == 123
+    assert registry.by_id(456) is None
+    assert [mb.id for mb in registry] == [123]
+
+
+def _write(path, configs_str, mtime):
+    path.write_text(json.dumps(configs_str.split(",")))
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_registry_reloads_changed_file(tmp_path):
+    path = tmp_path / "mailboxes.json"
+    _write(path, "twilio:+15556667777:123", 1_000_000_000)
+    registry = MailboxRegistry(path=str(path), check_interval=0)
+
+    old_index = registry.index
+    assert registry.by_id(123) is not None
+    assert registry.by_id(456) is None
+
+    # Unchanged file: the same index is kept
+    assert registry.index is old_index
+
+    _write(path, "twilio:+15556667777:123,twilio:+15558889999:456", 2_000_000_000)
+    assert registry.by_twilio_phone("+15558889999").id == 456
+    assert registry.index is not old_index
+
+    # A broken file doesn't take down routing
+    path.write_text("{not json")
+    os.utime(path, ns=(3_000_000_000, 3_000_000_000))
+    assert registry.by_id(456) is not None
+
+
+def test_registry_waits_for_check_interval(tmp_path):
+    path = tmp_path / "mailboxes.json"
+    _write(path, "twilio:+15556667777:123", 1_000_000_000)
+    registry = MailboxRegistry(path=str(path), check_interval=3600)
+    assert registry.by_id(456) is None
+
+    _write(path, "twilio:+15556667777:123,twilio:+15558889999:456", 2_000_000_000)
+    assert registry.by_id(456) is None
+
+    registry.reload()
+    assert registry.by_id(456) is not None
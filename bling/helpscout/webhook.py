@@ -1,11 +1,9 @@
-import base64
 import functools
-import hashlib
-import hmac
 
 from flask import request
 
-from bling.config import config
+from bling.common.webhook_auth import helpscout_replay_cache, helpscout_validator
+from bling.webhooks import HELPSCOUT_EMPTY_RESPONSE
 
 
 def verify_help_scout_signature(f):
@@ -16,20 +14,15 @@ def verify_help_scout_signature(f):
     @functools.wraps(f)
     def wrapped(*args, **kwargs):
         sig = request.headers.get("X-HelpScout-Signature")
-        if not _is_valid_signature(
-            config.helpscout_webhook_secret, request.get_data(as_text=False), sig
-        ):
+        if not helpscout_validator().validate(request.get_data(as_text=False), sig):
             return "Unauthorized: Failed Help Scout signature verification", 401
-        else:
-            return f(*args, **kwargs)
-
-    return wrapped
 
+        # The event type isn't covered by the signature, and different events
+        # can carry the same conversation payload
+        return helpscout_replay_cache.run_once(
+            f"{request.headers.get('X-HelpScout-Event')}:{sig}",
+            lambda: f(*args, **kwargs),
+            duplicate=HELPSCOUT_EMPTY_RESPONSE,
+        )
 
-def _is_valid_signature(secret, data_bytes, signature_string):
-    if not signature_string:
-        return False
-    digest = hmac.digest(
-        bytes(secret, "UTF-8"), msg=data_bytes, digest=hashlib.sha1  # type: ignore
-    )
-    return hmac.compare_digest(digest, base64.b64decode(signature_string))
+    return wrapped
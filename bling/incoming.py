@@ -1,4 +1,4 @@
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
 from bling.transport import Transport, OutgoingMessage, IncomingMesage
 from bling.helpscout.client import (
@@ -15,16 +15,42 @@ FIRST_MESSAGE_RESPONSE = "Team Warren has received your message, and you'll hear
 MAX_CONVERSATION_LENGTH = 90
 
 
+def _resource_id(res) -> Optional[int]:
+    value = res.headers.get("Resource-ID")
+    return int(value) if value else None
+
+
 class IncomingHandler:
     """
     Handles a message from a supporter to the hotline number (either a text message or a voicemail)
     """
 
-    def __init__(self, hs_client: HelpScoutClient, transport: Transport):
+    def __init__(
+        self,
+        hs_client: HelpScoutClient,
+        transport: Transport,
+        spill_rate_limited: bool = False,
+    ):
         self.hs_client = hs_client
         self.transport = transport
+        # Raise RateLimited rather than wait when Help Scout's rate limit
+        # turns down the search or the post, see bling/deferred.py
+        self.spill_rate_limited = spill_rate_limited
 
-    def handle_message(self, message: IncomingMesage):
+    def handle_message(
+        self,
+        message: IncomingMesage,
+        posted: Optional[Callable[[], None]] = None,
+    ) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Returns the ids of the conversation and thread the message went into,
+        where Help Scout tells us them. New conversations come back without a
+        thread id.
+
+        posted is called once the message is in Help Scout, before the first
+        message auto reply, so a caller can tell that a failure after it
+        doesn't mean posting again (see bling/deferred.py).
+        """
         customer = NewCustomer(
             email=message.from_phone.blackhole_email,
             phone=message.from_phone.helpscout_format,
@@ -40,19 +66,28 @@ class IncomingHandler:
 
         conversation_id, is_new_user = self._find_conversation_for_message(message)
 
+        thread_id = None
         if conversation_id:
             # Add a thread to the existing conversation
-            self.hs_client.add_thread_to_conversation(conversation_id, thread)
+            res = self.hs_client.add_thread_to_conversation(
+                conversation_id, thread, spill=self.spill_rate_limited
+            )
+            thread_id = _resource_id(res)
         else:
             # Create a new conversation
-            self.hs_client.create_conversation(
+            res = self.hs_client.create_conversation(
                 Conversation(
                     subject=f"Request from {message.from_phone.helpscout_format}",
                     customer=customer,
                     mailboxId=message.mailbox.id,
                     threads=[thread],
-                )
+                ),
+                spill=self.spill_rate_limited,
             )
+            conversation_id = _resource_id(res)
+
+        if posted is not None:
+            posted()
 
         if is_new_user:
             self.transport.send_response(
@@ -63,6 +98,8 @@ class IncomingHandler:
                 )
             )
 
+        return conversation_id, thread_id
+
     def _find_conversation_for_message(
         self, message: IncomingMesage
     ) -> Tuple[Optional[int], bool]:
@@ -94,6 +131,7 @@ class IncomingHandler:
         conversations = self.hs_client.find_conversations(
             mailbox_ids=[message.mailbox.id],
             filters={"email": f'"{message.from_phone.blackhole_email}"'},
+            spill=self.spill_rate_limited,
         )
 
         if len(conversations) == 0:
@@ -7,6 +7,7 @@ from bling.transport import IncomingMesage, OutgoingMessage
 from bling.helpscout.mailboxes import Mailbox
 from bling.phone import Phone
 from bling.helpscout.client import Conversation, NewCustomer, Thread, ThreadType
+from bling.common.resilience import RateLimited
 
 
 @pytest.fixture
@@ -59,7 +60,8 @@ def test_no_existing_conversation(handler, mailbox):
                     imported=False,
                 )
             ],
-        )
+        ),
+        spill=False,
     )
 
     assert handler.hs_client.add_thread_to_conversation.call_count == 0
@@ -78,11 +80,15 @@ def test_existing_conversation(handler, mailbox):
         {"id": 456, "threads": 50},
         {"id": 123, "threads": 90},
     ]
-    handler.handle_message(
+    handler.hs_client.add_thread_to_conversation.return_value.headers = {
+        "Resource-ID": "789"
+    }
+    ids = handler.handle_message(
         IncomingMesage(
             mailbox=mailbox, from_phone=Phone.parse("+15558889999"), body="Some text"
         )
     )
+    assert ids == (456, 789)
 
     # Should add to a existing conversation and not send a welcome text
     handler.hs_client.add_thread_to_conversation.assert_called_with(
@@ -97,6 +103,7 @@ def test_existing_conversation(handler, mailbox):
             text="Some text",
             imported=False,
         ),
+        spill=False,
     )
 
     assert handler.hs_client.create_conversation.call_count == 0
@@ -136,8 +143,39 @@ def test_existing_long_conversation(handler, mailbox):
                     imported=False,
                 )
             ],
-        )
+        ),
+        spill=False,
     )
 
     assert handler.hs_client.add_thread_to_conversation.call_count == 0
     assert handler.transport.send_response.call_count == 0
+
+
+def test_rate_limited_search_spills(mailbox):
+    handler = IncomingHandler(MagicMock(), MagicMock(), spill_rate_limited=True)
+    handler.hs_client.find_conversations.side_effect = RateLimited("helpscout", 30)
+    with pytest.raises(RateLimited):
+        handler.handle_message(
+            IncomingMesage(
+                mailbox=mailbox, from_phone=Phone.parse("+15558889999"), body="hi"
+            )
+        )
+
+    assert handler.hs_client.find_conversations.call_args.kwargs["spill"]
+    assert handler.hs_client.create_conversation.call_count == 0
+    assert handler.hs_client.add_thread_to_conversation.call_count == 0
+    assert handler.transport.send_response.call_count == 0
+
+
+def test_posted_is_called_before_the_auto_reply(handler, mailbox):
+    handler.hs_client.find_conversations.return_value = []
+    handler.transport.send_response.side_effect = RuntimeError("Twilio is down")
+    posted = MagicMock()
+    with pytest.raises(RuntimeError):
+        handler.handle_message(
+            IncomingMesage(
+                mailbox=mailbox, from_phone=Phone.parse("+15558889999"), body="hi"
+            ),
+            posted,
+        )
+    posted.assert_called_once_with()
@@ -0,0 +1,469 @@
+"""
+Replay captured or synthetic Twilio and Help Scout webhooks against a
+running Bling, at a controlled rate, to rehearse incident-day traffic.
+
+    python -m bling.loadgen --target http://localhost:5000 \\
+        [--input webhooks.jsonl | --synthetic twilio_sms,twilio_voicemail] \\
+        [--rate 50] [--ramp 30] [--duration 120] [--concurrency 20] \\
+        [--senders 2000 --sender-dist zipf] [--check-duplicates] [--json]
+
+Each line of an --input file is a webhook to send:
+
+    {"kind": "twilio_sms", "params": {"From": "+16175550101", "To": ..., "Body": ...}}
+    {"kind": "twilio_voicemail", "params": {"from": ..., "to": ..., "recording": ...}}
+    {"kind": "twilio_transcription", "params": {...}}
+    {"kind": "helpscout", "event": "convo.agent.reply.created", "body": {...}}
+
+Requests are signed with TWILIO_AUTH_TOKEN and HELPSCOUT_WEBHOOK_SECRET
+(or --twilio-auth-token / --helpscout-secret), which have to match the
+target's. Twilio signs the public URL, so if the target is behind a proxy
+or an API Gateway stage, pass the URL Bling sees as --signed-url-base.
+
+Every request is made unique (a LoadgenId form field for Twilio, a
+loadgenId key for Help Scout; Bling ignores both) so that the target's
+replay protection doesn't drop repeats. With --senders, the supporter's
+number is replaced by one drawn from a pool of that many numbers, either
+uniformly or Zipf-distributed so a few supporters send most messages.
+
+--check-duplicates looks up, through the Help Scout API (HELPSCOUT_API_*
+and HELPSCOUT_BASE_URL), how many of the senders ended up with more than
+one conversation created during the run.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bling.bench.stats import Results, format_table
+from bling.common.rate_limit import TokenBucket
+from bling.common.webhook_auth import (
+    HelpScoutSignatureValidator,
+    TwilioSignatureValidator,
+)
+from bling.config import config
+
+ROUTES = {
+    "twilio_sms": "/bling/twilio_sms",
+    "twilio_voicemail": "/bling/twilio_voicemail",
+    "twilio_transcription": "/bling/twilio_transcription",
+    "helpscout": "/bling/helpscout_webhook",
+}
+
+# The form field holding the supporter's number, for each Twilio webhook
+TWILIO_SENDER_FIELDS = {
+    "twilio_sms": "From",
+    "twilio_voicemail": "from",
+    "twilio_transcription": "From",
+}
+
+
+@dataclass
+class Webhook:
+    kind: str
+    # Twilio form parameters
+    params: Dict[str, str] = field(default_factory=dict)
+    # Help Scout
+    event: str = "convo.agent.reply.created"
+    body: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Webhook":
+        kind = data.get("kind")
+        if kind not in ROUTES:
+            raise ValueError(f"Unknown webhook kind: {kind!r}")
+        return cls(
+            kind=kind,
+            params={k: str(v) for k, v in (data.get("params") or {}).items()},
+            event=data.get("event", cls.event),
+            body=data.get("body"),
+        )
+
+    @property
+    def sender(self) -> Optional[str]:
+        if self.kind == "helpscout":
+            return ((self.body or {}).get("customer") or {}).get("phone")
+        return self.params.get(TWILIO_SENDER_FIELDS[self.kind])
+
+
+def load_webhooks(path: str) -> List[Webhook]:
+    with open(path) as f:
+        return [Webhook.from_json(json.loads(line)) for line in f if line.strip()]
+
+
+def synthetic_webhooks(
+    kinds: List[str], mailbox_phone: str, mailbox_id: int, conversation_id: int
+) -> List[Webhook]:
+    """One webhook of each kind, for the senders to be filled in"""
+    placeholder = "+16175550199"
+    webhooks = {
+        "twilio_sms": Webhook(
+            "twilio_sms",
+            params={
+                "From": placeholder,
+                "To": mailbox_phone,
+                "Body": "Load test: when is the next event near me?",
+                "NumMedia": "0",
+            },
+        ),
+        "twilio_voicemail": Webhook(
+            "twilio_voicemail",
+            params={
+                "from": placeholder,
+                "to": mailbox_phone,
+                "length": "15",
+                "recording": "https://api.twilio.com/recordings/RE-loadgen",
+            },
+        ),
+        "twilio_transcription": Webhook(
+            "twilio_transcription",
+            params={
+                "From": placeholder,
+                "To": mailbox_phone,
+                "TranscriptionStatus": "completed",
+                "TranscriptionText": "Load test: please call me back",
+                "RecordingUrl": "https://api.twilio.com/recordings/RE-loadgen",
+            },
+        ),
+        "helpscout": Webhook(
+            "helpscout",
+            body={
+                "id": conversation_id,
+                "type": "phone",
+                "mailbox": {"id": mailbox_id},
+                "customer": {"phone": placeholder},
+                "threads": [
+                    {
+                        "id": 1,
+                        "type": "message",
+                        "createdAt": "2020-01-01T00:00:00Z",
+                        "body": "<p>Load test reply</p>",
+                        "source": {"type": "web", "via": "user"},
+                    }
+                ],
+            },
+        ),
+    }
+    return [webhooks[kind] for kind in kinds]
+
+
+class SenderPool:
+    """
+    Supporter phone numbers to send as. With a Zipf distribution the k-th
+    number is picked with weight 1/k^s, which is closer to real traffic
+    (a few people text a lot) and exercises the conversation lookup races.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        distribution: str = "uniform",
+        zipf_s: float = 1.2,
+        seed: Optional[int] = None,
+    ):
+        self.phones = [f"+1617{2000000 + i:07}" for i in range(count)]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if distribution == "zipf":
+            weights = [1 / (k**zipf_s) for k in range(1, count + 1)]
+        elif distribution == "uniform":
+            weights = [1.0] * count
+        else:
+            raise ValueError(f"Unknown sender distribution: {distribution!r}")
+        self._cumulative = list(itertools.accumulate(weights))
+
+    def pick(self) -> str:
+        with self._lock:
+            x = self._random.random() * self._cumulative[-1]
+        return self.phones[bisect_left(self._cumulative, x)]
+
+
+class Signer:
+    """Turns a webhook into a signed HTTP request for the target"""
+
+    def __init__(
+        self,
+        signed_url_base: str,
+        twilio_auth_token: Optional[str],
+        helpscout_secret: Optional[str],
+        unique: bool = True,
+    ):
+        self.signed_url_base = signed_url_base.rstrip("/")
+        self.twilio = TwilioSignatureValidator([twilio_auth_token])
+        self.helpscout = HelpScoutSignatureValidator([helpscout_secret])
+        self.unique = unique
+        self._run = f"{time.time():.0f}"
+
+    def prepare(
+        self, webhook: Webhook, sender: Optional[str], n: int
+    ) -> Tuple[str, Any, Dict[str, str]]:
+        """(path, form or body, headers)"""
+        path = ROUTES[webhook.kind]
+
+        if webhook.kind == "helpscout":
+            body = json.loads(json.dumps(webhook.body or {}))
+            if sender:
+                body.setdefault("customer", {})["phone"] = sender
+            if self.unique:
+                body["loadgenId"] = f"{self._run}-{n}"
+            raw = json.dumps(body).encode("utf-8")
+            return (
+                path,
+                raw,
+                {
+                    "Content-Type": "application/json",
+                    "X-HelpScout-Event": webhook.event,
+                    "X-HelpScout-Signature": self.helpscout.sign(raw),
+                },
+            )
+
+        params = dict(webhook.params)
+        if sender:
+            params[TWILIO_SENDER_FIELDS[webhook.kind]] = sender
+        if self.unique:
+            params["LoadgenId"] = f"{self._run}-{n}"
+        signature = self.twilio.sign(self.signed_url_base + path, params)
+        return path, params, {"X-Twilio-Signature": signature}
+
+
+@dataclass
+class LoadReport:
+    results: Dict[str, Results]
+    senders: Set[str]
+    started_at: str
+    elapsed: float
+    # How often every worker was busy when a request was due, so the
+    # concurrency cap (not the target) set the pace
+    saturated: int = 0
+    duplicates: Optional[Dict[str, int]] = None
+
+    def summaries(self) -> List[Dict[str, object]]:
+        return [r.summary() for r in self.results.values()]
+
+
+def target_rate(elapsed: float, rate: float, ramp: float) -> float:
+    """Requests per second at a point in the run: linear ramp, then flat"""
+    if ramp <= 0 or elapsed >= ramp:
+        return rate
+    return max(1.0, rate * elapsed / ramp)
+
+
+def run_load(
+    target: str,
+    webhooks: List[Webhook],
+    signer: Signer,
+    senders: Optional[SenderPool] = None,
+    rate: float = 10,
+    ramp: float = 0,
+    duration: float = 30,
+    max_requests: Optional[int] = None,
+    concurrency: int = 10,
+    timeout: float = 30,
+) -> LoadReport:
+    import requests
+
+    target = target.rstrip("/")
+    results = {"all": Results("all")}
+    for webhook in webhooks:
+        results.setdefault(webhook.kind, Results(webhook.kind))
+    used_senders: Set[str] = set()
+    lock = threading.Lock()
+    local = threading.local()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def send(webhook: Webhook, sender: Optional[str], n: int):
+        try:
+            session = getattr(local, "session", None)
+            if session is None:
+                session = local.session = requests.Session()
+            path, data, headers = signer.prepare(webhook, sender, n)
+            start = time.perf_counter()
+            try:
+                status = session.post(
+                    target + path, data=data, headers=headers, timeout=timeout
+                ).status_code
+            except requests.RequestException:
+                status = 0
+            seconds = time.perf_counter() - start
+            with lock:
+                results[webhook.kind].record(seconds, status)
+                results["all"].record(seconds, status)
+                if sender or webhook.sender:
+                    used_senders.add(sender or webhook.sender)
+        finally:
+            slots.release()
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    bucket = TokenBucket(rate=target_rate(0, rate, ramp), capacity=1)
+    saturated = 0
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for n in itertools.count():
+            elapsed = time.monotonic() - start
+            if elapsed >= duration or (max_requests is not None and n >= max_requests):
+                break
+            bucket.set_rate(target_rate(elapsed, rate, ramp))
+            bucket.acquire()
+            if not slots.acquire(blocking=False):
+                saturated += 1
+                slots.acquire()
+            webhook = webhooks[n % len(webhooks)]
+            pool.submit(send, webhook, senders.pick() if senders else None, n)
+    elapsed = time.monotonic() - start
+
+    for r in results.values():
+        r.elapsed = elapsed
+    return LoadReport(
+        results=results,
+        senders=used_senders,
+        started_at=started_at,
+        elapsed=elapsed,
+        saturated=saturated,
+    )
+
+
+def count_duplicate_conversations(
+    client, mailbox_id: int, senders: Set[str], since: str
+) -> Dict[str, int]:
+    """
+    Senders that have more than one conversation in the mailbox created since
+    the run started, and how many
+    """
+    from bling.phone import Phone
+
+    duplicates = {}
+    for sender in sorted(senders):
+        email = Phone.parse(sender).blackhole_email
+        conversations = client.find_conversations(
+            mailbox_ids=[mailbox_id], filters={"email": f'"{email}"'}
+        )
+        created = [c for c in conversations if c.get("createdAt", since) >= since]
+        if len(created) > 1:
+            duplicates[sender] = len(created)
+    return duplicates
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--target", required=True, help="e.g. http://localhost:5000")
+    parser.add_argument("--signed-url-base", help="URL base Twilio signatures use")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--input", help="JSONL file of webhooks to replay")
+    source.add_argument(
+        "--synthetic",
+        default="twilio_sms",
+        help=f"comma-separated kinds of synthetic webhooks ({', '.join(ROUTES)})",
+    )
+    parser.add_argument("--mailbox-phone", default="+16173973198")
+    parser.add_argument("--mailbox-id", type=int, default=206906)
+    parser.add_argument(
+        "--conversation-id",
+        type=int,
+        default=1,
+        help="existing conversation synthetic Help Scout replies refer to",
+    )
+    parser.add_argument("--rate", type=float, default=10, help="requests per second")
+    parser.add_argument("--ramp", type=float, default=0, help="seconds to reach rate")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--senders", type=int, default=100, help="0 keeps the payloads' senders"
+    )
+    parser.add_argument("--sender-dist", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--zipf-s", type=float, default=1.2)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--twilio-auth-token")
+    parser.add_argument("--helpscout-secret")
+    parser.add_argument("--check-duplicates", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.input:
+        webhooks = load_webhooks(args.input)
+    else:
+        kinds = [k.strip() for k in args.synthetic.split(",") if k.strip()]
+        unknown = set(kinds) - set(ROUTES)
+        if unknown:
+            raise SystemExit(f"Unknown webhook kinds: {', '.join(sorted(unknown))}")
+        webhooks = synthetic_webhooks(
+            kinds, args.mailbox_phone, args.mailbox_id, args.conversation_id
+        )
+    if not webhooks:
+        raise SystemExit("No webhooks to send")
+
+    signer = Signer(
+        args.signed_url_base or args.target,
+        args.twilio_auth_token or config.twilio_auth_token,
+        args.helpscout_secret or config.helpscout_webhook_secret,
+    )
+    senders = (
+        SenderPool(args.senders, args.sender_dist, args.zipf_s, args.seed)
+        if args.senders
+        else None
+    )
+
+    report = run_load(
+        args.target,
+        webhooks,
+        signer,
+        senders=senders,
+        rate=args.rate,
+        ramp=args.ramp,
+        duration=args.duration,
+        max_requests=args.requests,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+    )
+
+    if args.check_duplicates:
+        from bling.clients import helpscout_client
+
+        report.duplicates = count_duplicate_conversations(
+            helpscout_client(), args.mailbox_id, report.senders, report.started_at
+        )
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "elapsed": round(report.elapsed, 2),
+                    "saturated": report.saturated,
+                    "results": report.summaries(),
+                    "duplicate_conversations": report.duplicates,
+                },
+                indent=2,
+            )
+        )
+        return
+
+    print(format_table(report.summaries()))
+    print(f"\n{report.elapsed:.1f}s, {len(report.senders)} senders")
+    if report.saturated:
+        print(
+            f"All {args.concurrency} workers were busy for {report.saturated} "
+            "requests; the target rate wasn't reached"
+        )
+    if report.duplicates is not None:
+        print(
+            f"{len(report.duplicates)} senders with duplicate conversations"
+            + (f": {report.duplicates}" if report.duplicates else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import json
+from collections import Counter
+
+from bling.bench.fakes import FakeHelpScout, FakeServer
+from bling.common.webhook_auth import (
+    HelpScoutSignatureValidator,
+    TwilioSignatureValidator,
+)
+from bling.helpscout.client import HelpScoutClient
+from bling.loadgen import (
+    ROUTES,
+    SenderPool,
+    Signer,
+    Webhook,
+    count_duplicate_conversations,
+    run_load,
+    synthetic_webhooks,
+    target_rate,
+)
+from bling.phone import Phone
+
+
+class FakeBling(FakeServer):
+    """Checks signatures the way Bling does"""
+
+    def __init__(self):
+        super().__init__()
+        self.twilio = TwilioSignatureValidator(["token"])
+        self.helpscout = HelpScoutSignatureValidator(["secret"])
+        self.seen = []
+        for path in ROUTES.values():
+            self.route("POST", path, self._webhook)
+
+    def _webhook(self, request):
+        if request.path == "/bling/helpscout_webhook":
+            valid = self.helpscout.validate(
+                request.body, request.headers.get("x-helpscout-signature")
+            )
+            self.seen.append(json.loads(request.body))
+        else:
+            form = request.form()
+            valid = self.twilio.validate(
+                self.url + request.path,
+                form,
+                request.headers.get("x-twilio-signature"),
+            )
+            self.seen.append(form)
+        return (200 if valid else 403), None, {}
+
+
+def test_run_load_signs_requests():
+    with FakeBling() as target:
+        webhooks = synthetic_webhooks(list(ROUTES), "+16175550100", 1, 2)
+        report = run_load(
+            target.url,
+            webhooks,
+            Signer(target.url, "token", "secret"),
+            senders=SenderPool(3, seed=1),
+            rate=1000,
+            max_requests=12,
+            concurrency=4,
+        )
+
+    summary = report.results["all"].summary()
+    assert summary["requests"] == 12
+    assert summary["statuses"] == {200: 12}
+    assert set(report.results) == {"all"} | set(ROUTES)
+    assert report.senders <= set(SenderPool(3).phones)
+
+    # Every request is unique, so replay protection doesn't drop them
+    ids = [s.get("LoadgenId") or s.get("loadgenId") for s in target.seen]
+    assert len(set(ids)) == 12
+
+
+def test_wrong_secret_is_rejected():
+    with FakeBling() as target:
+        report = run_load(
+            target.url,
+            [Webhook("twilio_sms", params={"From": "+16175550101", "To": "+1"})],
+            Signer(target.url, "wrong", "secret"),
+            rate=1000,
+            max_requests=2,
+        )
+    summary = report.results["all"].summary()
+    assert summary["errors"] == 2
+    assert summary["error_rate"] == 1.0
+
+
+def test_sender_pool_distribution():
+    uniform_pool = SenderPool(10, seed=1)
+    zipf_pool = SenderPool(10, "zipf", seed=1)
+    uniform = Counter(uniform_pool.pick() for _ in range(5000))
+    zipf = Counter(zipf_pool.pick() for _ in range(5000))
+
+    assert len(uniform) == 10
+    assert max(uniform.values()) < 700
+    top, count = zipf.most_common(1)[0]
+    assert top == SenderPool(10).phones[0]
+    assert count > 1500
+
+
+def test_target_rate_ramps():
+    assert target_rate(0, 100, 10) == 1.0
+    assert target_rate(5, 100, 10) == 50
+    assert target_rate(20, 100, 10) == 100
+    assert target_rate(0, 100, 0) == 100
+
+
+def test_count_duplicate_conversations():
+    with FakeHelpScout() as helpscout:
+        one, two = "+16172000001", "+16172000002"
+        helpscout.add_conversation(1, Phone.parse(one).blackhole_email)
+        helpscout.add_conversation(1, Phone.parse(two).blackhole_email)
+        helpscout.add_conversation(1, Phone.parse(two).blackhole_email)
+        client = HelpScoutClient(base_url=helpscout.url, client_id="a", secret="b")
+        duplicates = count_duplicate_conversations(
+            client, 1, {one, two}, "2000-01-01T00:00:00Z"
+        )
+    assert duplicates == {two: 2}
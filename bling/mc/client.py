@@ -9,10 +9,36 @@ import requests
 import xmltodict
 from dateutil import parser as date_parser
 
+from bling.common import logs, metrics
+from bling.common.resilience import OK, Backoff, Verdict, upstream
 from bling.common.utils import nested_get
 
 MOBILE_COMMONS_API_BASE = "https://secure.mcommons.com/api/"
 MOBILE_COMMONS_SIGNUP_URL = "https://secure.mcommons.com/profiles/join"
+# API methods that are safe to call again after an error. Sending a message
+# isn't: it may have gone out.
+IDEMPOTENT_METHODS = {"messages", "profile", "profile_update", "profile_opt_out"}
+
+
+def judge_response(
+    api_method: str, resp: Optional[requests.Response], error: Optional[Exception]
+) -> Verdict:
+    """Whether a Mobile Commons API call failed, and whether to try it again"""
+    idempotent = api_method in IDEMPOTENT_METHODS
+    if error is not None:
+        if not isinstance(error, requests.RequestException):
+            return OK
+        retry = isinstance(error, requests.ConnectTimeout) or (
+            idempotent
+            and isinstance(error, (requests.ConnectionError, requests.Timeout))
+        )
+        return Verdict(failed=True, retry=retry, reason=type(error).__name__)
+    assert resp is not None
+    if resp.status_code == 429:
+        return Verdict(failed=False, retry=True, reason="429")
+    if resp.status_code >= 500:
+        return Verdict(failed=True, retry=idempotent, reason=str(resp.status_code))
+    return OK
 
 
 @dataclass
@@ -104,16 +130,32 @@ class MobileCommonsClient:
     def __init__(self, username, password, session=None):
         self.username = username
         self.password = password
-        self.session = session if not None else requests.Session()
+        self.session = session if session is not None else requests.Session()
+        self.upstream = upstream("mobilecommons")
 
     def post_to_mobile_commons(self, api_method, payload):
-        try:
-            url = MOBILE_COMMONS_API_BASE + api_method
+        url = MOBILE_COMMONS_API_BASE + api_method
+
+        def post():
+            start = time.perf_counter()
             resp = self.session.post(
                 url, auth=(self.username, self.password), json=payload
             )
+            metrics.record_upstream(
+                "mobilecommons",
+                api_method,
+                resp.status_code,
+                time.perf_counter() - start,
+                request_bytes=len(resp.request.body or b""),
+                response_bytes=len(resp.content),
+            )
             # logging.info(f"Response from MC {api_method}: {resp.text[0:400]}")
             return resp
+
+        try:
+            return self.upstream.call(
+                post, lambda resp, error: judge_response(api_method, resp, error)
+            )
         except RuntimeError:
             logging.exception("Error posting to MC")
 
@@ -156,7 +198,9 @@ class MobileCommonsClient:
                 and d["response"]["success"] == "true"
             )
         except (RuntimeError, KeyError, xmltodict.expat.ExpatError):
-            logging.exception(f"Failed to read mobile commons response {response.text}")
+            logging.exception(
+                "Failed to read mobile commons response %s", logs.preview(response.text)
+            )
 
     def create_or_update_mobile_commons_profile(self, payload):
         return self.post_to_mobile_commons("profile_update", payload)
@@ -193,18 +237,23 @@ class MobileCommonsClient:
         params = {"limit": limit_per_page, "start_time": start_str, "end_time": end_str}
         url = MOBILE_COMMONS_API_BASE + "messages"
         fails = 0
+        backoff = Backoff(base=retry_wait, cap=retry_wait * 2**retry_limit)
 
         while True:
             if end_page and page >= end_page:
                 break
-            time.sleep(fails * retry_wait)
+            if fails:
+                time.sleep(backoff.delay(fails - 1))
 
             params["page"] = page
-            logging.debug(f"Requesting {url} with params {params}")
+            logging.debug("Requesting %s with params %s", url, logs.preview(params))
 
             try:
-                resp = self.session.get(
-                    url, params=params, auth=(self.username, self.password)
+                resp = self.upstream.call(
+                    lambda: self.session.get(
+                        url, params=params, auth=(self.username, self.password)
+                    ),
+                    lambda resp, error: judge_response("messages", resp, error),
                 )
 
                 data = xmltodict.parse(resp.text, attr_prefix="", cdata_key="value")
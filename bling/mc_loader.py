@@ -2,8 +2,9 @@ import logging
 from typing import Optional
 
 from bling.transport import IncomingMesage, MobileCommonsTransport
-from bling.helpscout.mailboxes import MAILBOXES_BY_CAMPAIGN_ID
+from bling.helpscout import mailboxes
 from bling.clients import incoming_message_handler, mobilecommons_transport
+from bling.common import logs
 from bling.phone import Phone
 
 
@@ -34,10 +35,12 @@ def load_mobilecommons_incoming(
 
     for msg in transport.get_client().get_all_received_messages(start_str, end_str):
         campaign_id = msg.get("campaign_id")
-        mailbox = MAILBOXES_BY_CAMPAIGN_ID.get(campaign_id)
+        mailbox = mailboxes.registry.by_campaign_id(campaign_id)
 
         if mailbox is None:
-            logging.warning(f"Failed to find a mailbox for message: '{msg}'")
+            logging.warning(
+                "Failed to find a mailbox for message: %s", logs.preview(msg)
+            )
             continue  # Early Continuation
 
         # Pulling these particular fields from the mobilecommons messages is
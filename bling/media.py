@@ -0,0 +1,275 @@
+"""
+Copies the media (photos, etc.) in incoming MMS messages from Twilio into
+attachments on the message's Help Scout thread, so agents don't have to
+click through to Twilio links that eventually expire.
+
+The webhook only queues the work; a small thread pool does the copying after
+Twilio has its response. On Lambda, where the container is frozen as soon as
+the webhook returns, the work is handed to an asynchronous invocation of the
+same function instead, which lambda_handler.py passes to handle_async. Each
+file is streamed from Twilio to a cache file named for its media SID, then
+streamed from there to Help Scout, so neither leg holds the whole file in
+memory, and a retried upload doesn't download it again. The cache file is
+removed once the upload succeeds, or the last attempt fails.
+"""
+
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+from bling.common import metrics
+from bling.common.lru import LRUCache
+from bling.config import config
+
+ATTEMPTS = 3
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# The "source" of the Lambda events we invoke ourselves with
+ASYNC_SOURCE = "bling.media"
+
+
+@dataclass
+class Media:
+    url: str
+    content_type: str
+
+    @property
+    def sid(self) -> str:
+        return self.url.rstrip("/").rsplit("/", 1)[-1]
+
+    @property
+    def file_name(self) -> str:
+        extension = mimetypes.guess_extension(self.content_type) or ""
+        return f"{self.sid}{extension}"
+
+
+def media_in(payload: Mapping[str, str]) -> List[Media]:
+    """The media in an incoming Twilio SMS webhook"""
+    media = []
+    for i in range(int(payload.get("NumMedia") or 0)):
+        url = payload.get(f"MediaUrl{i}")
+        if url:
+            content_type = payload.get(f"MediaContentType{i}")
+            media.append(Media(url, content_type or "application/octet-stream"))
+    return media
+
+
+def _session():
+    from bling.clients import twilio_client
+
+    return twilio_client().http_client.session
+
+
+def _cache_path(media: Media) -> str:
+    return os.path.join(config.media_cache_dir, media.sid)
+
+
+def download(media: Media) -> str:
+    """The path of a local copy of the media, fetching it if there isn't one"""
+    from bling.twi.http_client import with_base_url
+
+    os.makedirs(config.media_cache_dir, exist_ok=True)
+    path = _cache_path(media)
+    if os.path.exists(path):
+        metrics.increment("media_cache_total", result="hit")
+        return path
+    metrics.increment("media_cache_total", result="miss")
+
+    start = time.perf_counter()
+    size = 0
+    with _session().get(
+        with_base_url(media.url, config.twilio_base_url),
+        auth=(config.twilio_account_sid, config.twilio_auth_token),
+        stream=True,
+        timeout=30,
+    ) as res:
+        metrics.record_upstream(
+            "twilio", "media.fetch", res.status_code, time.perf_counter() - start
+        )
+        res.raise_for_status()
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in res.iter_content(DOWNLOAD_CHUNK_BYTES):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, path)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+    metrics.observe("media_bytes", size, buckets=metrics.SIZE_BUCKETS)
+    return path
+
+
+class MediaForwarder:
+    def __init__(self, client, workers: int):
+        self.client = client
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bling-media"
+        )
+        self._pending: Set[Future] = set()
+        self._lock = threading.Lock()
+        # Media already attached, so the same message handled twice doesn't
+        # attach it twice
+        self._done = LRUCache(1024)
+
+    def submit(
+        self,
+        conversation_id: int,
+        thread_id: Optional[int],
+        media: List[Media],
+        text: str = "",
+    ) -> Future:
+        future = self._pool.submit(
+            self.forward, conversation_id, thread_id, media, text
+        )
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for queued media to be forwarded; False if it timed out"""
+        with self._lock:
+            pending = set(self._pending)
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
+
+    def forward(
+        self,
+        conversation_id: int,
+        thread_id: Optional[int],
+        media: List[Media],
+        text: str = "",
+    ):
+        """
+        Attach the media to the thread, or when Help Scout didn't tell us its
+        id (a new conversation), to the customer thread with the message's
+        text. Not the newest customer thread, which could be a later text.
+        """
+        if thread_id is None:
+            thread_id = self.client.customer_thread_id(conversation_id, text)
+            if thread_id is None:
+                logging.warning(
+                    "No thread to attach media to in conversation %s", conversation_id
+                )
+                return
+        for item in media:
+            if self._done.get(item.sid):
+                continue
+            for attempt in range(1, ATTEMPTS + 1):
+                try:
+                    path = download(item)
+                    self.client.upload_attachment(
+                        conversation_id,
+                        thread_id,
+                        item.file_name,
+                        item.content_type,
+                        path,
+                    )
+                except Exception:
+                    if attempt == ATTEMPTS:
+                        with suppress(FileNotFoundError):
+                            os.remove(_cache_path(item))
+                        metrics.increment("media_forwarded_total", result="failed")
+                        logging.exception(
+                            "Failed to attach %s to conversation %s",
+                            item.sid,
+                            conversation_id,
+                        )
+                    else:
+                        time.sleep(attempt)
+                    continue
+                self._done.put(item.sid, True)
+                metrics.increment("media_forwarded_total", result="ok")
+                with suppress(FileNotFoundError):
+                    os.remove(path)
+                break
+
+
+_forwarder: Optional[MediaForwarder] = None
+_forwarder_lock = threading.Lock()
+
+
+def forwarder() -> MediaForwarder:
+    global _forwarder
+    with _forwarder_lock:
+        if _forwarder is None:
+            from bling.clients import helpscout_client
+
+            _forwarder = MediaForwarder(helpscout_client(), config.media_workers)
+    return _forwarder
+
+
+_lambda = None
+
+
+def _lambda_client():
+    # boto3 comes with the Lambda runtime
+    import boto3
+
+    global _lambda
+    if _lambda is None:
+        _lambda = boto3.client("lambda")
+    return _lambda
+
+
+def _invoke_async(event: Dict[str, Any]):
+    start = time.perf_counter()
+    res = _lambda_client().invoke(
+        FunctionName=os.environ["AWS_LAMBDA_FUNCTION_NAME"],
+        InvocationType="Event",
+        Payload=json.dumps(event).encode("utf-8"),
+    )
+    metrics.record_upstream(
+        "lambda", "invoke", res["StatusCode"], time.perf_counter() - start
+    )
+
+
+def submit(
+    conversation_id: int, thread_id: Optional[int], media: List[Media], text: str
+):
+    """Attach the media to the thread, without holding up the webhook; text is
+    the message's, see MediaForwarder.forward"""
+    if not config.on_lambda:
+        forwarder().submit(conversation_id, thread_id, media, text)
+        return
+    try:
+        _invoke_async(
+            {
+                "source": ASYNC_SOURCE,
+                "conversation_id": conversation_id,
+                "thread_id": thread_id,
+                "text": text,
+                "media": [
+                    {"url": m.url, "content_type": m.content_type} for m in media
+                ],
+            }
+        )
+    except Exception:
+        # The links in the message text still work
+        metrics.increment("media_forwarded_total", len(media), result="failed")
+        logging.exception(
+            "Failed to hand off media for conversation %s", conversation_id
+        )
+
+
+def handle_async(event: Dict[str, Any]):
+    """Attach the media in an event from submit, see lambda_handler.py"""
+    forwarder().forward(
+        event["conversation_id"],
+        event["thread_id"],
+        [Media(**m) for m in event["media"]],
+        event.get("text", ""),
+    )
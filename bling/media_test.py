@@ -0,0 +1,174 @@
+import os
+
+import pytest
+import requests
+
+from bling import media
+from bling.bench.fakes import FakeHelpScout, FakeTwilio
+from bling.config import config
+from bling.helpscout.client import HelpScoutClient
+
+IMAGE = bytes(range(256)) * 1000
+
+
+@pytest.fixture
+def twilio(monkeypatch, tmp_path):
+    with FakeTwilio() as fake:
+        monkeypatch.setitem(config.__dict__, "twilio_base_url", fake.url)
+        monkeypatch.setitem(config.__dict__, "twilio_account_sid", "AC123")
+        monkeypatch.setitem(config.__dict__, "twilio_auth_token", "token")
+        monkeypatch.setitem(config.__dict__, "media_cache_dir", str(tmp_path))
+        monkeypatch.setattr(media, "_session", requests.Session)
+        yield fake
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+@pytest.fixture
+def forwarder(helpscout):
+    client = HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s")
+    return media.MediaForwarder(client, workers=2)
+
+
+def test_media_in():
+    assert media.media_in({"NumMedia": "0"}) == []
+    [item] = media.media_in(
+        {
+            "NumMedia": "1",
+            "MediaUrl0": "https://api.twilio.com/2010-04-01/Accounts/AC1/Messages/MM1/Media/ME1",
+            "MediaContentType0": "image/jpeg",
+        }
+    )
+    assert item.sid == "ME1"
+    assert item.file_name == "ME1.jpg"
+
+
+def test_attaches_media_to_the_thread(twilio, helpscout, forwarder, tmp_path):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=2)
+    thread_id = conversation.threads[1]["id"]
+    url = twilio.add_media("image/png", IMAGE)
+
+    forwarder.submit(conversation.id, thread_id, [media.Media(url, "image/png")])
+    assert forwarder.wait(5)
+
+    [attachment] = helpscout.attachments[thread_id]
+    assert attachment["data"] == IMAGE
+    assert attachment["mimeType"] == "image/png"
+    assert attachment["fileName"].endswith(".png")
+    # Nothing left in the cache once it's attached
+    assert os.listdir(tmp_path) == []
+
+    # The same media again is skipped
+    forwarder.submit(conversation.id, thread_id, [media.Media(url, "image/png")])
+    assert forwarder.wait(5)
+    assert len(helpscout.attachments[thread_id]) == 1
+
+
+def test_retries_upload_without_downloading_again(
+    twilio, helpscout, forwarder, monkeypatch
+):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    url = twilio.add_media("image/gif", IMAGE)
+    monkeypatch.setattr(media.time, "sleep", lambda seconds: None)
+    upload = forwarder.client.upload_attachment
+    calls = []
+
+    def flaky_upload(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise requests.ConnectionError("reset")
+        return upload(*args)
+
+    monkeypatch.setattr(forwarder.client, "upload_attachment", flaky_upload)
+    # A new conversation, so the thread has to be looked up
+    forwarder.submit(
+        conversation.id, None, [media.Media(url, "image/gif")], "Seeded message"
+    )
+    assert forwarder.wait(5)
+
+    assert len(calls) == 2
+    media_requests = [k for k in twilio.requests if "/Media/" in k]
+    assert [twilio.requests[k] for k in media_requests] == [1]
+    [attachment] = helpscout.attachments[conversation.threads[0]["id"]]
+    assert attachment["data"] == IMAGE
+
+
+def test_failed_upload_leaves_nothing_cached(
+    twilio, helpscout, forwarder, monkeypatch, tmp_path
+):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    url = twilio.add_media("image/png", IMAGE)
+    monkeypatch.setattr(media.time, "sleep", lambda seconds: None)
+
+    def failing_upload(*args):
+        raise requests.ConnectionError("reset")
+
+    monkeypatch.setattr(forwarder.client, "upload_attachment", failing_upload)
+    forwarder.submit(
+        conversation.id, conversation.threads[0]["id"], [media.Media(url, "image/png")]
+    )
+    assert forwarder.wait(5)
+    assert os.listdir(tmp_path) == []
+
+
+def test_new_conversation_media_goes_to_the_message_thread(
+    twilio, helpscout, forwarder
+):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    [message] = conversation.threads
+    # Another text arrives before the media is copied
+    conversation.threads.append(helpscout._new_thread("customer", "And another"))
+    url = twilio.add_media("image/png", IMAGE)
+
+    forwarder.submit(
+        conversation.id, None, [media.Media(url, "image/png")], "Seeded message"
+    )
+    assert forwarder.wait(5)
+    assert list(helpscout.attachments) == [message["id"]]
+
+    # No thread with the message's text, so nowhere to attach it
+    forwarder.submit(
+        conversation.id, None, [media.Media(url + "2", "image/png")], "Gone"
+    )
+    assert forwarder.wait(5)
+    assert list(helpscout.attachments) == [message["id"]]
+
+
+def test_lambda_hands_media_to_another_invocation(
+    twilio, helpscout, forwarder, monkeypatch
+):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    thread_id = conversation.threads[0]["id"]
+    url = twilio.add_media("image/png", IMAGE)
+    monkeypatch.setitem(config.__dict__, "on_lambda", True)
+    monkeypatch.setattr(media, "_forwarder", forwarder)
+    events = []
+    monkeypatch.setattr(media, "_invoke_async", events.append)
+
+    media.submit(
+        conversation.id, thread_id, [media.Media(url, "image/png")], "Seeded message"
+    )
+    assert helpscout.attachments.get(thread_id) is None
+
+    [event] = events
+    assert event["source"] == media.ASYNC_SOURCE
+    media.handle_async(event)
+    [attachment] = helpscout.attachments[thread_id]
+    assert attachment["data"] == IMAGE
+
+
+def test_failed_download_leaves_nothing_behind(twilio, monkeypatch, tmp_path):
+    url = twilio.add_media("image/png", IMAGE)
+
+    def broken(self, chunk_size=1):
+        yield IMAGE[:chunk_size]
+        raise requests.ConnectionError("reset")
+
+    monkeypatch.setattr(requests.Response, "iter_content", broken)
+    with pytest.raises(requests.ConnectionError):
+        media.download(media.Media(url, "image/png"))
+    assert os.listdir(tmp_path) == []
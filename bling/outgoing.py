@@ -2,12 +2,14 @@ import logging
 from typing import Any, Dict
 
 from dateutil import parser as date_parser
-from lxml import html
 
 from bling.helpscout.mailboxes import Mailbox
 from bling.phone import Phone
+from bling.common import logs
 from bling.common.utils import nested_get
+from bling.config import config
 from bling.helpscout.client import HelpScoutClient, NewCustomer, Thread, ThreadType
+from bling.sms_encoding import encode_sms
 from bling.transport import Transport, OutgoingMessage
 
 
@@ -29,13 +31,13 @@ class OutgoingHandler:
         # Get conversation id
         conversation_id = webhook_payload.get("id")
         if not conversation_id:
-            logging.warning(f"Payload missing ID: {webhook_payload}")
+            logging.warning("Payload missing ID: %s", logs.preview(webhook_payload))
             return
 
         # Get user phone
         user_helpscout_phone = nested_get(webhook_payload, "customer", "phone")
         if not user_helpscout_phone:
-            logging.warning(f"Payload user phone: {webhook_payload}")
+            logging.warning("Payload user phone: %s", logs.preview(webhook_payload))
             return
 
         user_phone = Phone.parse(user_helpscout_phone)  # type: ignore
@@ -57,15 +59,41 @@ class OutgoingHandler:
             or source_via != "user"
         ):
             logging.error(
-                f"Most recent thread does not appear to have been created by an agent: {most_recent}"
+                "Most recent thread does not appear to have been created by an agent: %s",
+                logs.preview(most_recent),
             )
             return
 
         body = self._clean_text(most_recent.get("body", ""))
         if body == "":
-            logging.error(f"Empty message text: {most_recent.get('body')}")
+            logging.error(
+                "Empty message text: %s", logs.preview(most_recent.get("body"))
+            )
             return
 
+        # Avoid UCS-2 (and twice the segments) over a stray smart quote
+        encoded = encode_sms(
+            body,
+            allow_transliteration=config.sms_transliterate,
+            fold_accents=config.sms_fold_accents,
+        )
+        body = encoded.body
+        if body.strip() == "":
+            # e.g. a reply of nothing but zero-width characters
+            logging.error(
+                "Empty message text after encoding: %s",
+                logs.preview(most_recent.get("body")),
+            )
+            return
+
+        logging.info(
+            "Sending SMS reply for conversation %s: %s, %d segment(s)%s",
+            conversation_id,
+            encoded.encoding,
+            encoded.segments,
+            " (transliterated)" if encoded.transliterated else "",
+        )
+
         # Send the text
         self.transport.send_response(
             OutgoingMessage(mailbox=mailbox, to_phone=user_phone, body=body)
@@ -84,6 +112,8 @@ class OutgoingHandler:
 
     def _clean_text(self, text: str) -> str:
         if "<" in text:
+            from lxml import html
+
             plaintext = html.document_fromstring(text).text_content().strip()
         else:
             plaintext = text.strip()
@@ -135,6 +135,14 @@ def test_empty_message(handler, mailbox, webhook_payload):
     assert handler.hs_client.add_thread_to_conversation.call_count == 0
 
 
+def test_message_empty_after_encoding(handler, mailbox, webhook_payload):
+    webhook_payload["threads"][1]["body"] = "\u200b \u200b\ufeff"
+    handler.handle_outgoing_reply(mailbox, webhook_payload)
+
+    assert handler.transport.send_response.call_count == 0
+    assert handler.hs_client.add_thread_to_conversation.call_count == 0
+
+
 def test_clean_text_html(handler):
     assert handler._clean_text(" abc <p>foo <br /> bar</p>  ") == "abc foo  bar"
 
@@ -144,3 +152,16 @@ def test_clean_text_signature(handler):
         handler._clean_text("foo\nbar -- baz\n-- bax\n--\nsome signature")
         == "foo\nbar -- baz\n-- bax"
     )
+
+
+def test_send_reply_transliterates_typography(handler, mailbox, webhook_payload):
+    webhook_payload["threads"][1]["body"] = "<p>We’ll call you back — soon…</p>"
+    handler.handle_outgoing_reply(mailbox, webhook_payload)
+
+    handler.transport.send_response.assert_called_with(
+        OutgoingMessage(
+            mailbox=mailbox,
+            to_phone=Phone.parse("+15558889999"),
+            body="We'll call you back - soon...",
+        )
+    )
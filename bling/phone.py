@@ -1,7 +1,5 @@
 from dataclasses import dataclass
 
-import phonenumbers
-
 from bling.config import config
 
 
@@ -27,6 +25,10 @@ class Phone:
 
     @staticmethod
     def parse(input_phone: str):
+        # phonenumbers loads a lot of metadata, so only import it once we
+        # actually have a number to parse
+        import phonenumbers
+
         phone = phonenumbers.parse(input_phone, "US")
         national_phone = str(phone.national_number)
 
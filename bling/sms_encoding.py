@@ -0,0 +1,176 @@
+from dataclasses import dataclass
+
+GSM_7 = "GSM-7"
+UCS_2 = "UCS-2"
+
+# GSM 03.38 basic character set. Each of these costs one septet.
+GSM_BASIC_CHARS = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+
+# GSM 03.38 extension table. These are sent as ESC + char, so they cost two
+# septets and can't be split across segments.
+GSM_EXTENDED_CHARS = frozenset("\f^{}\\[~]|€")
+
+# Single-segment and per-segment (once a UDH header is needed) capacities
+GSM_SINGLE_SEGMENT = 160
+GSM_MULTI_SEGMENT = 153
+UCS_SINGLE_SEGMENT = 70
+UCS_MULTI_SEGMENT = 67
+
+# Typographic characters the Help Scout editor likes to produce, mapped to
+# their closest GSM-7 equivalents. A single one of these in a reply would
+# otherwise force the whole message into UCS-2.
+TRANSLITERATIONS = {
+    "\u00a0": " ",  # no-break space
+    "\u2002": " ",  # en space
+    "\u2003": " ",  # em space
+    "\u2009": " ",  # thin space
+    "\u200a": " ",  # hair space
+    "\u202f": " ",  # narrow no-break space
+    "\u200b": "",  # zero-width space
+    "\u200c": "",  # zero-width non-joiner
+    "\u200d": "",  # zero-width joiner
+    "\u2060": "",  # word joiner
+    "\ufeff": "",  # byte order mark
+    "\u00ad": "",  # soft hyphen
+    "‐": "-",  # hyphen
+    "‑": "-",  # non-breaking hyphen
+    "‒": "-",  # figure dash
+    "–": "-",  # en dash
+    "—": "-",  # em dash
+    "―": "-",  # horizontal bar
+    "−": "-",  # minus sign
+    "‘": "'",  # left single quote
+    "’": "'",  # right single quote
+    "‚": "'",  # single low-9 quote
+    "‛": "'",  # single high-reversed-9 quote
+    "′": "'",  # prime
+    "´": "'",  # acute accent
+    "`": "'",  # grave accent
+    "‹": "'",  # single left-pointing angle quote
+    "›": "'",  # single right-pointing angle quote
+    "“": '"',  # left double quote
+    "”": '"',  # right double quote
+    "„": '"',  # double low-9 quote
+    "‟": '"',  # double high-reversed-9 quote
+    "″": '"',  # double prime
+    "«": '"',  # left-pointing double angle quote
+    "»": '"',  # right-pointing double angle quote
+    "…": "...",  # ellipsis
+    "•": "-",  # bullet
+    "·": "-",  # middle dot
+    "×": "x",  # multiplication sign
+    "÷": "/",  # division sign
+    "⁄": "/",  # fraction slash
+}
+
+# Accented letters outside GSM-7, mapped to the letter without the accent.
+# Unlike the typography above this changes the words themselves ("Acción"
+# becomes "Accion"), so it's only done with BLING_SMS_FOLD_ACCENTS.
+ACCENT_FOLDING = {
+    "á": "a",
+    "â": "a",
+    "ã": "a",
+    "ç": "c",
+    "ê": "e",
+    "ë": "e",
+    "í": "i",
+    "î": "i",
+    "ï": "i",
+    "ó": "o",
+    "ô": "o",
+    "õ": "o",
+    "ú": "u",
+    "û": "u",
+    "Á": "A",
+    "À": "A",
+    "Â": "A",
+    "Ã": "A",
+    "È": "E",
+    "Ê": "E",
+    "Í": "I",
+    "Ó": "O",
+    "Ú": "U",
+}
+
+_TRANSLITERATION_TABLE = str.maketrans(TRANSLITERATIONS)
+_ACCENT_FOLDING_TABLE = str.maketrans({**TRANSLITERATIONS, **ACCENT_FOLDING})
+
+
+@dataclass
+class EncodedMessage:
+    """
+    An outbound SMS body, along with the encoding it will be sent with and the
+    number of segments (and so carrier sends) it will cost.
+    """
+
+    body: str
+    encoding: str
+    segments: int
+    transliterated: bool = False
+
+
+def is_gsm_7(text: str) -> bool:
+    return all(c in GSM_BASIC_CHARS or c in GSM_EXTENDED_CHARS for c in text)
+
+
+def transliterate(text: str, fold_accents: bool = False) -> str:
+    """Replace typographic characters (and, with fold_accents, accented
+    letters) with their GSM-7 equivalents"""
+    if fold_accents:
+        return text.translate(_ACCENT_FOLDING_TABLE)
+    return text.translate(_TRANSLITERATION_TABLE)
+
+
+def count_segments(text: str) -> int:
+    """Number of segments a message will be split into by the carrier"""
+    if is_gsm_7(text):
+        units = [2 if c in GSM_EXTENDED_CHARS else 1 for c in text]
+        single, multi = GSM_SINGLE_SEGMENT, GSM_MULTI_SEGMENT
+    else:
+        # UCS-2 is really UTF-16 on the wire: characters outside the BMP
+        # (emoji, mostly) take a surrogate pair, which can't be split.
+        units = [2 if ord(c) > 0xFFFF else 1 for c in text]
+        single, multi = UCS_SINGLE_SEGMENT, UCS_MULTI_SEGMENT
+
+    if sum(units) <= single:
+        return 1
+
+    segments = 1
+    used = 0
+    for size in units:
+        if used + size > multi:
+            segments += 1
+            used = 0
+        used += size
+    return segments
+
+
+def encode_sms(
+    text: str, allow_transliteration: bool = True, fold_accents: bool = False
+) -> EncodedMessage:
+    """
+    Pick the cheapest encoding for an outbound SMS.
+
+    If the text isn't GSM-7 and transliteration is allowed, typographic
+    characters are swapped for GSM-7 equivalents -- but only if that makes the
+    whole message GSM-7. If something else (e.g. an emoji, or an accented
+    letter without fold_accents) would force UCS-2 anyway, the original text
+    is sent untouched.
+    """
+    if is_gsm_7(text):
+        return EncodedMessage(body=text, encoding=GSM_7, segments=count_segments(text))
+
+    if allow_transliteration:
+        replaced = transliterate(text, fold_accents)
+        if is_gsm_7(replaced):
+            return EncodedMessage(
+                body=replaced,
+                encoding=GSM_7,
+                segments=count_segments(replaced),
+                transliterated=True,
+            )
+
+    return EncodedMessage(body=text, encoding=UCS_2, segments=count_segments(text))
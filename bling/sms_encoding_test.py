@@ -0,0 +1,70 @@
+from bling.sms_encoding import GSM_7, UCS_2, count_segments, encode_sms
+
+
+def test_count_segments_gsm():
+    assert count_segments("") == 1
+    assert count_segments("a" * 160) == 1
+    assert count_segments("a" * 161) == 2
+    assert count_segments("a" * 306) == 2
+    assert count_segments("a" * 307) == 3
+
+    # extended characters cost two septets
+    assert count_segments("€" * 80) == 1
+    assert count_segments("€" * 81) == 2
+
+    # ...and can't be split across a segment boundary
+    assert count_segments("a" * 152 + "€" + "a" * 152) == 3
+
+
+def test_count_segments_ucs():
+    assert count_segments("é" * 160) == 1  # é is in the GSM basic set
+    assert count_segments("ê" * 70) == 1
+    assert count_segments("ê" * 71) == 2
+    assert count_segments("ê" * 134) == 2
+    assert count_segments("ê" * 135) == 3
+
+    # emoji are surrogate pairs in UTF-16
+    assert count_segments("😀" * 35) == 1
+    assert count_segments("😀" * 36) == 2
+
+
+def test_encode_plain_gsm():
+    encoded = encode_sms("Thanks for reaching out!")
+    assert encoded.body == "Thanks for reaching out!"
+    assert encoded.encoding == GSM_7
+    assert encoded.segments == 1
+    assert not encoded.transliterated
+
+
+def test_encode_transliterates_typography():
+    text = "We’ll be there — “soon”… " + "x" * 120
+    encoded = encode_sms(text)
+    assert encoded.body == 'We\'ll be there - "soon"... ' + "x" * 120
+    assert encoded.encoding == GSM_7
+    assert encoded.segments == 1
+    assert encoded.transliterated
+
+    # without transliteration the same reply takes three UCS-2 segments
+    untouched = encode_sms(text, allow_transliteration=False)
+    assert untouched.body == text
+    assert untouched.encoding == UCS_2
+    assert untouched.segments == 3
+
+
+def test_encode_keeps_original_when_ucs_is_unavoidable():
+    text = "We’ll be there 😀"
+    encoded = encode_sms(text)
+    assert encoded.body == text
+    assert encoded.encoding == UCS_2
+    assert not encoded.transliterated
+
+
+def test_encode_keeps_accents_unless_asked():
+    text = "¿Cómo está? Acción — ya"
+    encoded = encode_sms(text)
+    assert encoded.body == text
+    assert encoded.encoding == UCS_2
+
+    folded = encode_sms(text, fold_accents=True)
+    assert folded.body == "¿Como esta? Accion - ya"
+    assert folded.encoding == GSM_7
@@ -1,10 +1,17 @@
+import time
 from dataclasses import dataclass
-from typing import Union
+from typing import TYPE_CHECKING, Optional, Union
 
+from bling.common import metrics
+from bling.common.resilience import OK, Verdict, upstream
 from bling.helpscout.mailboxes import Mailbox
-from bling.mc.client import MobileCommonsClient
 from bling.phone import Phone
-from twilio.rest import TwilioClient
+
+# Only needed for type hints; a Twilio-only deployment shouldn't have to
+# import the Mobile Commons client (and vice versa) just to load this module
+if TYPE_CHECKING:
+    from bling.mc.client import MobileCommonsClient
+    from twilio.rest import Client as TwilioClient
 
 TWILIO_TRANSPORT_TYPE = "twilio"
 MOBILECOMMONS_TRANSPORT_TYPE = "mobilecommons"
@@ -25,7 +32,7 @@ class OutgoingMessage:
 
 
 class Transport:
-    def get_client(self) -> Union[MobileCommonsClient, TwilioClient]:
+    def get_client(self) -> Union["MobileCommonsClient", "TwilioClient"]:
         raise NotImplementedError("'get_client' is not implemented on this transport")
 
     def send_response(self, message: OutgoingMessage):
@@ -34,26 +41,78 @@ class Transport:
         )
 
 
+def judge_twilio(result, error: Optional[Exception]) -> Verdict:
+    """
+    Only retry sends that can't have gone out: rate limited, or never
+    connected. Anything else might have, and a supporter getting the same
+    text twice is worse than a failure we can see.
+    """
+    if error is None:
+        return OK
+    # TwilioRestException carries the HTTP status of the API error
+    status = getattr(error, "status", None)
+    if status == 429:
+        return Verdict(failed=False, retry=True, reason="429")
+    if isinstance(status, int):
+        return Verdict(failed=status >= 500, reason=str(status))
+    import requests
+
+    if isinstance(error, requests.RequestException):
+        return Verdict(
+            failed=True,
+            retry=isinstance(error, requests.ConnectTimeout),
+            reason=type(error).__name__,
+        )
+    return OK
+
+
 class TwilioTransport(Transport):
-    def __init__(self, client: TwilioClient):
+    def __init__(self, client: "TwilioClient"):
         self.client = client
+        self.upstream = upstream("twilio")
 
-    def get_client(self) -> TwilioClient:
+    def get_client(self) -> "TwilioClient":
         return self.client
 
     def send_response(self, message: OutgoingMessage):
-        return self.client.messages.create(
-            to=message.to_phone.twilio_format,
-            from_=message.mailbox.phone.twilio_format,
-            body=message.body,
-        )
+        mailbox = message.mailbox
+        if mailbox.messaging_service_sid:
+            # The Messaging Service picks the number (with its own sticky
+            # sender) and spreads the load across its pool
+            sender = {"messaging_service_sid": mailbox.messaging_service_sid}
+        else:
+            sender = {"from_": mailbox.sender_for(message.to_phone).twilio_format}
+
+        start = time.perf_counter()
+        status: object = "error"
+        try:
+            response = self.upstream.call(
+                lambda: self.client.messages.create(
+                    to=message.to_phone.twilio_format, body=message.body, **sender
+                ),
+                judge_twilio,
+            )
+            status = 201
+            return response
+        except Exception as e:
+            # TwilioRestException carries the HTTP status of the API error
+            status = getattr(e, "status", "error")
+            raise
+        finally:
+            metrics.record_upstream(
+                "twilio",
+                "messages.create",
+                status,
+                time.perf_counter() - start,
+                request_bytes=len(message.body.encode("utf-8")),
+            )
 
 
 class MobileCommonsTransport(Transport):
-    def __init__(self, client: MobileCommonsClient):
+    def __init__(self, client: "MobileCommonsClient"):
         self.client = client
 
-    def get_client(self) -> MobileCommonsClient:
+    def get_client(self) -> "MobileCommonsClient":
         return self.client
 
     def send_response(self, message: OutgoingMessage):
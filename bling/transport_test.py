@@ -0,0 +1,78 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from bling.helpscout.mailboxes import parse_mailboxes
+from bling.phone import Phone
+from bling.transport import OutgoingMessage, TwilioTransport
+
+
+def test_twilio_single_number():
+    transport = TwilioTransport(MagicMock())
+    [mailbox] = parse_mailboxes("twilio:+15556667777:123")
+
+    transport.send_response(
+        OutgoingMessage(
+            mailbox=mailbox, to_phone=Phone.parse("+15558889999"), body="hi"
+        )
+    )
+
+    transport.client.messages.create.assert_called_with(
+        to="+15558889999", from_="+15556667777", body="hi"
+    )
+
+
+def test_twilio_sender_pool():
+    transport = TwilioTransport(MagicMock())
+    [mailbox] = parse_mailboxes("twilio:+15556667777|+15550001111:123")
+    to_phone = Phone.parse("+15558889999")
+
+    transport.send_response(
+        OutgoingMessage(mailbox=mailbox, to_phone=to_phone, body="hi")
+    )
+
+    transport.client.messages.create.assert_called_with(
+        to="+15558889999", from_=mailbox.sender_for(to_phone).twilio_format, body="hi"
+    )
+
+
+def test_twilio_messaging_service():
+    transport = TwilioTransport(MagicMock())
+    [mailbox] = parse_mailboxes("twilio:MG123|+15556667777:123")
+
+    transport.send_response(
+        OutgoingMessage(
+            mailbox=mailbox, to_phone=Phone.parse("+15558889999"), body="hi"
+        )
+    )
+
+    transport.client.messages.create.assert_called_with(
+        to="+15558889999", messaging_service_sid="MG123", body="hi"
+    )
+
+
+def test_twilio_retries_rate_limited_sends():
+    from twilio.base.exceptions import TwilioRestException
+
+    from bling.common.resilience import Backoff, Upstream
+
+    transport = TwilioTransport(MagicMock())
+    transport.upstream = Upstream("twilio", backoff=Backoff(base=0.01))
+    transport.client.messages.create.side_effect = [
+        TwilioRestException(429, "/Messages.json", "Too many requests"),
+        "sent",
+    ]
+    [mailbox] = parse_mailboxes("twilio:+15556667777:123")
+    message = OutgoingMessage(
+        mailbox=mailbox, to_phone=Phone.parse("+15558889999"), body="hi"
+    )
+
+    assert transport.send_response(message) == "sent"
+
+    # Other errors might have sent the text, so they aren't retried
+    transport.client.messages.create.side_effect = TwilioRestException(
+        500, "/Messages.json", "Oops"
+    )
+    with pytest.raises(TwilioRestException):
+        transport.send_response(message)
+    assert transport.client.messages.create.call_count == 3
@@ -0,0 +1,28 @@
+import re
+from typing import Optional
+
+from twilio.http.http_client import TwilioHttpClient
+
+_TWILIO_HOST_RE = re.compile(r"^https://[a-z0-9.-]+\.twilio\.com")
+
+
+def with_base_url(url: str, base_url: Optional[str]) -> str:
+    """A Twilio URL, on base_url's host instead if that's set"""
+    return _TWILIO_HOST_RE.sub(base_url.rstrip("/"), url) if base_url else url
+
+
+class BaseUrlHttpClient(TwilioHttpClient):
+    """
+    Sends every Twilio API request to another host, e.g. the fake Twilio in
+    bling/bench/fakes.py. The twilio library builds absolute URLs itself, so
+    this is the only place to swap the host out.
+    """
+
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        return super().request(
+            method, with_base_url(url, self.base_url), *args, **kwargs
+        )
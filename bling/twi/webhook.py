@@ -1,13 +1,13 @@
 # From: https://www.twilio.com/docs/usage/tutorials/how-to-secure-your-flask-app-by-validating-incoming-twilio-requests
 
-import logging
 from functools import wraps
 
 from flask import abort, request
 
+from bling.common import logs
 from bling.common.request_url import request_url
-from bling.config import config
-from twilio.request_validator import RequestValidator
+from bling.common.webhook_auth import twilio_replay_cache, twilio_validator
+from bling.webhooks import TWILIO_EMPTY_RESPONSE
 
 
 def validate_twilio_request(f):
@@ -15,25 +15,30 @@ def validate_twilio_request(f):
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Create an instance of the RequestValidator class
-        validator = RequestValidator(config.twilio_auth_token)
-
         url = request_url()
+        signature = request.headers.get("X-TWILIO-SIGNATURE", "")
 
         # Validate the request using its URL, POST data,
         # and X-TWILIO-SIGNATURE header
-        request_valid = validator.validate(
-            url, request.form, request.headers.get("X-TWILIO-SIGNATURE", "")
-        )
+        request_valid = twilio_validator().validate(url, request.form, signature)
 
         # Continue processing the request if it's valid, return a 403 error if
         # it's not
-        if request_valid:
-            return f(*args, **kwargs)
-        else:
-            logging.warning(
-                f"Invalid Twilio signature :: {url} :: {request.headers.get('X-TWILIO-SIGNATURE', '')} :: {request.form}"
+        if not request_valid:
+            logs.warning_limited(
+                "invalid_twilio_signature",
+                "Invalid Twilio signature :: %s :: %s :: %s",
+                url,
+                signature,
+                logs.preview(request.form.to_dict()),
             )
             return abort(403)
 
+        # A replay (or a retry of a request we already handled) gets the same
+        # empty response as the original, so Twilio doesn't fall back to the
+        # error handler and text the supporter that something went wrong
+        return twilio_replay_cache.run_once(
+            signature, lambda: f(*args, **kwargs), duplicate=TWILIO_EMPTY_RESPONSE
+        )
+
     return decorated_function
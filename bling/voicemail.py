@@ -0,0 +1,120 @@
+"""
+Puts a voicemail and its transcription in the same Help Scout thread.
+
+Twilio sends the recording first, from the Studio flow, and the
+transcription a little later, to a separate callback. The recording goes
+into Help Scout straight away, as a new thread, and the coordinator
+remembers that thread by the recording's SID. When the transcription
+arrives, it's added to the text of that thread, which saves searching for
+the conversation again and leaves one thread per voicemail instead of two.
+
+Help Scout doesn't tell us the thread's id when the recording starts a new
+conversation, so then it's the customer thread with the recording's text,
+not just the newest one, which could be a text sent in the meantime.
+
+If the transcription takes longer than BLING_VOICEMAIL_MERGE_SECONDS, or
+arrives at a process that didn't handle the recording (e.g. another Lambda
+container), or the thread can't be found or updated, it goes into Help
+Scout as a message of its own, as it always used to.
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from bling.common import metrics
+from bling.common.lru import LRUCache
+from bling.config import config
+
+
+def recording_sid(recording_url: str) -> str:
+    """The SID at the end of a Twilio recording URL, e.g. RE123.mp3"""
+    return recording_url.rstrip("/").rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+@dataclass
+class PendingVoicemail:
+    conversation_id: int
+    # None for a new conversation, which Help Scout doesn't tell us, so the
+    # thread is found by its text
+    thread_id: Optional[int]
+    text: str
+    expires_at: float
+
+
+class VoicemailCoordinator:
+    def __init__(self, client, timeout: float, max_size: int = 1024):
+        self.client = client
+        self.timeout = timeout
+        self._pending = LRUCache(max_size)
+
+    def recorded(
+        self,
+        sid: str,
+        conversation_id: int,
+        thread_id: Optional[int],
+        text: str,
+    ):
+        """Remember the thread a recording went into"""
+        self._pending.put(
+            sid,
+            PendingVoicemail(
+                conversation_id, thread_id, text, time.monotonic() + self.timeout
+            ),
+        )
+
+    def claim(self, sid: str) -> Optional[PendingVoicemail]:
+        """The recording's thread, if it's still waiting for a transcription"""
+        pending = self._pending.pop(sid)
+        if pending is None or pending.expires_at < time.monotonic():
+            return None
+        return pending
+
+    def merge(self, sid: str, transcription: str) -> bool:
+        """
+        Add the transcription to the recording's thread. False if it has to
+        be posted separately instead.
+        """
+        pending = self.claim(sid)
+        if pending is None:
+            metrics.increment("voicemail_transcriptions_total", result="unmatched")
+            return False
+        try:
+            thread_id = pending.thread_id or self.client.customer_thread_id(
+                pending.conversation_id, pending.text
+            )
+            if thread_id is None:
+                metrics.increment("voicemail_transcriptions_total", result="no_thread")
+                return False
+            self.client.update_thread_text(
+                pending.conversation_id,
+                thread_id,
+                f"{pending.text}\n{transcription}",
+            )
+        except Exception:
+            logging.exception(
+                "Failed to add a transcription to conversation %s",
+                pending.conversation_id,
+            )
+            metrics.increment("voicemail_transcriptions_total", result="failed")
+            return False
+        metrics.increment("voicemail_transcriptions_total", result="merged")
+        return True
+
+
+_coordinator: Optional[VoicemailCoordinator] = None
+_coordinator_lock = threading.Lock()
+
+
+def coordinator() -> VoicemailCoordinator:
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            from bling.clients import helpscout_client
+
+            _coordinator = VoicemailCoordinator(
+                helpscout_client(), config.voicemail_merge_seconds
+            )
+    return _coordinator
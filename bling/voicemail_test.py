@@ -0,0 +1,82 @@
+import pytest
+
+from bling.bench.fakes import FakeHelpScout
+from bling.helpscout.client import HelpScoutClient
+from bling.voicemail import VoicemailCoordinator, recording_sid
+
+RECORDING = "https://api.twilio.com/2010-04-01/Accounts/AC1/Recordings/RE123"
+VOICEMAIL = f"Caller left a voicemail (5 seconds): {RECORDING}\n"
+
+
+@pytest.fixture
+def helpscout():
+    with FakeHelpScout() as fake:
+        yield fake
+
+
+@pytest.fixture
+def client(helpscout):
+    return HelpScoutClient(base_url=helpscout.url, client_id="id", secret="s")
+
+
+def test_recording_sid():
+    assert recording_sid(RECORDING) == "RE123"
+    assert recording_sid(RECORDING + ".mp3") == "RE123"
+
+
+def test_adds_transcription_to_the_voicemail_thread(helpscout, client):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=2)
+    thread = conversation.threads[1]
+    coordinator = VoicemailCoordinator(client, timeout=60)
+
+    coordinator.recorded("RE123", conversation.id, thread["id"], VOICEMAIL)
+    assert coordinator.merge("RE123", "Transcription: hello")
+
+    assert len(conversation.threads) == 2
+    assert thread["body"] == VOICEMAIL + "\nTranscription: hello"
+    # Only once
+    assert not coordinator.merge("RE123", "Transcription: hello")
+
+
+def test_finds_the_thread_in_a_new_conversation(helpscout, client):
+    conversation = helpscout.add_conversation(1, "a@example.com")
+    # However Help Scout formats the text we posted
+    conversation.threads.append(
+        helpscout._new_thread("customer", VOICEMAIL.replace("\n", "<br />"))
+    )
+    # The supporter texts before the transcription is ready
+    conversation.threads.append(helpscout._new_thread("customer", "Did you get it?"))
+    voicemail, text = conversation.threads
+    coordinator = VoicemailCoordinator(client, timeout=60)
+
+    coordinator.recorded("RE123", conversation.id, None, VOICEMAIL)
+    assert coordinator.merge("RE123", "Transcription: hello")
+    assert voicemail["body"] == VOICEMAIL + "\nTranscription: hello"
+    assert text["body"] == "Did you get it?"
+
+
+def test_posts_separately_when_the_thread_is_not_found(helpscout, client):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    coordinator = VoicemailCoordinator(client, timeout=60)
+
+    coordinator.recorded("RE123", conversation.id, None, VOICEMAIL)
+    assert not coordinator.merge("RE123", "Transcription: hello")
+    assert conversation.threads[0]["body"] == "Seeded message"
+
+
+def test_falls_back_when_unknown_or_too_late(helpscout, client):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    coordinator = VoicemailCoordinator(client, timeout=-1)
+
+    assert not coordinator.merge("RE999", "Transcription: hello")
+    coordinator.recorded("RE123", conversation.id, None, VOICEMAIL)
+    assert not coordinator.merge("RE123", "Transcription: hello")
+    assert conversation.threads[0]["body"] == "Seeded message"
+
+
+def test_falls_back_when_the_update_fails(helpscout, client):
+    conversation = helpscout.add_conversation(1, "a@example.com", threads=1)
+    coordinator = VoicemailCoordinator(client, timeout=60)
+
+    coordinator.recorded("RE123", conversation.id, 12345, VOICEMAIL)
+    assert not coordinator.merge("RE123", "Transcription: hello")
@@ -0,0 +1,127 @@
+"""
+Warm up a freshly started process so the first real webhook doesn't pay for
+OAuth, TLS handshakes, lazy imports and config parsing.
+
+Called from the scheduled event that keeps the Lambda container alive (see
+lambda_handler.py), and from the /bling/warmup route of the Flask app, which
+needs BLING_OPS_TOKEN since it calls Help Scout and Twilio.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from bling import clients
+from bling.config import config
+from bling.helpscout import mailboxes
+from bling.transport import MOBILECOMMONS_TRANSPORT_TYPE, TWILIO_TRANSPORT_TYPE
+
+# Don't redo the network steps more often than this, however often the
+# endpoint is hit
+MIN_INTERVAL_SECONDS = 60
+
+_lock = threading.Lock()
+_last_report: Dict[str, Any] = {}
+_last_run = 0.0
+
+
+def _mailboxes():
+    # Parses the mailbox config (and so every phone number in it)
+    mailboxes.registry.index
+
+
+def _transport_types():
+    return {mb.transport_type for mb in mailboxes.registry}
+
+
+def _helpscout():
+    # Building the shared client authenticates, which also opens the pooled
+    # TLS connection to the API host
+    clients.helpscout_client()
+
+
+def _twilio():
+    if TWILIO_TRANSPORT_TYPE not in _transport_types():
+        return
+    client = clients.twilio_client()
+    client.api.accounts(config.twilio_account_sid).fetch()
+
+
+def _mobilecommons():
+    if MOBILECOMMONS_TRANSPORT_TYPE not in _transport_types():
+        return
+    clients.mobilecommons_client()
+
+
+def _parsers():
+    # Import and exercise everything the webhook paths import lazily
+    from dateutil import parser as date_parser
+    from lxml import html
+
+    from bling.common.webhook_auth import helpscout_validator, twilio_validator
+    from bling.helpscout.events import peek_webhook
+    from bling.phone import Phone
+    from bling.sms_encoding import encode_sms
+    import bling.incoming  # noqa: F401
+    import bling.outgoing  # noqa: F401
+
+    date_parser.parse("2020-01-27T10:20:30Z")
+    html.document_fromstring("<p>warm</p>").text_content()
+    peek_webhook(b'{"type": "phone", "mailbox": {"id": 1}}')
+    Phone.parse("+16175550100")
+    encode_sms("Warming up")
+    helpscout_validator()
+    twilio_validator()
+
+
+STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("mailboxes", _mailboxes),
+    ("parsers", _parsers),
+    ("helpscout", _helpscout),
+    ("twilio", _twilio),
+    ("mobilecommons", _mobilecommons),
+]
+
+
+def warm_up(force: bool = False) -> Dict[str, Any]:
+    """
+    Run each warm-up step and report how long it took. A failing step is
+    logged and reported but doesn't stop the others.
+    """
+    global _last_report, _last_run
+
+    # Another warm-up is already making the network calls, so don't queue
+    # up behind it
+    if not _lock.acquire(blocking=False):
+        return dict(_last_report, cached=True)
+    try:
+        if not force and time.monotonic() - _last_run < MIN_INTERVAL_SECONDS:
+            return dict(_last_report, cached=True)
+
+        steps = {}
+        total_start = time.perf_counter()
+        for name, step in STEPS:
+            start = time.perf_counter()
+            try:
+                step()
+                status = "ok"
+            except Exception as e:
+                logging.exception("Warm-up step %s failed", name)
+                # The route isn't authenticated, so the details (which can
+                # include URLs and response bodies) only go to the log
+                status = f"error: {type(e).__name__}"
+            steps[name] = {
+                "ms": round((time.perf_counter() - start) * 1000, 1),
+                "status": status,
+            }
+
+        _last_run = time.monotonic()
+        _last_report = {
+            "steps": steps,
+            "total_ms": round((time.perf_counter() - total_start) * 1000, 1),
+        }
+        logging.info("Warmed up: %s", _last_report)
+        return dict(_last_report, cached=False)
+    finally:
+        _lock.release()
@@ -0,0 +1,53 @@
+from unittest.mock import patch
+
+from bling import warmup
+
+
+def test_warm_up_reports_each_step():
+    with patch("bling.clients.helpscout_client") as helpscout, patch(
+        "bling.clients.twilio_client"
+    ) as twilio:
+        report = warmup.warm_up(force=True)
+
+        assert helpscout.call_count == 1
+        assert twilio.return_value.api.accounts.return_value.fetch.call_count == 1
+
+    assert not report["cached"]
+    assert [name for name, _ in warmup.STEPS] == list(report["steps"])
+    for step in report["steps"].values():
+        assert step["status"] == "ok"
+        assert step["ms"] >= 0
+
+
+def test_warm_up_is_rate_limited():
+    with patch("bling.clients.helpscout_client") as helpscout, patch(
+        "bling.clients.twilio_client"
+    ):
+        first = warmup.warm_up(force=True)
+        second = warmup.warm_up()
+
+        assert helpscout.call_count == 1
+        assert second["cached"]
+        assert second["steps"] == first["steps"]
+
+
+def test_warm_up_doesnt_wait_for_a_running_one():
+    with patch("bling.clients.helpscout_client") as helpscout, patch(
+        "bling.clients.twilio_client"
+    ):
+        with warmup._lock:
+            report = warmup.warm_up(force=True)
+
+        assert helpscout.call_count == 0
+        assert report["cached"]
+
+
+def test_warm_up_reports_failures():
+    with patch("bling.clients.helpscout_client") as helpscout, patch(
+        "bling.clients.twilio_client"
+    ):
+        helpscout.side_effect = RuntimeError("https://api.example.com/?secret=x")
+        report = warmup.warm_up(force=True)
+
+    assert report["steps"]["helpscout"]["status"] == "error: RuntimeError"
+    assert report["steps"]["twilio"]["status"] == "ok"
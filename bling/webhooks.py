@@ -0,0 +1,248 @@
+"""
+The logic behind each webhook, independent of the web framework. The Flask
+blueprint in bling/api.py and the Lambda entry point in lambda_handler.py
+both decode and authenticate requests, then hand them to these functions.
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from bling import coalesce, deferred, media, voicemail
+from bling.clients import incoming_message_handler, twilio_transport
+from bling.common import logs, metrics
+from bling.common.resilience import CircuitOpenError, RateLimited
+from bling.config import config
+from bling.common.utils import nested_get
+from bling.helpscout import mailboxes
+from bling.helpscout.mailboxes import Mailbox
+from bling.helpscout.events import peek_webhook, router
+from bling.phone import Phone
+from bling.transport import IncomingMesage
+
+Response = Tuple[str, int]
+
+TWILIO_EMPTY_RESPONSE: Response = ("<Response></Response>", 200)
+HELPSCOUT_EMPTY_RESPONSE: Response = ("", 204)
+
+
+def format_twilio_sms(payload: Mapping[str, Any]) -> str:
+    body = payload.get("Body") or "(empty message)"
+
+    for i in range(int(payload.get("NumMedia", "0"))):
+        content_type = payload.get(f"MediaContentType{i}", "unknown type")
+        url = payload.get(f"MediaUrl{i}", "(missing URL)")
+
+        body += f"\nAttachment ({content_type}): {url}"
+
+    return body
+
+
+def handle_twilio_sms(data: Mapping[str, str]) -> Response:
+    """
+    Incoming SMSes from Twilio
+    """
+    to_phone_twilio = data["To"]
+    mailbox = mailboxes.registry.by_twilio_phone(to_phone_twilio)
+    if mailbox is None:
+        # This will happen if you create a new phone number in Twilio and point
+        # it to Bling, but don't configure Bling to handle that phone number.
+        logs.warning_limited(
+            "unknown_phone", "Bling got an SMS to an unknown phone: %s", to_phone_twilio
+        )
+        return TWILIO_EMPTY_RESPONSE
+
+    from_phone = Phone.parse(data["From"])
+    attachments = media.media_in(data) if config.forward_media else []
+
+    coalescer = coalesce.coalescer()
+    if coalescer is not None:
+        coalescer.add(mailbox, from_phone, format_twilio_sms(data), attachments)
+    else:
+        deliver_sms(mailbox, from_phone, format_twilio_sms(data), attachments)
+    return TWILIO_EMPTY_RESPONSE
+
+
+def post_sms(
+    mailbox: Mailbox,
+    from_phone: Phone,
+    body: str,
+    attachments: List[media.Media],
+    posted: Optional[Callable[[], None]] = None,
+) -> Tuple[Optional[int], Optional[int]]:
+    """Post one or more texts (see bling/coalesce.py) to Help Scout; see
+    IncomingHandler.handle_message for posted"""
+    handler = incoming_message_handler(twilio_transport())
+    conversation_id, thread_id = handler.handle_message(
+        IncomingMesage(mailbox=mailbox, from_phone=from_phone, body=body), posted
+    )
+
+    # The links in the message text work straight away; the attachments
+    # follow once they've been copied over, without holding up Twilio
+    if attachments and conversation_id:
+        media.submit(conversation_id, thread_id, attachments, body)
+    return conversation_id, thread_id
+
+
+def deliver_sms(
+    mailbox: Mailbox,
+    from_phone: Phone,
+    body: str,
+    attachments: List[media.Media],
+    posted: Optional[Callable[[], None]] = None,
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    post_sms, or if Help Scout is unavailable or rate limiting us, queue the
+    message to be posted later (see bling/deferred.py), in which case there
+    are no ids; see post_sms for posted
+    """
+    if not deferred.enabled():
+        return post_sms(mailbox, from_phone, body, attachments, posted)
+    queue = deferred.queue()
+    # Anything already queued goes first, to keep messages in order
+    if not len(queue):
+        try:
+            return post_sms(mailbox, from_phone, body, attachments, posted)
+        except CircuitOpenError as e:
+            if e.service != "helpscout":
+                raise
+        except RateLimited as e:
+            if e.service != "helpscout":
+                raise
+            queue.pause(e.retry_after)
+    defer_sms(mailbox, from_phone, body, attachments)
+    return None, None
+
+
+def defer_sms(
+    mailbox: Mailbox, from_phone: Phone, body: str, attachments: List[media.Media]
+):
+    """Queue a message to be posted later, see bling/deferred.py"""
+    deferred.queue().put(
+        deferred.DeferredMessage(
+            mailbox_id=mailbox.id,
+            from_phone=from_phone.twilio_format,
+            body=body,
+            media=[{"url": m.url, "content_type": m.content_type} for m in attachments],
+        )
+    )
+
+
+def handle_twilio_voicemail(data: Mapping[str, str]) -> Response:
+    """
+    Incoming voicemail from Twilio
+    """
+    to_phone_twilio = data["to"]
+    mailbox = mailboxes.registry.by_twilio_phone(to_phone_twilio)
+    if mailbox is None:
+        logs.warning_limited(
+            "unknown_phone",
+            "Bling got a voicemail to an unknown phone: %s",
+            to_phone_twilio,
+        )
+        return TWILIO_EMPTY_RESPONSE
+
+    from_phone = Phone.parse(data["from"])
+
+    length = int(data.get("length") or 0)
+
+    body = f"Caller left a voicemail ({length} seconds): {data['recording']}\n"
+
+    conversation_id, thread_id = deliver_sms(mailbox, from_phone, body, [])
+
+    # So the transcription can go in the same thread
+    if conversation_id:
+        voicemail.coordinator().recorded(
+            voicemail.recording_sid(data["recording"]), conversation_id, thread_id, body
+        )
+    return TWILIO_EMPTY_RESPONSE
+
+
+def handle_twilio_transcription(data: Mapping[str, str]) -> Response:
+    """
+    Incoming transcriptions from Twilio
+    """
+    to_phone_twilio = data["To"]
+    mailbox = mailboxes.registry.by_twilio_phone(to_phone_twilio)
+    if mailbox is None:
+        logs.warning_limited(
+            "unknown_phone",
+            "Bling got a transcription to an unknown phone: %s",
+            to_phone_twilio,
+        )
+        return TWILIO_EMPTY_RESPONSE
+
+    from_phone = Phone.parse(data["From"])
+
+    status = data["TranscriptionStatus"]
+    if status == "failed":
+        addition = "Transcription failed, please listen to the recording."
+    else:
+        addition = f"Transcription: {data['TranscriptionText']}"
+    sid = data.get("RecordingSid") or voicemail.recording_sid(data["RecordingUrl"])
+    if voicemail.coordinator().merge(sid, addition):
+        return TWILIO_EMPTY_RESPONSE
+
+    if status == "failed":
+        body = f"Voicemail transcription failed, please listen to the recording: {data['RecordingUrl']}"
+    else:
+        body = f"Voicemail transcription: {data['TranscriptionText']}\n\nRecording: {data['RecordingUrl']}"
+
+    deliver_sms(mailbox, from_phone, body, [])
+    return TWILIO_EMPTY_RESPONSE
+
+
+def handle_helpscout_webhook(raw: bytes, event_type: str) -> Response:
+    """
+    Help Scout webhooks
+    See: https://developer.helpscout.com/webhooks/
+    """
+    if not event_type:
+        return "Bad request: missing event header", 400
+
+    event_type = event_type.strip()
+    subscription = router.subscription_for(event_type)
+    if subscription is None:
+        metrics.increment("helpscout_webhook_events_total", event="unsubscribed")
+        logging.debug("No handler for webhook event %s", event_type)
+        return HELPSCOUT_EMPTY_RESPONSE
+
+    # Help Scout sends us webhooks for every mailbox in the account, so
+    # throw away the ones that aren't ours before parsing the whole body
+    with metrics.timer("helpscout_webhook_prefilter_seconds"):
+        peek = peek_webhook(raw)
+    if peek is None:
+        metrics.increment("helpscout_webhook_prefilter_total", result="unscannable")
+    elif mailboxes.registry.by_id(peek.mailbox_id) is None:
+        metrics.increment("helpscout_webhook_prefilter_total", result="other_mailbox")
+        metrics.increment("helpscout_webhook_prefilter_skipped_bytes", len(raw))
+        logging.debug("Dropped webhook for mailbox %s", peek.mailbox_id)
+        return HELPSCOUT_EMPTY_RESPONSE
+    elif subscription.phone_only and peek.type != "phone":
+        metrics.increment("helpscout_webhook_prefilter_total", result="not_phone")
+        metrics.increment("helpscout_webhook_prefilter_skipped_bytes", len(raw))
+        logging.debug("Dropped %s webhook for mailbox %s", peek.type, peek.mailbox_id)
+        return HELPSCOUT_EMPTY_RESPONSE
+    else:
+        metrics.increment("helpscout_webhook_prefilter_total", result="passed")
+
+    # Timing the full parse of the webhooks that get through tells us how
+    # much time the prefilter saved on the ones it dropped
+    with metrics.timer("helpscout_webhook_parse_seconds"):
+        try:
+            data: Dict[str, Any] = json.loads(raw)
+        except ValueError:
+            return "Bad request: body isn't JSON", 400
+    if not isinstance(data, dict):
+        return "Bad request: body isn't a JSON object", 400
+    mailbox_id = nested_get(data, "mailbox", "id") or data.get("mailboxId")
+
+    logging.info(
+        "Received webhook with event_type %s, mailbox: %s", event_type, mailbox_id
+    )
+
+    mailbox = mailboxes.registry.by_id(mailbox_id)
+    if mailbox:
+        router.dispatch(subscription, mailbox, data)
+
+    return HELPSCOUT_EMPTY_RESPONSE
@@ -1,4 +1,13 @@
-from bling.api import format_twilio_sms
+import pytest
+
+from bling.helpscout import mailboxes
+from bling.helpscout.mailboxes import Mailbox
+from bling.phone import Phone
+from bling.webhooks import format_twilio_sms, handle_helpscout_webhook
+
+MAILBOX = Mailbox(
+    transport_type="twilio", phone=Phone.parse("+16175550100"), id=1, mc_campaign_id=""
+)
 
 
 def test_format_twilio_sms():
@@ -30,3 +39,17 @@ def test_format_twilio_sms():
         )
         == "foo\nAttachment (text/plain): http://example.com/0\nAttachment (unknown type): http://example.com/1\nAttachment (unknown type): (missing URL)"
     )
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b'{"type": "phone", "mailbox": {"id": 1}, "id": 1',
+        b"[1, 2]",
+        b'"reply"',
+        b"\xff",
+    ],
+)
+def test_helpscout_webhook_bad_body(monkeypatch, body):
+    monkeypatch.setattr(mailboxes.registry, "by_id", lambda mailbox_id: MAILBOX)
+    assert handle_helpscout_webhook(body, "convo.agent.reply.created")[1] == 400
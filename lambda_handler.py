@@ -0,0 +1,199 @@
+"""
+Lambda entry point for the webhook routes that skips serverless-wsgi, Flask
+and Flask-CORS. API Gateway events are decoded and authenticated here and
+handed straight to bling.webhooks.
+
+app.py is still the entry point for local development and for everything
+else (see serverless.example.yml).
+"""
+
+import base64
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import parse_qs, urlencode
+
+from bling import media, webhooks
+from bling.common import logs, metrics, profiler
+from bling.warmup import warm_up
+from bling.common.webhook_auth import (
+    helpscout_replay_cache,
+    helpscout_validator,
+    ops_authorized,
+    twilio_replay_cache,
+    twilio_validator,
+)
+
+# Body, status and Content-Type
+Response = Tuple[str, int, str]
+
+TEXT = "text/plain"
+JSON = "application/json"
+TWIML = "text/xml"
+
+
+class Request:
+    """The parts of an API Gateway (REST or HTTP API) proxy event we use"""
+
+    def __init__(self, event: Dict[str, Any]):
+        context = event.get("requestContext") or {}
+        http = context.get("http") or {}
+
+        self.method = event.get("httpMethod") or http.get("method") or "GET"
+        self.headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+
+        body = event.get("body") or ""
+        self.body = (
+            base64.b64decode(body)
+            if event.get("isBase64Encoded")
+            else body.encode("utf-8")
+        )
+
+        # The route, without the stage prefix HTTP APIs leave on rawPath
+        path = event.get("path") or event.get("rawPath") or "/"
+        stage = context.get("stage")
+        if stage and stage != "$default" and path.startswith(f"/{stage}/"):
+            path = path[len(stage) + 1 :]
+        self.path = path
+
+        # The URL as the caller saw it (including the stage), which is what
+        # Twilio signs. REST APIs only give us the decoded parameters, so the
+        # query is encoded again the way serverless-wsgi does, keeping
+        # repeated parameters and their order.
+        if "rawQueryString" in event:
+            query = event["rawQueryString"]
+        elif event.get("multiValueQueryStringParameters"):
+            query = urlencode(event["multiValueQueryStringParameters"], doseq=True)
+        else:
+            query = urlencode(event.get("queryStringParameters") or {})
+        scheme = self.headers.get("x-forwarded-proto", "https")
+        host = self.headers.get("host", "")
+        self.url = (
+            f"{scheme}://{host}{context.get('path') or event.get('rawPath') or path}"
+        )
+        if query:
+            self.url += f"?{query}"
+
+    def header(self, name: str) -> Optional[str]:
+        return self.headers.get(name.lower())
+
+    @property
+    def form_lists(self) -> Dict[str, List[str]]:
+        """Every value of each form field, which is what Twilio signs"""
+        return parse_qs(self.body.decode("utf-8"), keep_blank_values=True)
+
+    @property
+    def form(self) -> Dict[str, str]:
+        """The first value of each form field, like Flask's request.form"""
+        return {k: v[0] for k, v in self.form_lists.items()}
+
+
+def _twilio_route(handle: Callable[[Mapping[str, str]], webhooks.Response]):
+    def route(request: Request) -> Response:
+        form = request.form
+        signature = request.header("X-Twilio-Signature") or ""
+        if not twilio_validator().validate(request.url, request.form_lists, signature):
+            logs.warning_limited(
+                "invalid_twilio_signature",
+                "Invalid Twilio signature :: %s",
+                request.url,
+            )
+            return "Forbidden", 403, TEXT
+        body, status = twilio_replay_cache.run_once(
+            signature, lambda: handle(form), duplicate=webhooks.TWILIO_EMPTY_RESPONSE
+        )
+        return body, status, TWIML
+
+    return route
+
+
+def _helpscout_route(request: Request) -> Response:
+    signature = request.header("X-HelpScout-Signature")
+    if not helpscout_validator().validate(request.body, signature):
+        return "Unauthorized: Failed Help Scout signature verification", 401, TEXT
+
+    event_type = request.header("X-HelpScout-Event")
+    body, status = helpscout_replay_cache.run_once(
+        f"{event_type}:{signature}",
+        lambda: webhooks.handle_helpscout_webhook(request.body, event_type),
+        duplicate=webhooks.HELPSCOUT_EMPTY_RESPONSE,
+    )
+    return body, status, TEXT
+
+
+def _hello(request: Request) -> Response:
+    return "Hello from Bling!", 200, TEXT
+
+
+def _metrics(request: Request) -> Response:
+    if not ops_authorized(request.header("Authorization")):
+        return "Unauthorized", 401, TEXT
+    return metrics.render_prometheus(), 200, metrics.CONTENT_TYPE
+
+
+ROUTES: Dict[Tuple[str, str], Callable[[Request], Response]] = {
+    ("GET", "/bling/"): _hello,
+    ("GET", "/bling/metrics"): _metrics,
+    ("POST", "/bling/twilio_sms"): _twilio_route(webhooks.handle_twilio_sms),
+    ("POST", "/bling/twilio_voicemail"): _twilio_route(
+        webhooks.handle_twilio_voicemail
+    ),
+    ("POST", "/bling/twilio_transcription"): _twilio_route(
+        webhooks.handle_twilio_transcription
+    ),
+    ("POST", "/bling/helpscout_webhook"): _helpscout_route,
+}
+
+
+def _quietly(f: Callable[..., Any], *args: Any):
+    """Bookkeeping after a route, which mustn't change its response: Twilio
+    would retry a webhook we've handled if the invocation failed"""
+    try:
+        f(*args)
+    except Exception:
+        logging.exception("Error in %s", getattr(f, "__name__", f))
+
+
+def handler(event: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+    # The schedule that keeps the container alive also warms it up
+    if event.get("source") == "aws.events":
+        return warm_up()
+    # MMS media handed off by an earlier invocation, see bling/media.py
+    if event.get("source") == media.ASYNC_SOURCE:
+        media.handle_async(event)
+        return {}
+
+    start = time.perf_counter()
+    request = Request(event)
+    route = ROUTES.get((request.method, request.path))
+    if route is None:
+        body, status, content_type = "Not found", 404, TEXT
+    else:
+        running = profiler.start_if_requested(
+            request.path, request.header(profiler.PROFILE_HEADER)
+        )
+        try:
+            body, status, content_type = route(request)
+        except Exception:
+            logging.exception("Error handling %s %s", request.method, request.path)
+            body = json.dumps({"message": "Server error"})
+            status, content_type = 500, JSON
+        finally:
+            if running is not None:
+                _quietly(profiler.finish, running, request.path)
+
+    _quietly(
+        metrics.record_request,
+        # Don't make a new series for every path someone probes us with
+        request.path if route else "unmatched",
+        status,
+        time.perf_counter() - start,
+        len(request.body),
+    )
+
+    return {
+        "statusCode": status,
+        "headers": {"Content-Type": content_type},
+        "body": body,
+    }
@@ -0,0 +1,209 @@
+import base64
+from unittest.mock import patch
+
+import pytest
+
+import lambda_handler
+from bling.common import webhook_auth
+from bling.common.webhook_auth import (
+    HelpScoutSignatureValidator,
+    TwilioSignatureValidator,
+)
+from bling.config import config
+
+SMS = {
+    "From": "+15558889999",
+    "To": "+16173973198",
+    "Body": "hi",
+    "MessageSid": "SM123",
+}
+
+
+@pytest.fixture(autouse=True)
+def validators(monkeypatch):
+    monkeypatch.setattr(
+        webhook_auth, "_twilio_validator", TwilioSignatureValidator(["token"])
+    )
+    monkeypatch.setattr(
+        webhook_auth, "_helpscout_validator", HelpScoutSignatureValidator(["secret"])
+    )
+    webhook_auth.twilio_replay_cache.clear()
+    webhook_auth.helpscout_replay_cache.clear()
+
+
+def _twilio_event(params, signature=None):
+    body = "&".join(f"{k}={v}".replace("+", "%2B") for k, v in params.items())
+    url = "https://abc.execute-api.us-east-1.amazonaws.com/dev/bling/twilio_sms"
+    return {
+        "httpMethod": "POST",
+        "path": "/bling/twilio_sms",
+        "headers": {
+            "Host": "abc.execute-api.us-east-1.amazonaws.com",
+            "X-Forwarded-Proto": "https",
+            "X-Twilio-Signature": signature
+            or webhook_auth.twilio_validator().sign(url, params),
+        },
+        "requestContext": {"path": "/dev/bling/twilio_sms", "stage": "dev"},
+        "isBase64Encoded": True,
+        "body": base64.b64encode(body.encode()).decode(),
+    }
+
+
+def test_twilio_sms():
+    with patch("bling.webhooks.incoming_message_handler") as handler, patch(
+        "bling.webhooks.twilio_transport"
+    ):
+        handler.return_value.handle_message.return_value = (123, 456)
+        response = lambda_handler.handler(_twilio_event(SMS))
+        assert response == {
+            "statusCode": 200,
+            "headers": {"Content-Type": "text/xml"},
+            "body": "<Response></Response>",
+        }
+        message = handler.return_value.handle_message.call_args[0][0]
+        assert message.body == "hi"
+        assert message.from_phone.twilio_format == "+15558889999"
+
+        # replays are acknowledged without doing any work
+        assert lambda_handler.handler(_twilio_event(SMS))["statusCode"] == 200
+        assert handler.return_value.handle_message.call_count == 1
+
+
+def test_twilio_bad_signature():
+    with patch("bling.webhooks.incoming_message_handler") as handler:
+        response = lambda_handler.handler(_twilio_event(SMS, signature="abc="))
+        assert response["statusCode"] == 403
+        assert response["headers"]["Content-Type"] == "text/plain"
+        assert handler.call_count == 0
+
+
+def test_twilio_repeated_fields_and_query():
+    params = {**SMS, "Tag": ["b", "a"]}
+    url = (
+        "https://abc.execute-api.us-east-1.amazonaws.com/dev/bling/twilio_sms"
+        "?mailbox=1&mailbox=2&note=a+b"
+    )
+    event = _twilio_event(SMS)
+    event["body"] = base64.b64encode(
+        base64.b64decode(event["body"]) + b"&Tag=b&Tag=a"
+    ).decode()
+    event["multiValueQueryStringParameters"] = {"mailbox": ["1", "2"], "note": ["a b"]}
+    event["queryStringParameters"] = {"mailbox": "2", "note": "a b"}
+    event["headers"]["X-Twilio-Signature"] = webhook_auth.twilio_validator().sign(
+        url, params
+    )
+
+    request = lambda_handler.Request(event)
+    assert request.url == url
+    assert request.form_lists["Tag"] == ["b", "a"]
+    assert request.form["Tag"] == "b"
+
+    with patch("bling.webhooks.incoming_message_handler") as handler, patch(
+        "bling.webhooks.twilio_transport"
+    ):
+        handler.return_value.handle_message.return_value = (123, 456)
+        assert lambda_handler.handler(event)["statusCode"] == 200
+        assert handler.return_value.handle_message.call_count == 1
+
+
+def test_bookkeeping_errors_dont_change_the_response():
+    with patch("bling.webhooks.incoming_message_handler") as handler, patch(
+        "bling.webhooks.twilio_transport"
+    ), patch("lambda_handler.metrics.record_request", side_effect=RuntimeError):
+        handler.return_value.handle_message.return_value = (123, 456)
+        response = lambda_handler.handler(_twilio_event(SMS))
+        assert response["statusCode"] == 200
+        assert response["body"] == "<Response></Response>"
+
+
+def test_helpscout_http_api_event():
+    body = b'{"type": "phone", "mailbox": {"id": 1}, "id": 1}'
+    event = {
+        "rawPath": "/dev/bling/helpscout_webhook",
+        "rawQueryString": "",
+        "headers": {
+            "x-helpscout-event": "convo.agent.reply.created",
+            "x-helpscout-signature": HelpScoutSignatureValidator(["secret"]).sign(body),
+        },
+        "requestContext": {"http": {"method": "POST"}, "stage": "dev"},
+        "body": body.decode(),
+    }
+    with patch("bling.helpscout.events.outgoing_reply_handler") as handler:
+        assert lambda_handler.handler(event)["statusCode"] == 204
+        # mailbox 1 isn't one of ours
+        assert handler.call_count == 0
+
+    event["headers"]["x-helpscout-signature"] = "abc="
+    assert lambda_handler.handler(event)["statusCode"] == 401
+
+
+def test_not_found():
+    assert (
+        lambda_handler.handler({"httpMethod": "GET", "path": "/nope"})["statusCode"]
+        == 404
+    )
+
+
+def test_server_error():
+    with patch("bling.webhooks.incoming_message_handler") as handler, patch(
+        "bling.webhooks.twilio_transport"
+    ):
+        handler.return_value.handle_message.side_effect = RuntimeError("boom")
+        response = lambda_handler.handler(_twilio_event(SMS))
+        assert response["statusCode"] == 500
+        assert response["headers"]["Content-Type"] == "application/json"
+
+        # the failed request can be retried
+        handler.return_value.handle_message.side_effect = None
+        handler.return_value.handle_message.return_value = (123, 456)
+        assert lambda_handler.handler(_twilio_event(SMS))["statusCode"] == 200
+
+
+def test_scheduled_event_warms_up():
+    with patch("lambda_handler.warm_up") as warm_up:
+        warm_up.return_value = {"steps": {}}
+        assert lambda_handler.handler({"source": "aws.events"}) == {"steps": {}}
+        assert warm_up.call_count == 1
+
+
+def test_metrics_route(monkeypatch):
+    monkeypatch.setitem(config.__dict__, "ops_token", "ops-secret")
+    lambda_handler.handler({"httpMethod": "GET", "path": "/bling/"})
+    lambda_handler.handler({"httpMethod": "GET", "path": "/wp-login.php"})
+    response = lambda_handler.handler(
+        {
+            "httpMethod": "GET",
+            "path": "/bling/metrics",
+            "headers": {"Authorization": "Bearer ops-secret"},
+        }
+    )
+
+    assert response["statusCode"] == 200
+    assert response["headers"]["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'bling_requests_total{route="/bling/",status="200"}' in response["body"]
+    assert 'route="unmatched",status="404"' in response["body"]
+    assert "wp-login" not in response["body"]
+
+
+@pytest.mark.parametrize("token", [None, "ops-secret"])
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", "ops-secret"])
+def test_metrics_route_needs_the_ops_token(monkeypatch, token, authorization):
+    monkeypatch.setitem(config.__dict__, "ops_token", token)
+    headers = {"Authorization": authorization} if authorization else {}
+    response = lambda_handler.handler(
+        {"httpMethod": "GET", "path": "/bling/metrics", "headers": headers}
+    )
+    assert response["statusCode"] == 401
+    assert "bling_requests_total" not in response["body"]
+
+
+def test_no_warmup_route():
+    response = lambda_handler.handler({"httpMethod": "GET", "path": "/bling/warmup"})
+    assert response["statusCode"] == 404
+
+
+def test_media_event_attaches_media():
+    event = {"source": "bling.media", "conversation_id": 1, "thread_id": 2, "media": []}
+    with patch("bling.media.handle_async") as handle_async:
+        assert lambda_handler.handler(event) == {}
+        handle_async.assert_called_once_with(event)